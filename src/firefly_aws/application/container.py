@@ -47,7 +47,13 @@ class Container(di.Container):
     mutex: infra.DdbMutex = infra.DdbMutex
     rate_limiter: infra.DdbRateLimiter = infra.DdbRateLimiter
     file_system: ff.FileSystem = infra.S3FileSystem
+    rest_router: ff.RestRouter = infra.TrieRestRouter
     resource_monitor: domain.ResourceMonitor = infra.DdbResourceMonitor
+    boot_profiler: domain.BootProfiler = lambda self: domain.boot_profiler
+    outbox: domain.Outbox = infra.BotoOutbox
+    retry_policy: infra.RetryPolicy = infra.RetryPolicy
+    json_codec: domain.JsonCodec = lambda self: infra.OrjsonCodec() if infra.OrjsonCodec.available() \
+        else infra.StdlibJsonCodec()
 
 
 if os.environ['FF_ENVIRONMENT'] != 'local':
@@ -55,3 +61,4 @@ if os.environ['FF_ENVIRONMENT'] != 'local':
     Container.__annotations__['message_transport'] = ff.MessageTransport
 
 del RootContainer.file_system
+del RootContainer.rest_router
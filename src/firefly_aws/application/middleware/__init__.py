@@ -1,5 +1,7 @@
 import os
 
+from .response_caching_middleware import ResponseCachingMiddleware
+
 
 if os.environ.get('ADAPTIVE_MEMORY'):
     from .adaptive_memory_routing_middleware import AdaptiveMemoryRoutingMiddleware
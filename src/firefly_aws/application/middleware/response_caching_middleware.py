@@ -0,0 +1,58 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from typing import Callable, List, Optional
+
+import firefly as ff
+import firefly.application as ffa
+
+from ...domain.service.response_cache import ResponseCache
+
+
+def _after_authorization(bus: str, middleware: List[ff.Middleware]):
+    # Cached responses must only be served to callers that passed authentication and authorization.
+    for i, m in enumerate(middleware):
+        if isinstance(m, ffa.AuthorizingMiddleware):
+            return i + 1
+    return 0
+
+
+@ff.register_middleware(buses=['query', 'event'], cb=_after_authorization)
+class ResponseCachingMiddleware(ff.Middleware, ff.LoggerAware):
+    _response_cache: ResponseCache = None
+
+    def __call__(self, message: ff.Message, next_: Callable) -> Optional[ff.Message]:
+        if isinstance(message, ff.Event):
+            try:
+                return next_(message)
+            finally:
+                self._response_cache.invalidate(str(message))
+
+        if not isinstance(message, ff.Query) or self._response_cache.policy(str(message)) is None:
+            return next_(message)
+
+        # The key is taken once, before the handler runs: an invalidation while it runs must not let its (possibly
+        # stale) result be stored under the new generation.
+        key = self._response_cache.key(message)
+        hit, response = self._response_cache.get(key)
+        if hit:
+            self.debug('Serving %s from the response cache', message)
+            return response
+
+        response = next_(message)
+        self._response_cache.set(key, message, response)
+
+        return response
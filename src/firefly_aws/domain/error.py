@@ -27,3 +27,7 @@ class DocumentTooLarge(FireflyAwsError):
 
 class LambdaTimedOut(FireflyAwsError):
     pass
+
+
+class CircuitOpen(FireflyAwsError):
+    pass
@@ -18,6 +18,16 @@ class ResourceNameAware(ABC):
     def _stream_resource_name(self, context: str):
         return f'{self._service_name(context)}Stream'
 
+    def _event_stream_name(self, context: str):
+        return f'{self._service_name(context)}EventStream'
+
+    def _event_stream_arn(self, context: str):
+        return f'arn:aws:kinesis:{self._region}:{self._account_id}:stream/{self._event_stream_name(context)}'
+
+    def _event_stream_mapping_name(self, consumer_context: str, stream_context: str):
+        slug = f'{self._project}_{self._ff_environment}_{consumer_context}_{stream_context}'
+        return f'{inflection.camelize(inflection.underscore(slug))}EventStreamMapping'
+
     def _analytics_application_resource_name(self, context: str):
         return f'{self._service_name(context)}AnalyticsStream'
 
@@ -13,14 +13,27 @@
 #  <http://www.gnu.org/licenses/>.
 
 from .requeue_message import RequeueMessage
+from .boot_profiler import BootProfiler, boot_profiler
+from .access_log import AccessLog, Truncated
 from .ddb_serializer import DdbDeserializer
+from .deadline import Deadline
 from .execution_context import ExecutionContext
+from .fan_out import FanOut
 from .find_outlier_threshold import FindOutlierThreshold
 from .handle_error import HandleError
+from .isolate_kernel_state import IsolateKernelState
+from .json_codec import JsonCodec
 from .jwt_decoder import JwtDecoder
 from .lambda_executor import LambdaExecutor
-from .load_payload import LoadPayload
+from .load_payload import LoadPayload, PrefetchedPayloads
+from .outbox import Outbox
+from .parse_multipart import Base64Reader, ParseMultipart, UploadedFile
 from .prepare_s3_download import PrepareS3Download
+from .reset_kernel import ResetKernel
 from .resource_monitor import *
+from .response_cache import ResponseCache
+from .response_compressor import ResponseCompressor
+from .route_index import IndexedRoute, RouteIndex
 from .s3_service import S3Service
 from .store_large_payloads_in_s3 import StoreLargePayloadsInS3
+from .warm_up import WarmUp, WARMER_KEY
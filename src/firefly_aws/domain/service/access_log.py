@@ -0,0 +1,119 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import logging
+import random
+from time import perf_counter
+from typing import Any, Optional
+
+import firefly as ff
+
+import firefly_aws.domain as domain
+
+PAYLOAD_LOG_MAX_LENGTH = 2048
+
+
+class Truncated:
+    """
+    Log argument that renders data cut down to max_length characters. Rendering happens in __str__, so nothing is
+    formatted unless the record is actually emitted.
+    """
+    __slots__ = ('_data', '_max_length')
+
+    def __init__(self, data: Any, max_length: int = PAYLOAD_LOG_MAX_LENGTH):
+        self._data = data
+        self._max_length = max_length
+
+    def __str__(self):
+        data = self._data
+        if isinstance(data, (bytes, bytearray)):
+            truncated = len(data) > self._max_length
+            data = bytes(data[:self._max_length]).decode('utf-8', errors='ignore')
+        else:
+            if not isinstance(data, str):
+                data = str(data)
+            truncated = len(data) > self._max_length
+            data = data[:self._max_length]
+
+        return f'{data}... [truncated]' if truncated else data
+
+
+class AccessLog(ff.DomainService):
+    """
+    Emits one structured record per invocation (route, message, status, latency, request/response sizes, cold start)
+    and, for a sampled share of invocations, truncated request/response payloads at debug level.
+
+    Configured in the firefly_aws context: access_log (default true), payload_log_sample_rate (0-1, default 1) and
+    payload_log_max_length (default 2048).
+    """
+    _configuration: ff.Configuration = None
+    _execution_context: domain.ExecutionContext = None
+    _json_codec: domain.JsonCodec = None
+
+    def start(self, request_id: Optional[str] = None, cold_start: bool = False) -> dict:
+        config = self._configuration.contexts['firefly_aws']
+        rate = float(config.get('payload_log_sample_rate', 1.0))
+        record = {
+            'event_type': 'access-log',
+            'request_id': request_id,
+            'cold_start': cold_start,
+            '_start': perf_counter(),
+            '_sampled': rate >= 1.0 or (rate > 0.0 and random.random() < rate),
+        }
+        self._execution_context.access_record = record
+
+        return record
+
+    def annotate(self, **fields):
+        record = self._execution_context.access_record
+        if record is not None:
+            record.update(fields)
+
+    def finish(self, response: Any = None, **fields):
+        record = self._execution_context.access_record
+        if record is None:
+            return
+        self._execution_context.access_record = None
+
+        record.update(fields)
+        record['latency_ms'] = round((perf_counter() - record.pop('_start')) * 1000, 3)
+        del record['_sampled']
+        if isinstance(response, dict):
+            if 'statusCode' in response:
+                record.setdefault('status', response['statusCode'])
+            if isinstance(response.get('body'), str):
+                record.setdefault('response_bytes', len(response['body']))
+
+        if self._configuration.contexts['firefly_aws'].get('access_log', True) is False or \
+                not self._is_enabled(logging.INFO):
+            return
+
+        self.info('%s', self._json_codec.encode(record).decode('utf-8'))
+
+    def payload(self, label: str, data: Any):
+        record = self._execution_context.access_record
+        if record is not None and record.get('_sampled') is False:
+            return
+        if not self._is_enabled(logging.DEBUG):
+            return
+
+        max_length = int(
+            self._configuration.contexts['firefly_aws'].get('payload_log_max_length', PAYLOAD_LOG_MAX_LENGTH)
+        )
+        self.debug('%s: %s', label, Truncated(data, max_length))
+
+    def _is_enabled(self, level: int):
+        return self._logger.get_level() <= level
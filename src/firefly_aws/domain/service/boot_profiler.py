@@ -0,0 +1,209 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import inspect
+import json
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from time import perf_counter, time
+from typing import Optional
+
+import psutil
+
+ENABLED = ('1', 'true', 'yes', 'on')
+
+
+class _TimedImportFinder:
+    def __init__(self, profiler: BootProfiler):
+        self._profiler = profiler
+        self._local = threading.local()
+
+    def find_spec(self, fullname: str, path=None, target=None):
+        if getattr(self._local, 'searching', False):
+            return None
+
+        self._local.searching = True
+        try:
+            for finder in sys.meta_path:
+                if finder is self or not hasattr(finder, 'find_spec'):
+                    continue
+                spec = finder.find_spec(fullname, path, target)
+                if spec is not None:
+                    self._wrap_loader(spec)
+                    return spec
+        finally:
+            self._local.searching = False
+
+    def _wrap_loader(self, spec):
+        loader = spec.loader
+        if loader is None or inspect.isclass(loader) or not hasattr(loader, 'exec_module'):
+            return
+
+        # Loaders are shared between modules (one per path entry, zip file...), so they're never modified; each
+        # spec gets its own wrapper.
+        spec.loader = _TimedLoader(loader, self._profiler, spec.name)
+
+
+class _TimedLoader:
+    def __init__(self, loader, profiler: BootProfiler, name: str):
+        self._loader = loader
+        self._profiler = profiler
+        self._name = name
+
+    def create_module(self, spec):
+        create_module = getattr(self._loader, 'create_module', None)
+        return create_module(spec) if create_module is not None else None
+
+    def exec_module(self, module):
+        with self._profiler.span('import', self._name):
+            return self._loader.exec_module(module)
+
+    def __getattr__(self, name: str):
+        # get_source, get_resource_reader, is_package... are the wrapped loader's.
+        return getattr(self._loader, name)
+
+
+class BootProfiler:
+    """
+    Records a timeline of where cold-start time goes: module imports, DI resolutions, kernel boot and boto3 client
+    creation. Enabled with FF_BOOT_PROFILE=1. When FF_BOOT_PROFILE_FILE is set, the timeline is also written there as
+    JSON. Import and DI spans include the time spent in nested imports/resolutions.
+    """
+
+    def __init__(self, enabled: bool = None, file_name: str = None):
+        if enabled is None:
+            enabled = os.environ.get('FF_BOOT_PROFILE', '').lower() in ENABLED
+        self.enabled = enabled
+        self._file_name = file_name or os.environ.get('FF_BOOT_PROFILE_FILE')
+        self._origin = perf_counter()
+        self._since_process_start = self._seconds_since_process_start()
+        self._spans = []
+        self._lock = threading.Lock()
+        self._installed = False
+        self._finished = False
+
+    @contextmanager
+    def span(self, phase: str, name: str):
+        if not self.enabled or self._finished:
+            yield
+            return
+
+        start = perf_counter()
+        try:
+            yield
+        finally:
+            self._record(phase, name, start, perf_counter())
+
+    def install(self):
+        if self._installed or not self.enabled:
+            return
+        self._installed = True
+
+        sys.meta_path.insert(0, _TimedImportFinder(self))
+        self._wrap_kernel_boot()
+        self._wrap_container_build()
+        self._wrap_boto3()
+
+    def finish(self) -> Optional[dict]:
+        if not self.enabled or self._finished:
+            return None
+
+        timeline = self.report()
+        self._finished = True
+
+        if self._file_name is not None:
+            with open(self._file_name, 'w') as fp:
+                json.dump(timeline, fp)
+
+        return timeline
+
+    def report(self) -> dict:
+        with self._lock:
+            spans = list(self._spans)
+
+        totals = {}
+        for span in spans:
+            totals[span['phase']] = totals.get(span['phase'], 0.0) + span['duration_ms']
+
+        return {
+            'event_type': 'boot-timeline',
+            'before_profiler_ms': round(self._since_process_start * 1000, 3),
+            'total_ms': round((perf_counter() - self._origin) * 1000, 3),
+            'totals_ms': {k: round(v, 3) for k, v in totals.items()},
+            'spans': spans,
+        }
+
+    def _record(self, phase: str, name: str, start: float, end: float):
+        with self._lock:
+            self._spans.append({
+                'phase': phase,
+                'name': name,
+                'start_ms': round((start - self._origin) * 1000, 3),
+                'duration_ms': round((end - start) * 1000, 3),
+            })
+
+    def _wrap_kernel_boot(self):
+        import firefly as ff
+
+        boot = ff.Kernel.boot
+        profiler = self
+
+        def timed_boot(kernel, *args, **kwargs):
+            with profiler.span('kernel', 'boot'):
+                return boot(kernel, *args, **kwargs)
+
+        ff.Kernel.boot = timed_boot
+
+    def _wrap_container_build(self):
+        import firefly_di as di
+
+        build = di.Container.build
+        profiler = self
+
+        def timed_build(container, class_, **kwargs):
+            with profiler.span('di', getattr(class_, '__name__', str(class_))):
+                return build(container, class_, **kwargs)
+
+        di.Container.build = timed_build
+
+    def _wrap_boto3(self):
+        import boto3
+
+        for name in ('client', 'resource'):
+            self._wrap_boto3_factory(boto3, name)
+
+    def _wrap_boto3_factory(self, boto3, name: str):
+        factory = getattr(boto3, name)
+        profiler = self
+
+        def timed_factory(service_name, *args, **kwargs):
+            with profiler.span('boto3', f'{name}:{service_name}'):
+                return factory(service_name, *args, **kwargs)
+
+        setattr(boto3, name, timed_factory)
+
+    @staticmethod
+    def _seconds_since_process_start():
+        try:
+            return max(0.0, time() - psutil.Process(os.getpid()).create_time())
+        except psutil.Error:
+            return 0.0
+
+
+boot_profiler = BootProfiler()
+boot_profiler.install()
@@ -0,0 +1,84 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from time import monotonic, sleep
+from typing import Callable, Optional
+
+import firefly_aws.domain as domain
+
+SAFETY_MARGIN_MS = 1000
+
+
+class Deadline:
+    """
+    Time budget for the current invocation. Built from the Lambda context's remaining time minus a safety margin, so
+    that work stops (and messages can be requeued) before Lambda kills the process. A deadline without an expiry
+    never runs out, which is what you get outside of Lambda.
+    """
+
+    def __init__(self, expires_at: Optional[float] = None):
+        self._expires_at = expires_at
+
+    @classmethod
+    def from_context(cls, context, safety_margin_ms: int = None) -> Deadline:
+        if safety_margin_ms is None:
+            safety_margin_ms = SAFETY_MARGIN_MS
+        try:
+            remaining_ms = context.get_remaining_time_in_millis()
+        except AttributeError:
+            return cls()
+
+        return cls(monotonic() + (remaining_ms - int(safety_margin_ms)) / 1000)
+
+    def remaining(self) -> Optional[float]:
+        """Seconds left, or None when unbounded."""
+        if self._expires_at is None:
+            return None
+        return max(0.0, self._expires_at - monotonic())
+
+    def expired(self) -> bool:
+        return self._expires_at is not None and monotonic() >= self._expires_at
+
+    def check(self):
+        if self.expired():
+            raise domain.LambdaTimedOut('Deadline exceeded')
+
+    def can_finish(self, seconds: float) -> bool:
+        return self._expires_at is None or monotonic() + seconds < self._expires_at
+
+    def timeout(self, default: Optional[float] = None) -> Optional[float]:
+        """The smaller of default and the remaining time."""
+        remaining = self.remaining()
+        if remaining is None:
+            return default
+        return remaining if default is None else min(default, remaining)
+
+    def retry(self, cb: Callable, wait: float = 1, backoff: bool = True, retries: int = 5, catch=Exception):
+        """
+        Like ff.retry, but gives up as soon as the next wait would run past the deadline instead of sleeping into the
+        Lambda timeout.
+        """
+        while True:
+            self.check()
+            try:
+                return cb()
+            except catch:
+                retries -= 1
+                if retries <= 0 or not self.can_finish(wait):
+                    raise
+                sleep(wait)
+                if backoff:
+                    wait *= 2
@@ -4,7 +4,12 @@ from typing import Optional
 
 import firefly as ff
 
+from .deadline import Deadline
+
 
 class ExecutionContext(ff.DomainService):
     event: Optional[dict] = None
     context = None
+    cold_start: bool = False
+    access_record: Optional[dict] = None
+    deadline: Deadline = Deadline()
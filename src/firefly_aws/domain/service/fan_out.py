@@ -0,0 +1,110 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, List, Optional, Union
+
+import firefly as ff
+
+import firefly_aws.domain as domain
+from .isolate_kernel_state import KERNEL_STATE
+
+CONCURRENCY = 10
+
+Call = Union[ff.Message, str, tuple]
+
+
+class FanOut(ff.DomainService):
+    """
+    Scatter/gather for synchronous requests and invokes. Each call may be a message, a message name, or a
+    (name, data) tuple. Calls run concurrently on a bounded pool ("fan_out_concurrency" firefly_aws setting) and the
+    results come back in call order. A call that raised has its exception in its slot, and a call that did not finish
+    before the overall deadline (the smaller of timeout and the invocation's deadline) has a domain.LambdaTimedOut.
+
+    The pool's workers get their own kernel state, repository identity maps and unit of work (see
+    IsolateKernelState), starting from the caller's user, scopes and request. Calls that had not started by the
+    deadline are cancelled. Calls already running can't be stopped: they finish in the background, their results are
+    discarded, and their worker is only free again once they do.
+    """
+    _kernel: ff.Kernel = None
+    _isolate_kernel_state: domain.IsolateKernelState = None
+    _reset_kernel: domain.ResetKernel = None
+    _execution_context: domain.ExecutionContext = None
+    _configuration: ff.Configuration = None
+
+    def __init__(self):
+        self._concurrency = int(self._configuration.contexts['firefly_aws'].get('fan_out_concurrency', CONCURRENCY))
+        self._pool = None
+        self._pool_lock = threading.Lock()
+
+    def request_many(self, calls: List[Call], timeout: float = None, return_exceptions: bool = True) -> list:
+        return self._gather([self._call(self.request, c) for c in calls], timeout, return_exceptions)
+
+    def invoke_many(self, calls: List[Call], timeout: float = None, return_exceptions: bool = True) -> list:
+        return self._gather([self._call(self.invoke, c) for c in calls], timeout, return_exceptions)
+
+    @staticmethod
+    def _call(method: Callable, call: Call):
+        if isinstance(call, tuple):
+            name, data = call
+            return lambda: method(name, data=data)
+        return lambda: method(call)
+
+    def _gather(self, calls: List[Callable], timeout: Optional[float], return_exceptions: bool):
+        if not calls:
+            return []
+
+        timeout = self._execution_context.deadline.timeout(timeout)
+        pool = self._get_pool()
+        state = {name: getattr(self._kernel, name, None) for name in KERNEL_STATE}
+        futures = [pool.submit(self._run, call, state) for call in calls]
+        _, not_done = wait(futures, timeout=timeout)
+        for future in not_done:
+            future.cancel()
+
+        ret = []
+        for future in futures:
+            if future.cancelled() or not future.done():
+                ret.append(domain.LambdaTimedOut('Deadline exceeded before the call completed'))
+            elif future.exception() is not None:
+                ret.append(future.exception())
+            else:
+                ret.append(future.result())
+
+        if not return_exceptions:
+            for result in ret:
+                if isinstance(result, BaseException):
+                    raise result
+
+        return ret
+
+    def _get_pool(self):
+        with self._pool_lock:
+            if self._pool is None:
+                self._isolate_kernel_state()
+                self._pool = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix='fan-out')
+            return self._pool
+
+    def _run(self, call: Callable, state: dict):
+        self._reset_kernel()
+        for name, value in state.items():
+            setattr(self._kernel, name, value)
+
+        try:
+            return call()
+        finally:
+            self._reset_kernel()
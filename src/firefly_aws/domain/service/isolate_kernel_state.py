@@ -0,0 +1,113 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import threading
+from typing import Callable, Dict
+
+import firefly as ff
+
+KERNEL_STATE = ('user', 'required_scopes', 'http_request', 'secured')
+
+# Attributes that hold a repository's per-request state (checked-out entities, pending deletions, query state).
+REPOSITORY_STATE = ('_entities', '_deletions', '_entity_hashes', '_query_details')
+
+_REPOSITORY_DEFAULTS = {
+    '_entities': list,
+    '_deletions': list,
+    '_entity_hashes': dict,
+    '_query_details': dict,
+    '_state': lambda: 'empty',
+}
+# The unit of work: how deeply messages are nested, and the events held back until the outermost one commits.
+_TRANSACTION_DEFAULTS = {
+    '_level': lambda: 0,
+    '_event_buffer': list,
+}
+
+
+class _ThreadLocalAttribute:
+    def __init__(self, name: str, default: Callable = lambda: None):
+        self._name = name
+        self._default = default
+
+    def __get__(self, instance, owner):
+        if instance is None:
+            return self
+        local = _local(instance)
+        try:
+            return getattr(local, self._name)
+        except AttributeError:
+            value = self._default()
+            setattr(local, self._name, value)
+            return value
+
+    def __set__(self, instance, value):
+        setattr(_local(instance), self._name, value)
+
+
+def _local(instance) -> threading.local:
+    ret = instance.__dict__.get('_ff_local')
+    if ret is None:
+        ret = instance.__dict__.setdefault('_ff_local', threading.local())
+    return ret
+
+
+def _isolate(instance, state: Dict[str, Callable], extra: dict = None):
+    if getattr(instance, '_ff_isolated', False) is True:
+        return instance
+
+    current = {name: instance.__dict__.pop(name) for name in state if name in instance.__dict__}
+    attributes = {name: _ThreadLocalAttribute(name, default) for name, default in state.items()}
+    attributes['_ff_isolated'] = True
+    attributes.update(extra or {})
+
+    cls = instance.__class__
+    instance.__class__ = type(cls.__name__, (cls,), attributes)
+    # The thread doing the isolating keeps what it had.
+    for name, value in current.items():
+        setattr(instance, name, value)
+
+    return instance
+
+
+def _isolate_repository(repository):
+    return _isolate(repository, _REPOSITORY_DEFAULTS)
+
+
+def _isolating_call(self, entity):
+    return _isolate_repository(type(self).__mro__[1].__call__(self, entity))
+
+
+class IsolateKernelState(ff.DomainService):
+    """
+    Moves request-scoped state into thread-local storage so that several records can be handled concurrently without
+    seeing each other's state: the kernel's user, scopes, http request and secured flag, the identity maps of every
+    repository (including ones the registry creates later), and the transaction handler's unit of work.
+    """
+    _kernel: ff.Kernel = None
+    _registry: ff.Registry = None
+    _transaction_handler: ff.TransactionHandlingMiddleware = None
+
+    def __call__(self):
+        _isolate(self._kernel, {name: lambda: None for name in KERNEL_STATE})
+        if self._transaction_handler is not None:
+            _isolate(self._transaction_handler, _TRANSACTION_DEFAULTS)
+        if self._registry is not None:
+            for repository in list(getattr(self._registry, '_cache', {}).values()):
+                _isolate_repository(repository)
+            _isolate(self._registry, {}, {'__call__': _isolating_call})
+
+        return self._kernel
@@ -0,0 +1,168 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import base64
+import binascii
+import hashlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Records in the format written by the Kinesis Producer Library: a magic number, an AggregatedRecord protobuf message
+# and the MD5 of that message. Consumers that don't know the format (or records whose digest doesn't match) see the
+# record as it is, which is what the KPL's own de-aggregators do too.
+MAGIC = b'\xf3\x89\x9a\xc2'
+DIGEST_SIZE = 16
+
+# The KPL's default AggregationMaxSize; well under the 1MB record limit while still amortising the per-record cost.
+MAX_AGGREGATED_BYTES = 51_200
+
+# Protobuf tags: AggregatedRecord.partition_key_table (1) and .records (3), Record.partition_key_index (1) and
+# .data (3).
+PARTITION_KEY_TABLE = b'\x0a'
+RECORDS = b'\x1a'
+PARTITION_KEY_INDEX = b'\x08'
+DATA = b'\x1a'
+
+HASH_KEY_SPACE = 1 << 128
+
+
+def aggregate(records: List[Tuple[str, bytes]]) -> bytes:
+    """Packs (partition key, data) pairs into one record. Partition keys are stored once each."""
+    keys = {}
+    entries = bytearray()
+    for partition_key, data in records:
+        index = keys.setdefault(partition_key, len(keys))
+        record = PARTITION_KEY_INDEX + _varint(index) + DATA + _varint(len(data)) + data
+        entries += RECORDS + _varint(len(record)) + record
+
+    body = bytearray()
+    for key in keys:
+        key = key.encode('utf-8')
+        body += PARTITION_KEY_TABLE + _varint(len(key)) + key
+    body += entries
+
+    return MAGIC + bytes(body) + hashlib.md5(body).digest()
+
+
+def aggregated_size(partition_key: str, data: bytes) -> int:
+    """An upper bound on what a record adds to an aggregate, counting its partition key as new."""
+    key = len(partition_key.encode('utf-8'))
+    # A partition key index never takes more than five bytes.
+    record = 1 + 5 + 1 + len(_varint(len(data))) + len(data)
+    return 1 + len(_varint(key)) + key + 1 + len(_varint(record)) + record
+
+
+def deaggregate(data: bytes) -> Optional[List[Tuple[str, bytes]]]:
+    """The (partition key, data) pairs packed into an aggregated record, or None if it isn't one."""
+    if not data.startswith(MAGIC) or len(data) < len(MAGIC) + DIGEST_SIZE:
+        return None
+    body = data[len(MAGIC):-DIGEST_SIZE]
+    if hashlib.md5(body).digest() != data[-DIGEST_SIZE:]:
+        return None
+
+    keys = []
+    records = []
+    for field, value in _fields(body):
+        if field == 1:
+            keys.append(value.decode('utf-8'))
+        elif field == 3:
+            index, payload = 0, b''
+            for record_field, record_value in _fields(value):
+                if record_field == 1:
+                    index = record_value
+                elif record_field == 3:
+                    payload = record_value
+            records.append((index, payload))
+
+    return [(keys[index], payload) for index, payload in records]
+
+
+def deaggregate_record(data: str) -> Optional[List[Tuple[str, bytes]]]:
+    """Like deaggregate, for the base64 data of a record in a Lambda event."""
+    try:
+        return deaggregate(base64.b64decode(data, validate=True))
+    except (binascii.Error, ValueError):
+        return None
+
+
+def hash_key(partition_key: str) -> int:
+    """The 128 bit hash Kinesis maps a partition key to a shard with."""
+    return int.from_bytes(hashlib.md5(partition_key.encode('utf-8')).digest(), 'big')
+
+
+def partition_key_fields(config: dict) -> Dict[str, str]:
+    """
+    Events published to Kinesis instead of SNS ("kinesis_events" firefly_aws setting), by full name, with the field
+    their partition key is read from. The setting is either a list of names, keyed on "id", or a dict of name to field.
+    """
+    events = config.get('kinesis_events') or {}
+    if isinstance(events, dict):
+        return {name: field or 'id' for name, field in events.items()}
+    return {name: 'id' for name in events}
+
+
+def bucket(partition_key: str, shards: int) -> int:
+    """Which of "shards" equal slices of the hash key space the partition key falls in."""
+    return hash_key(partition_key) * shards >> 128
+
+
+def bucket_hash_key(bucket_: int, shards: int) -> str:
+    """An explicit hash key in the middle of a bucket, so records sent with it land where their own keys would."""
+    return str((2 * bucket_ + 1) * HASH_KEY_SPACE // (2 * shards))
+
+
+def _varint(value: int) -> bytes:
+    ret = bytearray()
+    while value > 0x7f:
+        ret.append((value & 0x7f) | 0x80)
+        value >>= 7
+    ret.append(value)
+
+    return bytes(ret)
+
+
+def _read_varint(buffer: bytes, position: int) -> Tuple[int, int]:
+    ret = shift = 0
+    while True:
+        if position >= len(buffer):
+            raise ValueError('Truncated varint')
+        byte = buffer[position]
+        position += 1
+        ret |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return ret, position
+        shift += 7
+
+
+def _fields(buffer: bytes) -> Iterator[Tuple[int, object]]:
+    position = 0
+    while position < len(buffer):
+        tag, position = _read_varint(buffer, position)
+        wire_type = tag & 7
+        if wire_type == 0:
+            value, position = _read_varint(buffer, position)
+        elif wire_type == 2:
+            length, position = _read_varint(buffer, position)
+            value = buffer[position:position + length]
+            position += length
+        elif wire_type == 1:
+            value, position = buffer[position:position + 8], position + 8
+        elif wire_type == 5:
+            value, position = buffer[position:position + 4], position + 4
+        else:
+            raise ValueError(f'Unsupported wire type {wire_type}')
+        if position > len(buffer):
+            raise ValueError('Truncated field')
+        yield tag >> 3, value
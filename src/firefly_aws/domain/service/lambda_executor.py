@@ -15,22 +15,26 @@
 from __future__ import annotations
 
 import base64
-import inspect
+import email.utils
+import hashlib
 import io
+import itertools
 import json
 import math
 import os
-import re
-import signal
+import threading
 import urllib.parse
 import uuid
-from contextlib import contextmanager
-from typing import Union
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Iterator, List, Optional, Set, Union
 
 import firefly as ff
-from multipart import MultipartParser
 
 import firefly_aws.domain as domain
+from . import kinesis_aggregation
+from .response_compressor import ENCODINGS
 
 STATUS_CODES = {
     'BadRequest': 400,
@@ -48,6 +52,11 @@ ACCESS_CONTROL_HEADERS = {
     'Access-Control-Expose-Headers': '*',
 }
 
+MAX_RESPONSE_SIZE = 6_000_000
+COMPRESSION_MIN_SIZE = 1024
+CONTENT_CHUNK_SIZE = 8 * 1024 * 1024
+ETAG_DIGEST_SIZE = 16
+
 COGNITO_TRIGGERS = (
     'PreSignUp_SignUp', 'PreSignUp_AdminCreateUser', 'PostConfirmation_ConfirmSignUp',
     'PostConfirmation_ConfirmForgotPassword', 'PreAuthentication_Authentication', 'PostAuthentication_Authentication',
@@ -60,20 +69,9 @@ COGNITO_TRIGGERS = (
 )
 
 
-@contextmanager
-def time_limit(seconds):
-    def signal_handler(signum, frame):
-        raise domain.LambdaTimedOut('Time limit exceeded')
-    signal.signal(signal.SIGALRM, signal_handler)
-    signal.alarm(seconds)
-    try:
-        yield
-    finally:
-        signal.alarm(0)
-
-
 class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
     _serializer: ff.Serializer = None
+    _json_codec: domain.JsonCodec = None
     _message_factory: ff.MessageFactory = None
     _rest_router: ff.RestRouter = None
     _s3_client = None
@@ -84,35 +82,83 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
     _store_large_payloads_in_s3: domain.StoreLargePayloadsInS3 = None
     _load_payload: domain.LoadPayload = None
     _execution_context: domain.ExecutionContext = None
+    _isolate_kernel_state: domain.IsolateKernelState = None
+    _boot_profiler: domain.BootProfiler = None
+    _response_compressor: domain.ResponseCompressor = None
+    _access_log: domain.AccessLog = None
+    _parse_multipart: domain.ParseMultipart = None
+    _warm_up: domain.WarmUp = None
+    _reset_kernel: domain.ResetKernel = None
+    _outbox: domain.Outbox = None
     _configuration: ff.Configuration = None
+    _context_map: ff.ContextMap = None
     _context: str = None
 
     def __init__(self):
-        self._version_matcher = re.compile(r'^/v(\d)')
-        self._default_matcher = re.compile(r'^/api/')
+        self._cold_start = True
+        self._event_names = None
+        self._record_pool = None
+        self._record_pool_size = None
+        self._message_semaphores = {}
+        self._semaphore_lock = threading.Lock()
 
     def run(self, event: dict, context):
+        self._execution_context.cold_start = self._cold_start
+        if self._cold_start:
+            self._cold_start = False
+            self._report_boot_timeline(context)
+
+        self._access_log.start(
+            request_id=getattr(context, 'aws_request_id', None), cold_start=self._execution_context.cold_start
+        )
         try:
-            return self._do_run(event, context)
+            response = self._do_run(event, context)
+            self._outbox.flush()
         except Exception as e:
+            self._flush_outbox_after_error()
+            self._access_log.finish(status=500, error=e.__class__.__name__)
             self._handle_error(e, event, context)
             raise e
 
+        self._access_log.finish(response)
+        return response
+
+    def _flush_outbox_after_error(self):
+        # Events raised before a failure or timeout were real side effects; publish them rather than drop them.
+        try:
+            self._outbox.flush()
+        except Exception as e:
+            self.exception('Could not flush the outbox: %s', e)
+
+    def _report_boot_timeline(self, context):
+        timeline = self._boot_profiler.finish()
+        if timeline is not None:
+            timeline['aws_request_id'] = getattr(context, 'aws_request_id', None)
+            self.info('%s', json.dumps(timeline))
+
     def _do_run(self, event: dict, context):
-        self.debug('Event: %s', event)
+        if isinstance(event, dict) and domain.WARMER_KEY in event:
+            self._warm_up()
+            self._access_log.annotate(warmer=True)
+            return {'warmed': True}
+
+        self._access_log.payload('Event', event)
         self.debug('Context: %s', context)
 
-        self._kernel.reset()
+        self._reset_kernel()
 
         self._execution_context.event = event
         self._execution_context.context = context
+        self._execution_context.deadline = domain.Deadline.from_context(
+            context, self._configuration.contexts['firefly_aws'].get('deadline_safety_margin')
+        )
 
         if 'requestContext' in event and 'http' in event['requestContext']:
-            self.info('HTTP request')
+            self.debug('HTTP request')
             return self._handle_http_event(event)
 
         if 'Records' in event and event['Records'][0].get('eventSource') in ('aws:sqs', 'aws:kinesis'):
-            self.info('Async message')
+            self.debug('Async message')
             return self._handle_async_event(event)
 
         message = False
@@ -125,33 +171,16 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
                 return event
 
         if message is False:
-            message = self._serializer.deserialize(json.dumps(event))
+            message = self._serializer.deserialize(event)
         if isinstance(message, ff.Command):
             try:
-                return self._serializer.deserialize(
-                    self._store_large_payloads_in_s3(
-                        self._serializer.serialize(self.invoke(message)),
-                        name=message.__class__.__name__,
-                        type_='command',
-                        context=message.get_context(),
-                        id_=getattr(message, '_id', str(uuid.uuid4()))
-                    )
-                )
+                return self._to_lambda_response(self.invoke(message), message, 'command')
             except ff.ConfigurationError:
                 if aws_message is True:
                     return event
                 raise
         elif isinstance(message, ff.Query):
-            response = self.request(message)
-            return self._serializer.deserialize(
-                self._store_large_payloads_in_s3(
-                    self._serializer.serialize(response),
-                    name=message.__class__.__name__,
-                    type_='query',
-                    context=message.get_context(),
-                    id_=getattr(message, '_id', str(uuid.uuid4()))
-                )
-            )
+            return self._to_lambda_response(self.request(message), message, 'query')
 
         return {
             'statusCode': 200,
@@ -161,15 +190,12 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
         }
 
     def _handle_http_event(self, event: dict):
-        route = self._default_matcher.sub('/', event['rawPath'])
-        match = self._version_matcher.match(route)
-        if match is not None and len(match.groups()) > 0:
-            os.environ['API_VERSION'] = match.groups()[0]
-        else:
-            os.environ['API_VERSION'] = '1'
-
-        route = self._version_matcher.sub('', route)
+        route, version = self._parse_route(event['rawPath'])
+        os.environ['API_VERSION'] = version
         method = event['requestContext']['http']['method']
+        self._access_log.annotate(
+            route=f'{method} {route}', request_bytes=len(event['body']) if event.get('body') is not None else 0
+        )
 
         if method.lower() == 'options':
             return {
@@ -182,9 +208,9 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
             for k, v in event['headers'].items():
                 if k.lower() == 'content-type':
                     if 'application/json' in v.lower():
-                        body = self._serializer.deserialize(event['body'])
+                        body = self._serializer.deserialize(self._json_codec.decode(event['body']))
                     elif 'multipart/form-data' in v.lower():
-                        body = self._parse_multipart(v, event['body'])
+                        body = self._parse_multipart(v, event['body'], event.get('isBase64Encoded', True))
                     elif 'x-www-form-urlencoded' in v.lower():
                         if event.get('isBase64Encoded') is True:
                             body = urllib.parse.parse_qs(base64.b64decode(event['body']).decode('utf-8'))
@@ -193,12 +219,12 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
                     else:
                         body = event['body']
             if body is None:
-                body = self._serializer.deserialize(event['body'])
+                body = self._serializer.deserialize(self._json_codec.decode(event['body']))
 
         try:
-            self.info(f'Trying to match route: "{method} {route}"')
-            endpoint, params = self._rest_router.match(route, method)
-            if not endpoint:
+            self.debug('Trying to match route: "%s %s"', method, route)
+            indexed_route, params = self._match_route(route, method)
+            if not indexed_route:
                 return {
                     'statusCode': 404,
                     'headers': ACCESS_CONTROL_HEADERS,
@@ -206,13 +232,8 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
                     'isBase64Encoded': False,
                 }
 
-            if endpoint.message is not None:
-                message_name = endpoint.message if isinstance(endpoint.message, str) else endpoint.message.get_fqn()
-            else:
-                message_name = endpoint.service
-                if inspect.isclass(message_name):
-                    message_name = message_name.get_fqn()
-            self.info(f'Matched route')
+            message_name = indexed_route.message_name
+            self._access_log.annotate(message=message_name)
 
             if 'queryStringParameters' in event:
                 params.update(event['queryStringParameters'])
@@ -221,15 +242,15 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
                 'headers': event['headers'],
                 'body': event.get('body'),
             }
-            self.info(f'Endpoint secured: {endpoint.secured}')
-            self.info(f'Required scopes: {endpoint.scopes}')
-            self._kernel.secured = endpoint.secured
-            self._kernel.required_scopes = endpoint.scopes
+            self.debug('Endpoint secured: %s', indexed_route.secured)
+            self.debug('Required scopes: %s', indexed_route.scopes)
+            self._kernel.secured = indexed_route.secured
+            self._kernel.required_scopes = indexed_route.scopes
             self._kernel.user = ff.User()
 
             try:
                 if method.lower() == 'get':
-                    return self._handle_http_response(self.request(message_name, data=params))
+                    return self._handle_http_response(self.request(message_name, data=params), conditional=True)
                 else:
                     if body is not None:
                         if isinstance(body, dict):
@@ -259,32 +280,41 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
         except TypeError:
             pass
 
-    def _parse_multipart(self, header: str, body: str):
-        boundary = None
-        parts = header.split(';')
-        for part in parts:
-            if 'boundary=' in part:
-                boundary = part.split('=')[-1]
-
-        self.info('Boundary: %s', boundary)
-        ret = {}
-        body = base64.b64decode(body)
-        parser = MultipartParser(io.BytesIO(body), boundary)
-        for part in parser:
-            if part.file and part.filename is not None:
-                ret[part.name] = ff.File(
-                    name=part.filename,
-                    content=part.raw,
-                    content_type=part.content_type
-                )
-            else:
-                ret[part.name] = part.value
-
-        return ret
+    def _to_lambda_response(self, response, message: ff.Message, type_: str):
+        payload = self._json_codec.encode(response)
+        self._access_log.annotate(message=str(message), status=200, response_bytes=len(payload))
+        # The Lambda runtime serializes what we return with the stdlib, so hand it plain JSON data.
+        return self._json_codec.decode(self._store_large_payloads_in_s3(
+            payload,
+            name=message.__class__.__name__,
+            type_=type_,
+            context=message.get_context(),
+            id_=getattr(message, '_id', str(uuid.uuid4())),
+            consumers=1
+        ))
 
-    def _handle_http_response(self, response: any, status_code: int = 200, headers: dict = None):
+    @staticmethod
+    def _parse_route(raw_path: str):
+        route = raw_path[4:] if raw_path.startswith('/api/') else raw_path
+        if route.startswith('/v') and len(route) > 2 and route[2].isdigit():
+            return route[3:], route[2]
+        return route, '1'
+
+    def _match_route(self, route: str, method: str):
+        if isinstance(self._rest_router, domain.RouteIndex):
+            return self._rest_router.lookup(route, method)
+
+        endpoint, params = self._rest_router.match(route, method)
+        if not endpoint:
+            return None, None
+        return domain.IndexedRoute.from_endpoint(endpoint), params
+
+    def _handle_http_response(self, response: any, status_code: int = 200, headers: dict = None,
+                              conditional: bool = False):
         headers = headers or {}
+        validators = {}
         if isinstance(response, ff.Envelope):
+            validators = response.headers
             if response.get_range() is not None:
                 range_ = response.get_range()
                 if range_['upper'] > range_['total']:
@@ -296,10 +326,47 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
             if 'location' in response.headers:
                 status_code = 303
                 headers['location'] = response.headers['location']
-            body = self._serializer.serialize(response.unwrap())
-        else:
-            body = self._serializer.serialize(response)
+            response = response.unwrap()
         headers.update(ACCESS_CONTROL_HEADERS)
+
+        conditional = conditional and status_code == 200 and \
+            self._configuration.contexts[self._context].get('conditional_requests', True) is not False
+        if conditional:
+            self._add_validators(validators, headers)
+            if self._is_not_modified(headers):
+                return self._not_modified(headers)
+
+        if isinstance(response, ff.File):
+            return self._handle_binary_response(response.content, response.content_type, status_code, headers)
+        if isinstance(response, (bytes, bytearray, memoryview)):
+            return self._handle_binary_response(response, None, status_code, headers)
+
+        chunks = self._iter_serialized(response)
+        hasher = None
+        if conditional and 'ETag' not in headers:
+            hasher = hashlib.blake2b(digest_size=ETAG_DIGEST_SIZE)
+            chunks = self._hash_chunks(chunks, hasher)
+
+        chunks, encoding = self._negotiate_compression(chunks, headers)
+        if encoding is not None:
+            # The compressed body is base64 encoded, so less of it fits in the Lambda response.
+            body, download_url = self._s3_service.spool_download(
+                self._response_compressor.compress(chunks, encoding),
+                max_inline_size=MAX_RESPONSE_SIZE * 3 // 4,
+                content_encoding=encoding,
+                content_type='application/json'
+            )
+        else:
+            body, download_url = self._s3_service.spool_download(chunks, max_inline_size=MAX_RESPONSE_SIZE)
+
+        if hasher is not None and download_url is None:
+            headers['ETag'] = f'"{hasher.hexdigest()}"'
+            if self._is_not_modified(headers):
+                return self._not_modified(headers, encoding)
+        if encoding is not None and 'ETag' in headers:
+            # The compressed bytes are a different representation, so they get their own strong validator.
+            headers['ETag'] = f'{headers["ETag"][:-1]}-{encoding}"'
+
         ret = {
             'statusCode': status_code,
             'headers': headers,
@@ -307,75 +374,485 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
             'isBase64Encoded': False,
         }
 
-        if len(body) > 6_000_000:
-            download_url = self._s3_service.store_download(body, apply_compression=False)
-            s3_download_domain = self._configuration.contexts[self._context].get('s3_download_domain')
-            if s3_download_domain is not None:
-                parts = download_url.split('/')
-                download_url = f'https://{s3_download_domain}/{"/".join(parts[3:])}'
+        if encoding is not None and body is not None:
+            ret['body'] = base64.b64encode(body).decode('ascii')
+            ret['isBase64Encoded'] = True
+            headers['Content-Encoding'] = encoding
+        elif body is not None:
+            ret['body'] = body.decode('utf-8')
 
+        if download_url is not None:
+            download_url = self._download_location(download_url)
             ret['body'] = json.dumps({
                 'location': download_url
             })
             ret['statusCode'] = 303
             ret['headers']['Location'] = download_url
 
-        self.info(f'Proxy Response: %s', ret)
+        self._access_log.payload('Proxy Response', ret)
+        return ret
+
+    def _handle_binary_response(self, content, content_type: str, status_code: int, headers: dict):
+        if isinstance(content, str):
+            content = content.encode('utf-8')
+        elif content is None:
+            content = b''
+        headers['Content-Type'] = content_type or 'application/octet-stream'
+        headers['Accept-Ranges'] = 'bytes'
+        ret = {
+            'statusCode': status_code,
+            'headers': headers,
+            'body': '',
+            'isBase64Encoded': False,
+        }
+
+        total = self._content_length(content)
+        range_ = self._parse_range(self._request_header('range'), total)
+        if range_ is False:
+            ret['statusCode'] = 416
+            headers['Content-Range'] = f'bytes */{total}'
+            return ret
+
+        # Base64 encoding adds a third, which has to fit in the Lambda response as well.
+        max_size = MAX_RESPONSE_SIZE * 3 // 4
+        if range_ is not None and range_[1] - range_[0] < max_size:
+            start, end = range_
+            ret['statusCode'] = 206
+            headers['Content-Range'] = f'bytes {start}-{end}/{total}'
+        elif total <= max_size:
+            start, end = 0, total - 1
+        else:
+            # S3 serves Range requests itself, so the whole object is uploaded and the client redirected to it.
+            _, download_url = self._s3_service.spool_download(
+                self._iter_content(content), max_inline_size=0, content_type=headers['Content-Type']
+            )
+            ret['statusCode'] = 303
+            headers['Location'] = self._download_location(download_url)
+            self._access_log.payload('Proxy Response', ret)
+            return ret
+
+        ret['body'] = base64.b64encode(self._read_content(content, start, end - start + 1)).decode('ascii')
+        ret['isBase64Encoded'] = True
+        self._access_log.payload('Proxy Response', ret)
+
+        return ret
+
+    @staticmethod
+    def _content_length(content) -> int:
+        if hasattr(content, 'read'):
+            content.seek(0, io.SEEK_END)
+            return content.tell()
+        return memoryview(content).nbytes
+
+    @staticmethod
+    def _read_content(content, start: int, length: int):
+        if hasattr(content, 'read'):
+            content.seek(start)
+            return content.read(length)
+        return memoryview(content).cast('B')[start:start + length]
+
+    @staticmethod
+    def _iter_content(content):
+        if hasattr(content, 'read'):
+            content.seek(0)
+            return iter(lambda: content.read(CONTENT_CHUNK_SIZE), b'')
+        return iter([bytes(content)])
+
+    @staticmethod
+    def _parse_range(header: str, total: int):
+        """
+        Returns (first, last) for a single satisfiable byte range, False for an unsatisfiable one and None when the
+        header is absent or not something we serve partially (other units, multiple ranges).
+        """
+        if not header or not header.strip().lower().startswith('bytes='):
+            return None
+        spec = header.split('=', 1)[1].strip()
+        if ',' in spec:
+            return None
+
+        first, _, last = spec.partition('-')
+        try:
+            if first.strip() == '':
+                length = int(last)
+                if length <= 0 or total == 0:
+                    return False
+                return max(0, total - length), total - 1
+            start = int(first)
+            end = int(last) if last.strip() != '' else total - 1
+        except ValueError:
+            return None
+
+        if start >= total or end < start:
+            return False
+        return start, min(end, total - 1)
+
+    def _download_location(self, download_url: str):
+        s3_download_domain = self._configuration.contexts[self._context].get('s3_download_domain')
+        if s3_download_domain is not None:
+            parts = download_url.split('/')
+            download_url = f'https://{s3_download_domain}/{"/".join(parts[3:])}'
+
+        return download_url
+
+    def _negotiate_compression(self, chunks: Iterator[bytes], headers: dict):
+        config = self._configuration.contexts[self._context]
+        if config.get('compression', True) is False:
+            return chunks, None
+
+        headers['Vary'] = 'Accept-Encoding'
+        encoding = self._response_compressor.negotiate(self._request_header('accept-encoding'))
+        if encoding is None:
+            return chunks, None
+
+        min_size = int(config.get('compression_min_size', COMPRESSION_MIN_SIZE))
+        head = []
+        size = 0
+        for chunk in chunks:
+            head.append(chunk)
+            size += len(chunk)
+            if size >= min_size:
+                break
+
+        return itertools.chain(head, chunks), (encoding if size >= min_size else None)
+
+    @staticmethod
+    def _hash_chunks(chunks: Iterator[bytes], hasher):
+        for chunk in chunks:
+            hasher.update(chunk)
+            yield chunk
+
+    @staticmethod
+    def _add_validators(envelope_headers: dict, headers: dict):
+        """
+        Handlers can supply validators on the envelope: a "version" (e.g. the aggregate's version) becomes the ETag
+        and a "last_modified" datetime or epoch timestamp becomes Last-Modified. Both let us answer a conditional
+        request before the body is serialized.
+        """
+        if envelope_headers.get('version') is not None:
+            headers['ETag'] = f'"v{envelope_headers["version"]}"'
+
+        last_modified = envelope_headers.get('last_modified')
+        if isinstance(last_modified, (int, float)):
+            last_modified = datetime.fromtimestamp(last_modified, tz=timezone.utc)
+        if isinstance(last_modified, datetime):
+            if last_modified.tzinfo is None:
+                last_modified = last_modified.replace(tzinfo=timezone.utc)
+            headers['Last-Modified'] = email.utils.format_datetime(last_modified.astimezone(timezone.utc), usegmt=True)
+
+    def _is_not_modified(self, headers: dict):
+        if_none_match = self._request_header('if-none-match')
+        if if_none_match is not None:
+            # If-Modified-Since is ignored when If-None-Match is present (RFC 7232, 3.3).
+            if 'ETag' not in headers:
+                return False
+            if if_none_match.strip() == '*':
+                return True
+            etag = self._opaque_tag(headers['ETag'])
+            return any(self._opaque_tag(tag) == etag for tag in if_none_match.split(','))
+
+        if_modified_since = self._request_header('if-modified-since')
+        if if_modified_since is None or 'Last-Modified' not in headers:
+            return False
+        try:
+            since = email.utils.parsedate_to_datetime(if_modified_since)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+
+        return email.utils.parsedate_to_datetime(headers['Last-Modified']) <= since
+
+    @staticmethod
+    def _opaque_tag(tag: str):
+        # Weak comparison: W/ is ignored, as is the content-coding suffix we add to compressed representations.
+        tag = tag.strip()
+        if tag.startswith('W/'):
+            tag = tag[2:]
+        tag = tag.strip('"')
+        name, _, coding = tag.rpartition('-')
+        if name and coding in ENCODINGS:
+            return name
+        return tag
+
+    def _not_modified(self, headers: dict, encoding: str = None):
+        if encoding is not None:
+            headers['ETag'] = f'{headers["ETag"][:-1]}-{encoding}"'
+        self._access_log.annotate(not_modified=True)
+        ret = {
+            'statusCode': 304,
+            'headers': headers,
+            'body': '',
+            'isBase64Encoded': False,
+        }
+        self._access_log.payload('Proxy Response', ret)
+
         return ret
 
+    def _request_header(self, name: str):
+        for k, v in ((self._kernel.http_request or {}).get('headers') or {}).items():
+            if k.lower() == name:
+                return v
+
+    def _iter_serialized(self, data, depth: int = 2):
+        # Serializes the outer containers piece by piece so a large response never has to exist as a single string.
+        if depth > 0 and isinstance(data, (list, tuple)) and len(data) > 0:
+            yield b'['
+            for i, item in enumerate(data):
+                if i > 0:
+                    yield b','
+                yield self._json_codec.encode(item)
+            yield b']'
+        elif depth > 0 and isinstance(data, dict) and len(data) > 0 and all(isinstance(k, str) for k in data):
+            yield b'{'
+            for i, (key, value) in enumerate(data.items()):
+                if i > 0:
+                    yield b','
+                yield self._json_codec.encode(key)
+                yield b':'
+                yield from self._iter_serialized(value, depth - 1)
+            yield b'}'
+        else:
+            yield self._json_codec.encode(data)
+
     def _handle_async_event(self, event: dict):
-        for record in event['Records']:
-            if 'kinesis' in record:
-                body = self._serializer.deserialize(record['kinesis']['data'])
-            else:
-                body = self._serializer.deserialize(record['body'])
+        records = event['Records']
+        concurrency = int(self._configuration.contexts['firefly_aws'].get('record_concurrency') or 1)
 
-            try:
-                message: Union[ff.Event, dict] = self._serializer.deserialize(body['Message'])
-            except KeyError:
-                message = self._serializer.deserialize(body)
-            except TypeError:
-                message = body
-
-            if (isinstance(message, dict) and 'PAYLOAD_KEY' in message) or \
-                    (isinstance(message, ff.Message) and hasattr(message, 'PAYLOAD_KEY')):
-                context = self._configuration.contexts['firefly_aws']
-                function_name = self._lambda_function_name(self._context, 'Async')
-                # If we're using adaptive memory and this is the router, we don't want to load the entire message.
-                if context.get('memory_async') != 'adaptive' or \
-                        not self._execution_context.context or \
-                        self._execution_context.context.function_name != function_name:
-                    try:
-                        payload_key = message['PAYLOAD_KEY'] if isinstance(message, dict) else message.PAYLOAD_KEY
-                        self.info('Payload key: %s', payload_key)
-                        message = self._load_payload(payload_key)
-                    except Exception as e:
-                        self.nack_message(record)
-                        self.error(e)
-                        continue
-                else:
-                    message = self._serializer.deserialize(self._serializer.serialize(message))
+        if 'kinesis' in records[0]:
+            results = self._handle_shard_records(records)
+        elif concurrency > 1 and len(records) > 1:
+            results = list(self._get_record_pool(concurrency).map(self._handle_async_record_in_thread, records))
+        else:
+            # Records are handled one at a time, so load the payloads they reference ahead of them.
+            with self._prefetch_payloads(records) as prefetched:
+                results = [self._try_async_record(record, prefetched) for record in records]
+
+        failures = [self.nack_message(record) for record, ok in zip(records, results) if not ok]
+        self._access_log.annotate(
+            records=len(records),
+            failures=len(failures),
+            request_bytes=sum(len(r['kinesis']['data'] if 'kinesis' in r else r.get('body') or '') for r in records)
+        )
+        if len(records) == 1:
+            return self.complete_handshake(records[0], failures)
+        return self.complete_batch_handshake(records, failures)
+
+    def _handle_shard_records(self, records: list):
+        # A Kinesis batch comes from one shard, whose records must be handled in order. Lambda resumes the shard at
+        # the lowest failed sequence number, so once a record fails, the ones after it are left for that retry.
+        results = []
+        for record in records:
+            results.append(self._try_async_record(record))
+            if not results[-1]:
+                break
+
+        return results + [False] * (len(records) - len(results))
+
+    def _try_async_record(self, record: dict, prefetched: domain.PrefetchedPayloads = None):
+        if self._execution_context.deadline.expired():
+            # Not enough time left to handle it; report it as failed so it's redelivered.
+            return False
 
-            if message is None:
-                self.info('Got a null message')
+        try:
+            self._handle_async_record(record, prefetched)
+            return True
+        except Exception as e:
+            self.exception(e)
+            return False
+        finally:
+            if prefetched is not None:
+                prefetched.done(record.get('messageId'))
+
+    def _prefetch_payloads(self, records: list):
+        references = {}
+        if len(records) > 1 and self._loads_payloads():
+            for record in records:
+                # Envelopes are small; only they need decoding here.
+                if 'PAYLOAD_' not in (record.get('body') or ''):
+                    continue
+                attributes = self._record_attributes(record)
+                try:
+                    body = self._json_codec.decode(record['body'])
+                    if isinstance(body, dict) and 'Message' in body:
+                        attributes = self._envelope_attributes(body)
+                        body = self._json_codec.decode(body['Message'])
+                except ValueError:
+                    continue
+                if attributes is not None and not self._is_handled(attributes):
+                    continue
+                if self._load_payload.is_reference(body):
+                    references[record['messageId']] = body
+
+        if len(references) < 2:
+            return nullcontext()
+        return self._load_payload.prefetch(references)
+
+    def _loads_payloads(self):
+        # If we're using adaptive memory and this is the router, we don't want to load the entire message.
+        function_name = self._lambda_function_name(self._context, 'Async')
+        return self._configuration.contexts['firefly_aws'].get('memory_async') != 'adaptive' or \
+            not self._execution_context.context or \
+            self._execution_context.context.function_name != function_name
+
+    def _handle_async_record_in_thread(self, record: dict):
+        self._reset_kernel()
+        try:
+            return self._try_async_record(record)
+        finally:
+            self._reset_kernel()
+
+    def _get_record_pool(self, concurrency: int):
+        if self._record_pool is None or self._record_pool_size != concurrency:
+            self._isolate_kernel_state()
+            self._record_pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='firefly-record')
+            self._record_pool_size = concurrency
+        return self._record_pool
+
+    def _message_semaphore(self, message_name: str):
+        limits = self._configuration.contexts['firefly_aws'].get('message_concurrency') or {}
+        if message_name not in limits:
+            return None
+
+        with self._semaphore_lock:
+            if message_name not in self._message_semaphores:
+                self._message_semaphores[message_name] = threading.BoundedSemaphore(int(limits[message_name]))
+            return self._message_semaphores[message_name]
+
+    def _handle_async_record(self, record: dict, prefetched: domain.PrefetchedPayloads = None):
+        if 'kinesis' in record:
+            records = kinesis_aggregation.deaggregate_record(record['kinesis']['data'])
+            if records is not None:
+                # Events published in Kinesis mode. Should one fail, the whole Kinesis record is retried, so the
+                # ones before it are handled again; the same at-least-once delivery SQS gives.
+                for _, data in records:
+                    body = self._json_codec.decode(data)
+                    self._route_async_body(data, self._body_attributes(body), body)
                 return
+            self._handle_async_body(self._json_codec.decode(record['kinesis']['data']), resource_settings=True)
+            return
 
-            if 'kinesis' in record:
-                message = self._message_factory.command('firefly_aws.UpdateResourceSettings', message)
+        # The message's name, type and context come with it as attributes: on the record for messages sent to
+        # the queue directly (or delivered raw), in the envelope for those delivered by SNS. Either way they're
+        # known before the message itself is parsed.
+        raw = record['body']
+        body = None
+        attributes = self._record_attributes(record)
+        if attributes is None:
+            body = self._json_codec.decode(raw)
+            if isinstance(body, dict) and 'Message' in body:
+                raw, body, attributes = body['Message'], None, self._envelope_attributes(body)
+        self._route_async_body(raw, attributes, body, prefetched, record.get('messageId'))
+
+    def _route_async_body(self, raw, attributes: Optional[dict], body=None,
+                          prefetched: domain.PrefetchedPayloads = None, message_id: str = None):
+        if attributes is not None:
+            if not self._is_handled(attributes):
+                self.debug('Nothing here handles %s.%s; acknowledging it', attributes['_context'], attributes['_name'])
+                return
+            if not self._loads_payloads():
+                # The adaptive memory router only decides which function gets a message; pass it on as it came.
+                return self._forward(raw, attributes)
+
+        if body is None:
+            body = self._json_codec.decode(raw)
+        self._handle_async_body(body, prefetched, message_id)
+
+    def _forward(self, raw: Union[str, bytes], attributes: dict):
+        name = f'{attributes["_context"]}.{attributes["_name"]}'
+        if attributes.get('_type') == 'command':
+            message = self._message_factory.command(name, {})
+        else:
+            message = self._message_factory.event(name, {})
+        setattr(message, '_raw_body', raw.decode('utf-8') if isinstance(raw, bytes) else raw)
+        message.headers['external'] = True
+        self._handle_async_message(message)
+
+    def _is_handled(self, attributes: dict) -> bool:
+        # A command without a handler is a configuration error; let it fail where it can be seen.
+        if attributes.get('_type') != 'event':
+            return True
+        event_names = self._handled_events()
+        return event_names is None or f'{attributes.get("_context")}.{attributes.get("_name")}' in event_names
+
+    def _handled_events(self) -> Optional[Set[str]]:
+        """Full names of the events something in this kernel listens to, or None if that isn't known."""
+        if self._event_names is None:
+            # Built aside and then assigned; records may be handled on several threads.
+            event_names = set()
+            contexts = list(self._context_map.contexts) if self._context_map is not None else []
+            if self._configuration.contexts['firefly_aws'].get('filter_unhandled_events', True) is not False and \
+                    any(context.name == self._context for context in contexts):
+                for context in contexts:
+                    for event_types in context.event_listeners.values():
+                        for event_type in event_types:
+                            if not isinstance(event_type, str):
+                                event_type = f'{event_type.get_class_context()}.{event_type.__name__}'
+                            event_names.add(event_type)
+            self._event_names = event_names
+
+        return self._event_names or None
 
-            try:
-                message.headers['external'] = True
-            except AttributeError:
-                self.info('message is not of type Message')
-
-            if isinstance(message, ff.Command):
-                self.invoke(message)
-            else:
-                self.dispatch(message)
-        if len(event['Records']) == 1:
-            self.complete_handshake(event['Records'][0])
+    @staticmethod
+    def _record_attributes(record: dict) -> Optional[dict]:
+        attributes = record.get('messageAttributes') or {}
+        if '_name' not in attributes:
+            return None
+        return {name: attribute.get('stringValue') for name, attribute in attributes.items()}
+
+    @staticmethod
+    def _envelope_attributes(envelope: dict) -> Optional[dict]:
+        attributes = envelope.get('MessageAttributes') or {}
+        if '_name' not in attributes:
+            return None
+        return {name: attribute.get('Value') for name, attribute in attributes.items()}
+
+    @staticmethod
+    def _body_attributes(body) -> Optional[dict]:
+        # Messages and the envelopes of large payloads both carry these.
+        if not isinstance(body, dict) or '_name' not in body or '_context' not in body:
+            return None
+        return {name: body.get(name) for name in ('_name', '_type', '_context')}
+
+    def _handle_async_body(self, body, prefetched: domain.PrefetchedPayloads = None, message_id: str = None,
+                           resource_settings: bool = False):
+        message: Union[ff.Event, dict] = self._serializer.deserialize(body)
+        reference = None
+
+        if self._load_payload.is_reference(message):
+            if prefetched is not None and message_id in prefetched:
+                reference, message = message, prefetched.take(message_id)
+            elif self._loads_payloads():
+                reference, message = message, self._load_payload(message)
+            elif isinstance(message, dict):
+                message = self._serializer.deserialize(message)
+
+        if message is None:
+            self.info('Got a null message')
+            return
+
+        if resource_settings:
+            message = self._message_factory.command('firefly_aws.UpdateResourceSettings', message)
+
+        try:
+            message.headers['external'] = True
+        except AttributeError:
+            self.info('message is not of type Message')
+
+        semaphore = self._message_semaphore(str(message)) if isinstance(message, ff.Message) else None
+        if semaphore is not None:
+            with semaphore:
+                self._handle_async_message(message)
+        else:
+            self._handle_async_message(message)
+
+        if reference is not None:
+            self._load_payload.release(reference)
+
+    def _handle_async_message(self, message: Union[ff.Message, dict]):
+        if isinstance(message, ff.Command):
+            self.invoke(message)
         else:
-            self.complete_batch_handshake(event['Records'])
+            self.dispatch(message)
 
     @staticmethod
     def _is_cognito_trigger_event(event: dict):
@@ -392,10 +869,14 @@ class LambdaExecutor(ff.DomainService, domain.ResourceNameAware):
         return False
 
     def nack_message(self, record: dict):
-        pass
+        if 'kinesis' in record:
+            return {'itemIdentifier': record['kinesis']['sequenceNumber']}
+        return {'itemIdentifier': record['messageId']}
 
-    def complete_handshake(self, record: dict):
-        pass
+    def complete_handshake(self, record: dict, failures: List[dict] = None):
+        return self.complete_batch_handshake([record], failures)
 
-    def complete_batch_handshake(self, records: list):
-        pass
+    def complete_batch_handshake(self, records: list, failures: List[dict] = None):
+        return {
+            'batchItemFailures': failures or [],
+        }
@@ -1,21 +1,181 @@
 from __future__ import annotations
 
-import bz2
+import base64
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, Hashable, Optional, Union
 
 import firefly as ff
 
+import firefly_aws.domain as domain
+from . import payload_codec
+from .store_large_payloads_in_s3 import refs_key
+
+PREFETCH_CONCURRENCY = 8
+# Used when the Lambda memory size is unknown; otherwise prefetching may hold a quarter of it.
+PREFETCH_MAX_BYTES = 64 * 1024 * 1024
+
 
 class LoadPayload(ff.DomainService):
     _s3_client = None
+    _cache: ff.Cache = None
     _serializer: ff.Serializer = None
+    _json_codec: domain.JsonCodec = None
+    _execution_context: domain.ExecutionContext = None
+    _configuration: ff.Configuration = None
     _bucket: str = None
 
-    def __call__(self, key: str):
+    def __init__(self):
+        self._pool: Optional[ThreadPoolExecutor] = None
+        self._pool_lock = threading.Lock()
+
+    def __call__(self, reference: Union[str, dict, ff.Message], charge: Callable[[int], None] = None):
+        """
+        Loads the message behind an envelope written by StoreLargePayloadsInS3. Accepts the envelope itself (as data
+        or as the message it deserialized to) or just its S3 key. charge, if given, is told the size of each buffer
+        held along the way.
+        """
+        charge = charge or (lambda size: None)
+        if isinstance(reference, str):
+            return self._load(reference, charge)
+
+        get = reference.get if isinstance(reference, dict) else lambda k: getattr(reference, k, None)
+        if get('PAYLOAD_CODEC') is not None:
+            data = payload_codec.decompress(base64.b64decode(get('PAYLOAD')), get('PAYLOAD_CODEC'))
+            charge(len(data))
+            return self._serializer.deserialize(self._json_codec.decode(data))
+
+        return self._load(get('PAYLOAD_KEY'), charge)
+
+    def prefetch(self, references: Dict[Hashable, Union[dict, ff.Message]]) -> PrefetchedPayloads:
+        """
+        Starts loading several payloads at once on a bounded pool ("payload_prefetch_concurrency" firefly_aws
+        setting). Download, decompression and deserialization all happen on the pool, overlapping with whatever the
+        caller does meanwhile. Loads are admitted in the order given while the bytes held stay under
+        "payload_prefetch_max_bytes" (a quarter of the function's memory by default); the first payload not yet
+        taken is always admitted, so a batch of large payloads is loaded a few at a time rather than all at once.
+        """
+        config = self._configuration.contexts['firefly_aws'] if self._configuration is not None else {}
+        max_bytes = config.get('payload_prefetch_max_bytes')
+        if max_bytes is None:
+            memory = getattr(getattr(self._execution_context, 'context', None), 'memory_limit_in_mb', None)
+            max_bytes = int(memory) * 1024 * 1024 // 4 if isinstance(memory, (int, str)) else PREFETCH_MAX_BYTES
+
+        ret = PrefetchedPayloads(int(max_bytes))
+        pool = self._get_pool(int(config.get('payload_prefetch_concurrency', PREFETCH_CONCURRENCY)))
+        for position, (key, reference) in enumerate(references.items()):
+            ret.submit(pool, key, position, lambda charge, r=reference: self(r, charge))
+
+        return ret
+
+    def _get_pool(self, concurrency: int):
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=concurrency, thread_name_prefix='payload-prefetch')
+            return self._pool
+
+    @staticmethod
+    def is_reference(data) -> bool:
+        if isinstance(data, dict):
+            return 'PAYLOAD_KEY' in data or 'PAYLOAD_CODEC' in data
+        return isinstance(data, ff.Message) and (hasattr(data, 'PAYLOAD_KEY') or hasattr(data, 'PAYLOAD_CODEC'))
+
+    def release(self, reference: Union[dict, ff.Message]):
+        """
+        Called by a consumer once it is done with a payload. Reference counted payloads (see StoreLargePayloadsInS3)
+        are deleted when their last consumer releases them; anything else is left to the lifecycle rule.
+        """
+        get = reference.get if isinstance(reference, dict) else lambda k: getattr(reference, k, None)
+        if get('PAYLOAD_RELEASE') is not True:
+            return
+
+        key = get('PAYLOAD_KEY')
+        try:
+            refs = self._cache.decrement(refs_key(key))
+            if refs is not None and refs <= 0:
+                self._s3_client.delete_object(Bucket=self._bucket, Key=key)
+        except Exception as e:
+            self.warning('Could not release payload %s: %s', key, e)
+
+    def _load(self, key: str, charge: Callable[[int], None]):
         response = self._s3_client.get_object(
             Bucket=self._bucket,
             Key=key
         )
         data = response['Body'].read()
-        if key.endswith('bz2'):
-            data = bz2.decompress(data)
-        return self._serializer.deserialize(data)
+        charge(len(data))
+        codec = payload_codec.codec_for_key(key)
+        if codec is not None:
+            data = payload_codec.decompress(data, codec)
+            charge(len(data))
+        return self._serializer.deserialize(self._json_codec.decode(data))
+
+
+class PrefetchedPayloads:
+    """
+    Handle on payloads being loaded by LoadPayload.prefetch(). take() waits for a payload (raising whatever its load
+    raised) and done() gives back the memory it held once the caller has finished with it. close() abandons loads
+    that haven't started.
+    """
+
+    def __init__(self, max_bytes: int):
+        self._max_bytes = max_bytes
+        self._futures: Dict[Hashable, Future] = {}
+        self._positions: Dict[Hashable, int] = {}
+        self._charges: Dict[Hashable, int] = {}
+        self._used = 0
+        self._taken = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def __contains__(self, key: Hashable):
+        return key in self._futures
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def submit(self, pool: ThreadPoolExecutor, key: Hashable, position: int, load: Callable):
+        self._positions[key] = position
+        self._charges[key] = 0
+        self._futures[key] = pool.submit(self._run, key, position, load)
+
+    def take(self, key: Hashable):
+        with self._condition:
+            # Whatever comes after this one may now be admitted, even over the cap.
+            self._taken = max(self._taken, self._positions[key] + 1)
+            self._condition.notify_all()
+        return self._futures[key].result()
+
+    def done(self, key: Hashable):
+        with self._condition:
+            self._used -= self._charges.pop(key, 0)
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for future in self._futures.values():
+            future.cancel()
+
+    @property
+    def used(self):
+        return self._used
+
+    def _run(self, key: Hashable, position: int, load: Callable):
+        with self._condition:
+            while not self._closed and self._used >= self._max_bytes and position > self._taken:
+                self._condition.wait()
+            if self._closed:
+                raise domain.LambdaTimedOut('Prefetching was abandoned')
+
+        return load(lambda size: self._charge(key, size))
+
+    def _charge(self, key: Hashable, size: int):
+        with self._condition:
+            if key in self._charges:
+                self._charges[key] += size
+                self._used += size
@@ -0,0 +1,33 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from abc import ABC, abstractmethod
+
+
+class Outbox(ABC):
+    """
+    Collects outgoing messages for the current invocation so they can be sent in batches. The executor flushes it
+    when the invocation ends, whether it succeeded, failed or timed out.
+    """
+
+    @abstractmethod
+    def add(self, destination: str, entry: dict):
+        pass
+
+    @abstractmethod
+    def flush(self):
+        """Sends everything pending. Raises ff.MessageBusError if some messages could not be delivered."""
+        pass
@@ -0,0 +1,127 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import base64
+import io
+from typing import Optional, Union
+
+import firefly as ff
+from multipart import MultipartParser
+
+MEMFILE_LIMIT = 2 ** 18
+MEM_LIMIT = 6 * 2 ** 20
+
+
+class Base64Reader(io.RawIOBase):
+    """
+    Readable stream over base64 text that decodes only as much as each read asks for.
+    """
+
+    def __init__(self, data: Union[str, bytes]):
+        self._data = data
+        self._pos = 0
+        self._buffer = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, b):
+        size = len(b)
+        while len(self._buffer) < size and self._pos < len(self._data):
+            end = self._pos + -(-(size - len(self._buffer)) // 3) * 4
+            self._buffer += base64.b64decode(self._data[self._pos:end])
+            self._pos = end
+
+        chunk = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        b[:len(chunk)] = chunk
+
+        return len(chunk)
+
+
+class UploadedFile(io.RawIOBase):
+    """
+    File-like access to an uploaded part. Parts up to the memory limit are kept in memory and can be read without a
+    copy through getbuffer(); larger parts are spooled to a temporary file in /tmp by the parser.
+    """
+
+    def __init__(self, file, size: int):
+        self._file = file
+        self._size = size
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        return self._file.readinto(b)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET):
+        return self._file.seek(offset, whence)
+
+    def tell(self):
+        return self._file.tell()
+
+    def getbuffer(self) -> Optional[memoryview]:
+        if isinstance(self._file, io.BytesIO):
+            return self._file.getbuffer()
+
+    def close(self):
+        if not self.closed:
+            self._file.close()
+        super().close()
+
+    def __len__(self):
+        return self._size
+
+
+class ParseMultipart(ff.DomainService):
+    _configuration: ff.Configuration = None
+
+    def __call__(self, header: str, body: Union[str, bytes], is_base64_encoded: bool = True):
+        boundary = None
+        for part in header.split(';'):
+            if 'boundary=' in part:
+                boundary = part.split('=')[-1].strip('"')
+
+        self.debug('Boundary: %s', boundary)
+        if is_base64_encoded:
+            stream = Base64Reader(body)
+        else:
+            stream = io.BytesIO(body.encode('utf-8') if isinstance(body, str) else body)
+
+        config = self._configuration.contexts['firefly_aws']
+        parser = MultipartParser(
+            stream,
+            boundary,
+            memfile_limit=int(config.get('multipart_memory_limit', MEMFILE_LIMIT)),
+            mem_limit=MEM_LIMIT
+        )
+
+        ret = {}
+        for part in parser:
+            if part.file and part.filename is not None:
+                ret[part.name] = ff.File(
+                    name=part.filename,
+                    content=UploadedFile(part.file, part.size),
+                    content_type=part.content_type
+                )
+            else:
+                ret[part.name] = part.value
+
+        return ret
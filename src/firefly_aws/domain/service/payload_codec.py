@@ -0,0 +1,66 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import bz2
+import gzip
+from typing import Optional
+
+import firefly as ff
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec name -> S3 key extension.
+EXTENSIONS = {
+    'gzip': 'gz',
+    'zstd': 'zst',
+    'bz2': 'bz2',
+}
+
+
+def available(codec: str) -> bool:
+    return codec in EXTENSIONS and (codec != 'zstd' or zstandard is not None)
+
+
+def compress(data: bytes, codec: str) -> bytes:
+    if codec == 'gzip':
+        # Level 1 is about three times faster than the default for ~15% larger output on typical JSON payloads.
+        return gzip.compress(data, compresslevel=1)
+    if codec == 'zstd' and zstandard is not None:
+        return zstandard.ZstdCompressor(level=3).compress(data)
+    if codec == 'bz2':
+        return bz2.compress(data)
+    raise ff.ConfigurationError(f'Payload codec "{codec}" is not available')
+
+
+def decompress(data: bytes, codec: str) -> bytes:
+    if codec == 'gzip':
+        return gzip.decompress(data)
+    if codec == 'zstd' and zstandard is not None:
+        # Frames written by compress() carry their size, but stream-written ones may not.
+        return zstandard.ZstdDecompressor().decompressobj().decompress(data)
+    if codec == 'bz2':
+        return bz2.decompress(data)
+    raise ff.FrameworkError(f'Cannot decode a payload compressed with "{codec}"')
+
+
+def codec_for_key(key: str) -> Optional[str]:
+    for codec, extension in EXTENSIONS.items():
+        if key.endswith(extension):
+            return codec
+    return None
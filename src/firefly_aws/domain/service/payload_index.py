@@ -0,0 +1,66 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import threading
+from collections import OrderedDict
+from typing import Optional
+
+BLOOM_BITS = 1 << 20
+BLOOM_HASHES = 4
+
+
+class PayloadIndex:
+    """
+    What this container knows about content-addressed payloads in S3: an LRU of keys with the time their object was
+    written, and a bloom filter remembering every key ever seen, long after it has left the LRU. The LRU answers
+    "exists, written at" without a request. A bloom filter hit only means a HEAD is worth making, since it can be a
+    false positive; a miss means the key has never been seen here.
+    """
+
+    def __init__(self, size: int = 4096, bits: int = BLOOM_BITS):
+        self._size = size
+        self._bits = bits
+        self._bloom = bytearray(bits // 8)
+        self._lru = OrderedDict()
+        self._lock = threading.Lock()
+
+    def written_at(self, digest: str) -> Optional[float]:
+        with self._lock:
+            if digest not in self._lru:
+                return None
+            self._lru.move_to_end(digest)
+            return self._lru[digest]
+
+    def might_contain(self, digest: str) -> bool:
+        return all(self._bloom[i >> 3] & (1 << (i & 7)) for i in self._positions(digest))
+
+    def add(self, digest: str, written_at: float):
+        with self._lock:
+            self._lru[digest] = written_at
+            self._lru.move_to_end(digest)
+            if len(self._lru) > self._size:
+                self._lru.popitem(last=False)
+            for i in self._positions(digest):
+                self._bloom[i >> 3] |= 1 << (i & 7)
+
+    def discard(self, digest: str):
+        # Bloom filters can't forget; a stale hit just costs a HEAD.
+        with self._lock:
+            self._lru.pop(digest, None)
+
+    def _positions(self, digest: str):
+        # The digest is already uniformly distributed, so slices of it serve as the independent hash functions.
+        return [int(digest[i * 8:i * 8 + 8], 16) % self._bits for i in range(BLOOM_HASHES)]
@@ -0,0 +1,91 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import firefly as ff
+
+from .isolate_kernel_state import KERNEL_STATE, REPOSITORY_STATE
+MODES = ('full', 'incremental', 'debug')
+
+
+class ResetKernel(ff.DomainService):
+    """
+    Clears request-scoped state between invocations: the kernel's user, scopes, http request and secured flag, plus
+    the identity maps of any repository that has been used.
+
+    The firefly_aws "kernel_reset" setting picks the mode:
+        full         (default) resets the kernel and every repository, whether or not they were touched.
+        incremental  only clears state that is actually set. Checking what is set costs more than resetting
+                     unconditionally unless the registry holds many repositories with expensive resets.
+        debug        incremental, then checks that a full reset would not have changed anything and raises
+                     ff.FrameworkError if it would have.
+    """
+    _kernel: ff.Kernel = None
+    _registry: ff.Registry = None
+    _configuration: ff.Configuration = None
+
+    def __init__(self):
+        self._mode = self._configuration.contexts['firefly_aws'].get('kernel_reset', 'full')
+        if self._mode not in MODES:
+            raise ff.ConfigurationError(f'kernel_reset must be one of {", ".join(MODES)}')
+
+    def __call__(self):
+        if self._mode == 'full':
+            self._kernel.reset()
+            for repository in self._repositories():
+                repository.reset()
+            return
+
+        self._reset_dirty()
+        if self._mode == 'debug':
+            self._assert_clean()
+
+    def _reset_dirty(self):
+        kernel = self._kernel
+        for name in KERNEL_STATE:
+            if getattr(kernel, name, None) is not None:
+                setattr(kernel, name, None)
+
+        for repository in self._repositories():
+            if self._is_dirty(repository):
+                repository.reset()
+
+    def _assert_clean(self):
+        before = self._kernel_state()
+        self._kernel.reset()
+        leaked = [name for name, value in self._kernel_state().items() if before.get(name) != value]
+        leaked.extend(str(repository) for repository in self._repositories() if self._is_dirty(repository))
+
+        if leaked:
+            raise ff.FrameworkError(f'State leaked past the kernel reset: {", ".join(leaked)}')
+
+    def _kernel_state(self):
+        ret = dict(vars(self._kernel))
+        ret.update({name: getattr(self._kernel, name, None) for name in KERNEL_STATE})
+        return ret
+
+    def _repositories(self):
+        # Registry.get_repositories() logs the whole list on every call.
+        return list(getattr(self._registry, '_cache', {}).values())
+
+    @staticmethod
+    def _is_dirty(repository):
+        # getattr, not __dict__: isolated repositories keep this state in thread-local descriptors.
+        if getattr(repository, '_state', 'empty') != 'empty':
+            return True
+        for name in REPOSITORY_STATE:
+            if getattr(repository, name, None):
+                return True
+        return False
@@ -0,0 +1,199 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import hashlib
+import threading
+import uuid
+from collections import OrderedDict
+from time import time
+from typing import Optional, Tuple
+
+import firefly as ff
+
+from .json_codec import JsonCodec
+
+VARY_BY = ('params', 'user', 'tenant', 'scopes')
+LOCAL_CACHE_SIZE = 1024
+GENERATION_REFRESH = 1.0
+# DynamoDB items are capped at 400KB; larger responses are only kept in memory.
+MAX_SHARED_SIZE = 350_000
+KEY_PREFIX = 'response-cache'
+
+
+class ResponseCache(ff.DomainService):
+    """
+    Caches query results according to per-query declarations in the owning context's configuration:
+
+        contexts:
+          todo:
+            response_cache:
+              todo.GetTodos:
+                ttl: 60
+                vary_by: [params, user]
+                invalidated_by: [todo.TodoUpdated]
+
+    Lookups hit an in-process LRU first and fall back to the shared ff.Cache. Every entry key includes a generation
+    token for its query; dispatching one of the invalidating events replaces the token in the shared cache, which
+    orphans the old entries in every container. Containers re-read the token at most every "response_cache_refresh"
+    seconds (firefly_aws setting, default 1).
+    """
+    _cache: ff.Cache = None
+    _kernel: ff.Kernel = None
+    _json_codec: JsonCodec = None
+    _serializer: ff.Serializer = None
+    _configuration: ff.Configuration = None
+
+    def __init__(self):
+        config = self._configuration.contexts['firefly_aws']
+        self._size = int(config.get('response_cache_size', LOCAL_CACHE_SIZE))
+        self._refresh = float(config.get('response_cache_refresh', GENERATION_REFRESH))
+        self._local = OrderedDict()
+        self._generations = {}
+        self._lock = threading.Lock()
+        self._policies = None
+        self._invalidations = None
+
+    def policy(self, message_name: str) -> Optional[dict]:
+        if self._policies is None:
+            self._load_policies()
+        return self._policies.get(message_name)
+
+    def get(self, key: str) -> Tuple[bool, any]:
+        now = time()
+        with self._lock:
+            entry = self._local.get(key)
+            if entry is not None and entry[0] > now:
+                self._local.move_to_end(key)
+                return True, self._serializer.deserialize(entry[1])
+
+        try:
+            entry = self._cache.get(key)
+        except Exception as e:
+            self.warning('Could not read %s from the shared cache: %s', key, e)
+            entry = None
+        if not isinstance(entry, dict) or entry.get('expires_at', 0) <= now:
+            return False, None
+
+        payload = entry['body'].encode('utf-8')
+        self._remember(key, entry['expires_at'], payload)
+        return True, self._serializer.deserialize(payload)
+
+    def set(self, key: str, message: ff.Message, response):
+        if isinstance(response, (ff.Envelope, ff.File, bytes, bytearray, memoryview)):
+            return
+
+        payload = self._json_codec.encode(response)
+        # Hits are rebuilt by the serializer, so only responses it gives back unchanged are cached; entities, dates
+        # and the like would come back as plain dicts and strings.
+        if self._serializer.deserialize(payload) != response:
+            self.debug('Not caching %s: its response does not survive serialization', message)
+            return
+
+        ttl = int(self.policy(str(message)).get('ttl', 60))
+        expires_at = time() + ttl
+        self._remember(key, expires_at, payload)
+
+        if len(payload) > MAX_SHARED_SIZE:
+            return
+        try:
+            self._cache.set(key, {'expires_at': expires_at, 'body': payload.decode('utf-8')}, ttl=ttl)
+        except Exception as e:
+            self.warning('Could not write %s to the shared cache: %s', key, e)
+
+    def invalidate(self, event_name: str):
+        if self._invalidations is None:
+            self._load_policies()
+
+        for message_name in self._invalidations.get(event_name, ()):
+            generation = uuid.uuid4().hex
+            with self._lock:
+                self._generations[message_name] = (time(), generation)
+                prefix = self._entry_prefix(message_name)
+                for key in [k for k in self._local if k.startswith(prefix)]:
+                    del self._local[key]
+            try:
+                self._cache.set(self._generation_key(message_name), generation)
+            except Exception as e:
+                self.warning('Could not invalidate cached responses for %s: %s', message_name, e)
+
+    def key(self, message: ff.Message) -> str:
+        """The entry the message's response is stored under, for the current generation of its query."""
+        message_name = str(message)
+        vary_by = self.policy(message_name).get('vary_by', ('params', 'user'))
+        user = self._kernel.user
+        parts = []
+        if 'params' in vary_by:
+            parts.append({k: v for k, v in message.to_dict().items() if not k.startswith('_') and k != 'headers'})
+        if 'user' in vary_by:
+            parts.append(getattr(user, 'id', None))
+        if 'tenant' in vary_by:
+            parts.append(getattr(user, 'tenant', None))
+        if 'scopes' in vary_by:
+            parts.append(sorted(getattr(user, 'scopes', None) or []))
+
+        digest = hashlib.blake2b(self._json_codec.encode(parts), digest_size=16).hexdigest()
+        return f'{self._entry_prefix(message_name)}{self._generation(message_name)}:{digest}'
+
+    def _generation(self, message_name: str):
+        now = time()
+        with self._lock:
+            checked_at, generation = self._generations.get(message_name, (0.0, None))
+        if now - checked_at < self._refresh:
+            return generation
+
+        try:
+            generation = self._cache.get(self._generation_key(message_name)) or '0'
+        except Exception as e:
+            self.warning('Could not read the cache generation of %s: %s', message_name, e)
+            generation = generation or '0'
+        with self._lock:
+            self._generations[message_name] = (now, generation)
+
+        return generation
+
+    # Keys must not contain ".", which DdbCache treats as a path into a stored document.
+    @staticmethod
+    def _entry_prefix(message_name: str):
+        return f'{KEY_PREFIX}:{message_name}:'.replace('.', ':')
+
+    @staticmethod
+    def _generation_key(message_name: str):
+        return f'{KEY_PREFIX}-generation:{message_name}'.replace('.', ':')
+
+    def _remember(self, key: str, expires_at: float, payload: bytes):
+        with self._lock:
+            self._local[key] = (expires_at, payload)
+            self._local.move_to_end(key)
+            if len(self._local) > self._size:
+                self._local.popitem(last=False)
+
+    def _load_policies(self):
+        policies = {}
+        invalidations = {}
+        for context in self._configuration.contexts.values():
+            for message_name, policy in ((context or {}).get('response_cache') or {}).items():
+                policy = dict(policy or {})
+                unknown = set(policy.get('vary_by', ())) - set(VARY_BY)
+                if unknown:
+                    raise ff.ConfigurationError(
+                        f'Unknown vary_by for {message_name}: {", ".join(sorted(unknown))}. '
+                        f'Use any of {", ".join(VARY_BY)}'
+                    )
+                policies[message_name] = policy
+                for event_name in policy.get('invalidated_by', ()):
+                    invalidations.setdefault(event_name, []).append(message_name)
+
+        self._policies, self._invalidations = policies, invalidations
@@ -0,0 +1,75 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import zlib
+from typing import Iterable, Iterator, Optional, Union
+
+import firefly as ff
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# In order of preference when the client weights several encodings equally.
+ENCODINGS = ('br', 'gzip', 'deflate')
+
+
+class ResponseCompressor(ff.DomainService):
+    def available_encodings(self):
+        return tuple(e for e in ENCODINGS if e != 'br' or brotli is not None)
+
+    def negotiate(self, accept_encoding: Optional[str]) -> Optional[str]:
+        if not accept_encoding:
+            return None
+
+        weights = {}
+        for item in accept_encoding.split(','):
+            parts = item.strip().split(';')
+            coding = parts[0].strip().lower()
+            q = 1.0
+            for param in parts[1:]:
+                name, _, value = param.strip().partition('=')
+                if name.strip() == 'q':
+                    try:
+                        q = float(value)
+                    except ValueError:
+                        q = 0.0
+            if coding:
+                weights[coding] = q
+
+        best = None
+        best_q = 0.0
+        for encoding in self.available_encodings():
+            q = weights.get(encoding, weights.get('*', 0.0))
+            if q > best_q:
+                best, best_q = encoding, q
+
+        return best
+
+    def compress(self, chunks: Iterable[Union[str, bytes]], encoding: str) -> Iterator[bytes]:
+        if encoding == 'br':
+            compressor = brotli.Compressor(quality=5)
+            compress, flush = compressor.process, compressor.finish
+        else:
+            compressor = zlib.compressobj(6, zlib.DEFLATED, 31 if encoding == 'gzip' else 15)
+            compress, flush = compressor.compress, compressor.flush
+
+        for chunk in chunks:
+            data = compress(chunk.encode('utf-8') if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield flush()
@@ -0,0 +1,45 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import inspect
+from abc import ABC, abstractmethod
+from typing import NamedTuple, Optional, Tuple, List
+
+import firefly as ff
+
+
+class IndexedRoute(NamedTuple):
+    endpoint: ff.HttpEndpoint
+    message_name: str
+    secured: bool
+    scopes: List[str]
+
+    @classmethod
+    def from_endpoint(cls, endpoint: ff.HttpEndpoint):
+        if endpoint.message is not None:
+            message_name = endpoint.message if isinstance(endpoint.message, str) else endpoint.message.get_fqn()
+        else:
+            message_name = endpoint.service
+            if inspect.isclass(message_name):
+                message_name = message_name.get_fqn()
+
+        return cls(endpoint=endpoint, message_name=message_name, secured=endpoint.secured, scopes=endpoint.scopes)
+
+
+class RouteIndex(ff.RestRouter, ABC):
+    @abstractmethod
+    def lookup(self, route: str, method: str = 'get') -> Tuple[Optional[IndexedRoute], Optional[dict]]:
+        pass
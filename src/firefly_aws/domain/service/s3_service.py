@@ -15,9 +15,19 @@
 from __future__ import annotations
 
 from abc import ABC, abstractmethod
+from typing import Iterable, Optional, Tuple, Union
 
 
 class S3Service(ABC):
     @abstractmethod
     def store_download(self, data: str, extension: str = None, file_name: str = None, apply_compression: bool = True):
         pass
+
+    @abstractmethod
+    def spool_download(self, chunks: Iterable[Union[str, bytes]], max_inline_size: int, content_encoding: str = None,
+                       content_type: str = None) -> Tuple[Optional[Union[str, bytes]], Optional[str]]:
+        """
+        Returns (data, None) when the chunks add up to no more than max_inline_size. Otherwise the chunks are streamed
+        to S3 and (None, download_url) is returned.
+        """
+        pass
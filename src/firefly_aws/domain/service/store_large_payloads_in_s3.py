@@ -1,29 +1,140 @@
 from __future__ import annotations
 
+import base64
+import hashlib
 import uuid
+from time import time
+from typing import Optional, Union
 
 import firefly as ff
 
+import firefly_aws.domain as domain
+from . import payload_codec
+from .payload_index import PayloadIndex
+
+INLINE_THRESHOLD = 64_000
+# SNS and SQS accept 256KB per message, which also has to hold the attributes and the rest of the envelope.
+MAX_INLINE_SIZE = 240_000
+DIGEST_SIZE = 20
+# Hex characters of the digest used as a prefix; S3 scales request rates per prefix.
+SHARD_WIDTH = 2
+# The bucket's lifecycle rule expires tmp/ objects after a day, so older objects are uploaded again rather than reused.
+MAX_REUSE_AGE = 12 * 3600
+REFS_TTL = 2 * 86400
+INDEX_SIZE = 4096
+
 
 class StoreLargePayloadsInS3(ff.DomainService):
+    """
+    Payloads over 64,000 bytes are compressed with the "payload_codec" firefly_aws setting (gzip by default, zstd
+    when zstandard is installed, none to disable compression). If the base64 encoded result fits in
+    "max_inline_payload_size" bytes it travels inline as {"PAYLOAD_CODEC": ..., "PAYLOAD": ...}; otherwise the
+    compressed bytes go to S3 and only a PAYLOAD_KEY is sent. LoadPayload reverses either envelope.
+
+    Stored objects are keyed by a hash of their content under sharded prefixes (tmp/<shard>/<digest>.json.gz), so
+    the same payload is only uploaded once. "payload_dedupe" decides how hard to look for an existing object:
+    "local" (default) trusts what this container has written or seen, checking with a HEAD only on a bloom filter
+    hit; "shared" also makes a HEAD for content this container has never seen; "off" always uploads.
+
+    With "payload_early_delete" enabled, payloads with a known number of consumers (queued commands, sync responses)
+    are uploaded under a key of their own, reference counted in the cache and deleted by LoadPayload.release() once
+    every consumer is done with them. They are never shared: a producer reusing an object could otherwise race its
+    last consumer's delete. Events fan out to an unknown number of subscribers and are left to the lifecycle rule.
+    """
     _s3_client = None
-    _serializer: ff.Serializer = None
+    _cache: ff.Cache = None
+    _json_codec: domain.JsonCodec = None
+    _configuration: ff.Configuration = None
     _bucket: str = None
 
-    def __call__(self, payload: str, name: str, context: str, type_: str, id_: str):
-        if len(payload) > 64_000:
-            key = f'tmp/{str(uuid.uuid1())}.json'
+    def __init__(self):
+        self._index: Optional[PayloadIndex] = None
+
+    def __call__(self, payload: Union[str, bytes], name: str, context: str, type_: str, id_: str,
+                 consumers: int = None) -> bytes:
+        if isinstance(payload, str):
+            payload = payload.encode('utf-8')
+
+        if len(payload) <= INLINE_THRESHOLD:
+            return payload
+
+        envelope = {
+            '_name': name,
+            '_type': type_,
+            '_context': context,
+            '_id': id_,
+        }
+        config = self._configuration.contexts['firefly_aws']
+        codec = config.get('payload_codec', 'gzip')
+        body = payload
+        if codec == 'none':
+            extension = '.json'
+        else:
+            if not payload_codec.available(codec):
+                raise ff.ConfigurationError(f'Payload codec "{codec}" is not available')
+            body = payload_codec.compress(payload, codec)
+            inline = base64.b64encode(body)
+            if len(inline) <= int(config.get('max_inline_payload_size', MAX_INLINE_SIZE)):
+                return self._json_codec.encode(dict(envelope, PAYLOAD_CODEC=codec, PAYLOAD=inline.decode('ascii')))
+            extension = f'.json.{payload_codec.EXTENSIONS[codec]}'
+
+        # Hashed before compression: compressed output isn't stable (gzip headers carry a timestamp).
+        digest = self._digest(payload, codec)
+        if consumers is not None and config.get('payload_early_delete') is True:
+            key = self._key(digest, f'-{uuid.uuid4().hex}{extension}')
+            self._cache.increment(refs_key(key), consumers, ttl=REFS_TTL)
             self._s3_client.put_object(
-                Body=payload,
+                Body=body,
                 Bucket=self._bucket,
                 Key=key
             )
-            return self._serializer.serialize({
-                'PAYLOAD_KEY': key,
-                '_name': name,
-                '_type': type_,
-                '_context': context,
-                '_id': id_,
-            })
-
-        return payload
+            envelope.update(PAYLOAD_KEY=key, PAYLOAD_RELEASE=True)
+            return self._json_codec.encode(envelope)
+
+        key = self._key(digest, extension)
+        envelope['PAYLOAD_KEY'] = key
+        if not self._exists(key, digest, config.get('payload_dedupe', 'local')):
+            self._s3_client.put_object(
+                Body=body,
+                Bucket=self._bucket,
+                Key=key
+            )
+            self._get_index(config).add(digest, time())
+
+        return self._json_codec.encode(envelope)
+
+    def _exists(self, key: str, digest: str, dedupe: str) -> bool:
+        index = self._get_index(self._configuration.contexts['firefly_aws'])
+        written_at = index.written_at(digest)
+        if written_at is None:
+            if dedupe == 'off' or (dedupe != 'shared' and not index.might_contain(digest)):
+                return False
+            try:
+                written_at = self._s3_client.head_object(Bucket=self._bucket, Key=key)['LastModified'].timestamp()
+            except Exception:
+                # Missing, or we can't tell; uploading again is always safe.
+                return False
+            index.add(digest, written_at)
+
+        return time() - written_at < MAX_REUSE_AGE
+
+    def _get_index(self, config: dict) -> PayloadIndex:
+        if self._index is None:
+            self._index = PayloadIndex(int(config.get('payload_index_size', INDEX_SIZE)))
+        return self._index
+
+    @staticmethod
+    def _digest(payload: bytes, codec: str) -> str:
+        # The codec is part of what is stored, so the same content under another codec is a different object.
+        hasher = hashlib.blake2b(codec.encode('ascii'), digest_size=DIGEST_SIZE)
+        hasher.update(payload)
+        return hasher.hexdigest()
+
+    @staticmethod
+    def _key(digest: str, suffix: str) -> str:
+        return f'tmp/{digest[:SHARD_WIDTH]}/{digest}{suffix}'
+
+
+def refs_key(payload_key: str) -> str:
+    # Cache keys can't contain dots.
+    return f'payload-refs:{payload_key.rsplit("/", 1)[-1].split(".")[0]}'
@@ -0,0 +1,45 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import firefly as ff
+import firefly_di as di
+
+WARMER_KEY = 'firefly_warmer'
+
+
+class WarmUp(ff.DomainService):
+    """
+    Runs on warmer invocations. Resolves the container services named in the firefly_aws "warm" setting so they're
+    built before the next real request, and calls warm_up() on any of them that has one (to open connections, fill
+    caches, etc.)
+    """
+    _container: di.Container = None
+    _configuration: ff.Configuration = None
+
+    def __call__(self):
+        for name in self._configuration.contexts['firefly_aws'].get('warm') or []:
+            try:
+                service = getattr(self._container, name)
+            except AttributeError:
+                self.warning('Nothing named %s to warm up', name)
+                continue
+
+            warm_up = getattr(service, 'warm_up', None)
+            if callable(warm_up):
+                try:
+                    warm_up()
+                except Exception as e:
+                    self.warning('Warming up %s failed: %s', name, e)
@@ -173,7 +173,7 @@ class DataApiStorageInterface(ffi.RdbStorageInterface, ABC):
         ret = []
         q = self._identifier_quote_char
         sql = sql.replace(f'select {q}document{q}', 'select id')
-        result = ff.retry(lambda: self._execute(sql, params))
+        result = self._execute(sql, params)
         for row in result:
             ret.append(self._fetch_large_document(row['id'], entity))
         return ret
@@ -212,7 +212,7 @@ class DataApiStorageInterface(ffi.RdbStorageInterface, ABC):
 
     def _get_result_count(self, sql: str, params: list):
         count_sql = f"select count(1) as c from ({sql}) a"
-        result = ff.retry(lambda: self._execute(count_sql, params))
+        result = self._execute(count_sql, params)
         return result[0]['c']
 
     def _paginate(self, sql: str, params: list, entity: Type[ff.Entity], raw: bool = False):
@@ -249,11 +249,7 @@ class DataApiStorageInterface(ffi.RdbStorageInterface, ABC):
         return ret
 
     def _load_query_results(self, sql: str, params: list, limit: int, offset: int):
-        return ff.retry(
-            lambda: self._execute(f'{sql} limit {limit} offset {offset}', params),
-            should_retry=lambda err: 'Database returned more than the allowed response size limit'
-                                     not in str(err) and '(413)' not in str(err)
-        )
+        return self._execute(f'{sql} limit {limit} offset {offset}', params)
 
     def _get_average_row_size(self, entity: Type[ff.Entity]):
         result = self._execute(f"select CEIL(AVG(LENGTH(document))) as c from {self._fqtn(entity)}")
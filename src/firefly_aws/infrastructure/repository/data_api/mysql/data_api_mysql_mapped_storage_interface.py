@@ -41,7 +41,7 @@ class DataApiMysqlMappedStorageInterface(DataApiMysqlBase):
             where table_schema = '{schema}'
             and table_name = '{table}'
         """
-        result = ff.retry(lambda: self._execute(sql))
+        result = self._execute(sql)
         try:
             return result[0]['AVG_ROW_LENGTH'] / 1024
         except KeyError:
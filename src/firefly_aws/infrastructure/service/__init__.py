@@ -14,6 +14,7 @@
 
 from .agent import *
 from .boto_message_transport import BotoMessageTransport
+from .boto_outbox import BotoOutbox
 from .boto_s3_service import BotoS3Service
 from .cognito_jwt_decoder import CognitoJwtDecoder
 from .data_api import DataApi
@@ -21,4 +22,8 @@ from .ddb_cache import DdbCache
 from .ddb_mutex import DdbMutex
 from .ddb_rate_limiter import DdbRateLimiter
 from .ddb_resource_monitor import *
+from .orjson_codec import OrjsonCodec
+from .retry_policy import RetryPolicy, CircuitBreaker
 from .s3_file_system import S3FileSystem
+from .stdlib_json_codec import StdlibJsonCodec
+from .trie_rest_router import TrieRestRouter
@@ -38,6 +38,8 @@
 
 from __future__ import annotations
 
+import hashlib
+import json
 import os
 import shutil
 from datetime import datetime
@@ -51,7 +53,10 @@ import yaml
 from botocore.exceptions import ClientError
 from troposphere import Template, GetAtt, Ref, Parameter, Output, Export, ImportValue, Join
 from troposphere.apigatewayv2 import Api, Stage, Deployment, Integration, Route
-from troposphere.awslambda import Function, Code, VPCConfig, Environment, Permission, EventSourceMapping
+from troposphere.applicationautoscaling import ScalableTarget, ScalingPolicy, \
+    TargetTrackingScalingPolicyConfiguration, PredefinedMetricSpecification
+from troposphere.awslambda import Function, Code, VPCConfig, Environment, Permission, EventSourceMapping, Alias, \
+    Version, ProvisionedConcurrencyConfiguration, DestinationConfig, OnFailure
 from troposphere.constants import NUMBER
 from troposphere.dynamodb import Table, AttributeDefinition, KeySchema, TimeToLiveSpecification
 from troposphere.events import Target, Rule
@@ -62,7 +67,10 @@ from troposphere.sqs import Queue, QueuePolicy, RedrivePolicy
 import troposphere.kinesis as kinesis
 import troposphere.kinesisanalyticsv2 as analytics
 
-from firefly_aws import S3Service, ResourceNameAware
+from firefly_aws import S3Service, ResourceNameAware, WARMER_KEY
+from firefly_aws.domain.service import kinesis_aggregation
+
+SYNC_ALIAS = 'live'
 
 
 @ff.agent('aws')
@@ -73,6 +81,7 @@ class AwsAgent(ff.Agent, ResourceNameAware, ff.LoggerAware):
     _s3_client = None
     _s3_service: S3Service = None
     _sns_client = None
+    _kinesis_client = None
     _cloudformation_client = None
     _adaptive_memory = None
 
@@ -177,6 +186,9 @@ class AwsAgent(ff.Agent, ResourceNameAware, ff.LoggerAware):
             **params
         ))
 
+        sync_alias = self._add_provisioned_concurrency(template, context, api_lambda)
+        self._add_warmer(template, context, api_lambda, sync_alias)
+
         route = inflection.dasherize(context.name)
         proxy_route = f'{route}/{{proxy+}}'
         template.add_resource(Permission(
@@ -197,6 +209,25 @@ class AwsAgent(ff.Agent, ResourceNameAware, ff.LoggerAware):
             ]),
             DependsOn=api_lambda
         ))
+        if sync_alias is not None:
+            template.add_resource(Permission(
+                f'{self._lambda_resource_name(service.name)}SyncAliasPermission',
+                Action='lambda:InvokeFunction',
+                FunctionName=Ref(sync_alias),
+                Principal='apigateway.amazonaws.com',
+                SourceArn=Join('', [
+                    'arn:aws:execute-api:',
+                    self._region,
+                    ':',
+                    self._account_id,
+                    ':',
+                    ImportValue(self._rest_api_reference()),
+                    '/*/*/',
+                    route,
+                    '*'
+                ]),
+                DependsOn=sync_alias
+            ))
 
         if self._adaptive_memory:
             value = '3008' if not self._adaptive_memory else '256'
@@ -292,7 +323,7 @@ class AwsAgent(ff.Agent, ResourceNameAware, ff.LoggerAware):
                 self._account_id,
                 ':function:',
                 Ref(api_lambda),
-            ]),
+            ] + ([':', SYNC_ALIAS] if sync_alias is not None else [])),
         ))
 
         template.add_resource(Route(
@@ -364,18 +395,26 @@ class AwsAgent(ff.Agent, ResourceNameAware, ff.LoggerAware):
 
         template.add_resource(EventSourceMapping(
             f'{self._lambda_resource_name(context.name)}AsyncMapping',
-            BatchSize=1,
             Enabled=True,
             EventSourceArn=GetAtt(queue, 'Arn'),
             FunctionName=self._lambda_function_name(service.name, 'Async'),
-            DependsOn=[queue, async_lambda]
+            DependsOn=[queue, async_lambda],
+            **self._event_source_mapping_params(context)
         ))
         topic = template.add_resource(Topic(
             self._topic_name(context.name),
             TopicName=self._topic_name(context.name)
         ))
+        stream = self._add_event_stream(template, context)
 
+        kinesis_events = kinesis_aggregation.partition_key_fields(self._aws_config)
         for context_name, list_ in subscriptions.items():
+            # Events published to Kinesis reach this context through a mapping on the publisher's stream, not SNS.
+            streamed = [x for x in list_ if f'{context_name}.{x["name"]}' in kinesis_events]
+            if len(streamed) > 0:
+                self._add_event_stream_mapping(template, context, context_name, async_lambda, dlq, stream)
+                list_ = [x for x in list_ if x not in streamed]
+
             if context_name == context.name and len(list_) > 0:
                 template.add_resource(SubscriptionResource(
                     self._subscription_name(context_name),
@@ -658,13 +697,165 @@ class AwsAgent(ff.Agent, ResourceNameAware, ff.LoggerAware):
 
             template.add_resource(EventSourceMapping(
                 f'{self._lambda_resource_name(context.name, memory=memory)}AsyncMapping',
-                BatchSize=1,
                 Enabled=True,
                 EventSourceArn=GetAtt(queue, 'Arn'),
                 FunctionName=self._lambda_function_name(context.name, 'Async', memory=memory),
-                DependsOn=[queue, adaptive_memory_lambda]
+                DependsOn=[queue, adaptive_memory_lambda],
+                **self._event_source_mapping_params(context)
             ))
 
+    def _add_event_stream(self, template, context: ff.Context):
+        kinesis_events = kinesis_aggregation.partition_key_fields(self._aws_config)
+        if not any(name.split('.')[0] == context.name for name in kinesis_events):
+            return None
+
+        return template.add_resource(kinesis.Stream(
+            self._event_stream_name(context.name),
+            Name=self._event_stream_name(context.name),
+            ShardCount=int(self._aws_config.get('kinesis_shards', 1))
+        ))
+
+    def _add_event_stream_mapping(self, template, context: ff.Context, stream_context: str, async_lambda, dlq,
+                                  stream=None):
+        depends_on = [async_lambda, dlq]
+        if stream_context == context.name:
+            depends_on.append(stream)
+        elif stream_context not in self._context_map.contexts:
+            self._find_or_create_stream(stream_context)
+
+        # Ordering matters on a stream, so a failing record is retried (and its batch bisected down to it) before
+        # its shard moves on. Records that still fail are reported to the dead letter queue.
+        template.add_resource(EventSourceMapping(
+            self._event_stream_mapping_name(context.name, stream_context),
+            Enabled=True,
+            EventSourceArn=self._event_stream_arn(stream_context),
+            FunctionName=self._lambda_function_name(context.name, 'Async'),
+            StartingPosition='LATEST',
+            BatchSize=int(self._aws_config.get('kinesis_batch_size', 100)),
+            FunctionResponseTypes=['ReportBatchItemFailures'],
+            BisectBatchOnFunctionError=True,
+            MaximumRetryAttempts=int(self._aws_config.get('kinesis_max_retries', 3)),
+            DestinationConfig=DestinationConfig(OnFailure=OnFailure(Destination=GetAtt(dlq, 'Arn'))),
+            DependsOn=depends_on
+        ))
+
+    def _extension_config(self, context: ff.Context):
+        config = dict(self._aws_config)
+        config.update(((context.config.get('extensions') or {}).get('firefly_aws') or {}))
+
+        return config
+
+    def _add_provisioned_concurrency(self, template, context: ff.Context, api_lambda):
+        setting = self._extension_config(context).get('provisioned_concurrency')
+        if not setting:
+            return None
+        if not isinstance(setting, dict):
+            setting = {'min': setting}
+
+        minimum = int(setting.get('min', 1))
+        maximum = int(setting.get('max', minimum))
+        if maximum < minimum:
+            raise ff.ConfigurationError('provisioned_concurrency max must not be lower than min')
+
+        # Versions are immutable, so a new one is published whenever the function's code or configuration changes. The
+        # logical id follows that: deploying the same function again keeps the version the alias points at.
+        digest = hashlib.sha256(
+            json.dumps(api_lambda.to_dict(), sort_keys=True, default=str).encode('utf-8')
+        ).hexdigest()[:10]
+        version = template.add_resource(Version(
+            f'{self._lambda_resource_name(context.name)}SyncVersion{digest}',
+            FunctionName=Ref(api_lambda)
+        ))
+        alias = template.add_resource(Alias(
+            f'{self._lambda_resource_name(context.name)}SyncAlias',
+            FunctionName=Ref(api_lambda),
+            FunctionVersion=GetAtt(version, 'Version'),
+            Name=SYNC_ALIAS,
+            ProvisionedConcurrencyConfig=ProvisionedConcurrencyConfiguration(
+                ProvisionedConcurrentExecutions=minimum
+            )
+        ))
+
+        if maximum > minimum:
+            target = template.add_resource(ScalableTarget(
+                f'{self._lambda_resource_name(context.name)}SyncScalableTarget',
+                MinCapacity=minimum,
+                MaxCapacity=maximum,
+                ResourceId=Join('', ['function:', Ref(api_lambda), f':{SYNC_ALIAS}']),
+                RoleARN=f'arn:aws:iam::{self._account_id}:role/aws-service-role/'
+                        f'lambda.application-autoscaling.amazonaws.com/'
+                        f'AWSServiceRoleForApplicationAutoScaling_LambdaConcurrency',
+                ScalableDimension='lambda:function:ProvisionedConcurrency',
+                ServiceNamespace='lambda',
+                DependsOn=alias
+            ))
+            template.add_resource(ScalingPolicy(
+                f'{self._lambda_resource_name(context.name)}SyncScalingPolicy',
+                PolicyName=f'{self._service_name(context.name)}SyncProvisionedConcurrency',
+                PolicyType='TargetTrackingScaling',
+                ScalingTargetId=Ref(target),
+                TargetTrackingScalingPolicyConfiguration=TargetTrackingScalingPolicyConfiguration(
+                    TargetValue=float(setting.get('target_utilization', 0.7)),
+                    PredefinedMetricSpecification=PredefinedMetricSpecification(
+                        PredefinedMetricType='LambdaProvisionedConcurrencyUtilization'
+                    )
+                )
+            ))
+
+        return alias
+
+    def _add_warmer(self, template, context: ff.Context, api_lambda, sync_alias=None):
+        setting = self._extension_config(context).get('warmer')
+        if not setting:
+            return
+        if not isinstance(setting, dict):
+            setting = {}
+
+        invoked = Ref(sync_alias) if sync_alias is not None else GetAtt(api_lambda, 'Arn')
+        rule = template.add_resource(Rule(
+            f'{self._lambda_resource_name(context.name)}WarmerRule',
+            ScheduleExpression=setting.get('schedule', 'rate(5 minutes)'),
+            State='ENABLED',
+            Targets=[Target(
+                f'{self._service_name(context.name)}WarmerTarget',
+                Arn=invoked,
+                Id=f'{self._lambda_resource_name(context.name)}Warmer',
+                Input=f'{{"{WARMER_KEY}": true}}'
+            )]
+        ))
+        template.add_resource(Permission(
+            f'{self._lambda_resource_name(context.name)}WarmerPermission',
+            Action='lambda:invokeFunction',
+            Principal='events.amazonaws.com',
+            FunctionName=invoked,
+            SourceArn=GetAtt(rule, 'Arn')
+        ))
+
+    def _event_source_mapping_params(self, context: ff.Context):
+        config = self._extension_config(context)
+
+        batch_size = int(config.get('batch_size', 1))
+        batching_window = int(config.get('batching_window', 0))
+        if batch_size > 10 and batching_window < 1:
+            raise ff.ConfigurationError('A batching_window is required when batch_size is greater than 10')
+
+        params = {
+            'BatchSize': batch_size,
+            'FunctionResponseTypes': ['ReportBatchItemFailures'],
+        }
+        if batching_window > 0:
+            params['MaximumBatchingWindowInSeconds'] = batching_window
+
+        maximum_concurrency = config.get('maximum_concurrency')
+        if maximum_concurrency is not None:
+            try:
+                from troposphere.awslambda import ScalingConfig
+            except ImportError:
+                raise ff.ConfigurationError('maximum_concurrency requires a version of troposphere with ScalingConfig')
+            params['ScalingConfig'] = ScalingConfig(MaximumConcurrency=int(maximum_concurrency))
+
+        return params
+
     def _migrate_schema(self, context: ff.Context):
         for entity in context.entities:
             if issubclass(entity, ff.AggregateRoot) and entity is not ff.AggregateRoot:
@@ -689,6 +880,17 @@ class AwsAgent(ff.Agent, ResourceNameAware, ff.LoggerAware):
             self.info(f'Creating stack for context "{context_name}"')
             self._create_stack(self._stack_name(context_name), template)
 
+    def _find_or_create_stream(self, context_name: str):
+        stream_name = self._event_stream_name(context_name)
+        try:
+            self._kinesis_client.describe_stream_summary(StreamName=stream_name)
+        except ClientError:
+            self.info(f'Creating event stream for context "{context_name}"')
+            self._kinesis_client.create_stream(
+                StreamName=stream_name, ShardCount=int(self._aws_config.get('kinesis_shards', 1))
+            )
+            self._kinesis_client.get_waiter('stream_exists').wait(StreamName=stream_name)
+
     @staticmethod
     def _get_subscriptions(context: ff.Context):
         ret = []
@@ -22,47 +22,48 @@ import firefly_aws as domain
 from botocore.exceptions import ClientError
 from firefly import Query, Command, Event
 
+from firefly_aws.domain.service import kinesis_aggregation
+from .boto_timeouts import with_read_timeout
+from .retry_policy import RetryPolicy
+
 
 class BotoMessageTransport(ff.MessageTransport, domain.ResourceNameAware):
     _serializer: ff.Serializer = None
+    _json_codec: domain.JsonCodec = None
     _store_large_payloads_in_s3: domain.StoreLargePayloadsInS3 = None
     _load_payload: domain.LoadPayload = None
+    _execution_context: domain.ExecutionContext = None
+    _outbox: domain.Outbox = None
+    _retry_policy: RetryPolicy = None
+    _configuration: ff.Configuration = None
     _lambda_client = None
     _sns_client = None
-    _sqs_resource = None
+    _sqs_client = None
     _s3_client = None
     _bucket: str = None
     _context: str = None
 
+    def __init__(self):
+        self._queue_urls = {}
+        self._partition_key_fields = None
+
     def dispatch(self, event: Event) -> None:
         try:
             if hasattr(event, '_memory'):
                 self._enqueue_message(event, context=self._context)
+            elif str(event) in self._kinesis_events():
+                self._put_record(event)
             else:
-                self._sns_client.publish(
-                    TopicArn=self._topic_arn(event.get_context()),
-                    Message=self._store_large_payloads_in_s3(
-                        self._serializer.serialize(event),
+                self._send(self._topic_arn(event.get_context()), {
+                    'Message': self._store_large_payloads_in_s3(
+                        self._json_codec.encode(event),
                         name=event.__class__.__name__,
                         type_='command' if isinstance(event, ff.Command) else 'event',
                         context=event.get_context(),
                         id_=getattr(event, '_id', str(uuid.uuid4()))
-                    ),
-                    MessageAttributes={
-                        '_name': {
-                            'DataType': 'String',
-                            'StringValue': event.__class__.__name__,
-                        },
-                        '_type': {
-                            'DataType': 'String',
-                            'StringValue': 'event'
-                        },
-                        '_context': {
-                            'DataType': 'String',
-                            'StringValue': event.get_context()
-                        },
-                    }
-                )
+                    ).decode('utf-8'),
+                    'MessageAttributes': self._message_attributes(event, 'event'),
+                })
         except ClientError as e:
             raise ff.MessageBusError(str(e))
 
@@ -76,36 +77,110 @@ class BotoMessageTransport(ff.MessageTransport, domain.ResourceNameAware):
         if hasattr(message, '_async') and getattr(message, '_async') is True:
             return self._enqueue_message(message)
 
+        # Messages sent so far go out before handing work to another function, so it can rely on them.
+        self._outbox.flush()
+
+        deadline = self._execution_context.deadline
+        function_name = f'{self._service_name(message.get_context())}Sync'
         try:
-            response = ff.retry(
-                lambda: self._lambda_client.invoke(
-                    FunctionName=f'{self._service_name(message.get_context())}Sync',
+            response = self._retry_policy(
+                function_name,
+                lambda: with_read_timeout(self._lambda_client, deadline.timeout()).invoke(
+                    FunctionName=function_name,
                     InvocationType='RequestResponse',
                     LogType='None',
-                    Payload=self._serializer.serialize(message)
+                    Payload=self._json_codec.encode(message)
                 ),
-                wait=2
+                # A command that timed out may still be running; sending it again could apply it twice.
+                retry_timeouts=not isinstance(message, Command)
             )
-        except ClientError as e:
+        except (ClientError, domain.CircuitOpen) as e:
             raise ff.MessageBusError(str(e))
 
-        ret = self._serializer.deserialize(response['Payload'].read().decode('utf-8'))
-        if isinstance(ret, dict) and 'PAYLOAD_KEY' in ret:
-            ret = self._load_payload(ret['PAYLOAD_KEY'])
+        ret = self._json_codec.decode(response['Payload'].read())
+        if self._load_payload.is_reference(ret):
+            message = self._load_payload(ret)
+            self._load_payload.release(ret)
+            return message
 
-        return ret
+        return self._serializer.deserialize(ret)
 
     def _enqueue_message(self, message: ff.Message, context: str = None):
         memory = None
         if hasattr(message, '_memory'):
             memory = getattr(message, '_memory')
-        queue = self._sqs_resource.get_queue_by_name(
-            QueueName=self._queue_name(context or message.get_context(), memory=memory)
-        )
-        queue.send_message(MessageBody=self._store_large_payloads_in_s3(
-            self._serializer.serialize(message),
-            name=message.__class__.__name__,
-            type_='command' if isinstance(message, ff.Command) else 'event',
-            context=message.get_context(),
-            id_=getattr(message, '_id', str(uuid.uuid4()))
-        ))
+        type_ = 'command' if isinstance(message, ff.Command) else 'event'
+        # Messages passed on by the adaptive memory router are sent the way they were received.
+        body = getattr(message, '_raw_body', None)
+        if body is None:
+            body = self._store_large_payloads_in_s3(
+                self._json_codec.encode(message),
+                name=message.__class__.__name__,
+                type_=type_,
+                context=message.get_context(),
+                id_=getattr(message, '_id', str(uuid.uuid4())),
+                consumers=1
+            ).decode('utf-8')
+        self._send(self._queue_url(self._queue_name(context or message.get_context(), memory=memory)), {
+            'MessageBody': body,
+            'MessageAttributes': self._message_attributes(message, type_),
+        })
+
+    def _put_record(self, event: Event):
+        field = self._kinesis_events()[str(event)]
+        partition_key = getattr(event, field, None)
+        if partition_key is None:
+            # Without an aggregate id there's no ordering to keep; spread the events over the shards.
+            partition_key = getattr(event, '_id', None) or str(uuid.uuid4())
+
+        self._send(self._event_stream_arn(event.get_context()), {
+            'Data': self._store_large_payloads_in_s3(
+                self._json_codec.encode(event),
+                name=event.__class__.__name__,
+                type_='event',
+                context=event.get_context(),
+                id_=getattr(event, '_id', str(uuid.uuid4()))
+            ),
+            'PartitionKey': str(partition_key),
+        })
+
+    def _kinesis_events(self):
+        if self._partition_key_fields is None:
+            self._partition_key_fields = {}
+            if self._configuration is not None:
+                self._partition_key_fields = kinesis_aggregation.partition_key_fields(
+                    self._configuration.contexts.get('firefly_aws') or {}
+                )
+
+        return self._partition_key_fields
+
+    @staticmethod
+    def _message_attributes(message: ff.Message, type_: str):
+        # Lets consumers tell what a message is before parsing it.
+        return {
+            '_name': {
+                'DataType': 'String',
+                'StringValue': message.__class__.__name__,
+            },
+            '_type': {
+                'DataType': 'String',
+                'StringValue': type_
+            },
+            '_context': {
+                'DataType': 'String',
+                'StringValue': message.get_context()
+            },
+        }
+
+    def _send(self, destination: str, entry: dict):
+        self._outbox.add(destination, entry)
+        # Outside of an invocation nothing would flush the outbox later.
+        if self._execution_context.context is None:
+            self._outbox.flush()
+
+    def _queue_url(self, queue_name: str):
+        # Resolved once per container; a queue's URL never changes.
+        if queue_name not in self._queue_urls:
+            self._queue_urls[queue_name] = self._sqs_client.get_queue_url(QueueName=queue_name)['QueueUrl']
+
+        return self._queue_urls[queue_name]
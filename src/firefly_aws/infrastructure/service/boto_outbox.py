@@ -0,0 +1,290 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import sleep
+from typing import List
+
+import firefly as ff
+from botocore.exceptions import BotoCoreError, ClientError
+
+import firefly_aws.domain as domain
+from firefly_aws.domain.service import kinesis_aggregation
+from .retry_policy import RetryPolicy
+
+# PublishBatch and SendMessageBatch limits.
+BATCH_SIZE = 10
+BATCH_BYTES = 256 * 1024
+
+# PutRecords limits.
+PUT_RECORDS_SIZE = 500
+PUT_RECORDS_BYTES = 5 * 1024 * 1024
+
+MAX_ENTRIES = 100
+MAX_BYTES = 1024 * 1024
+CONCURRENCY = 8
+RETRIES = 3
+RETRY_WAIT = .1
+
+
+class BotoOutbox(domain.Outbox, ff.LoggerAware):
+    """
+    Buffers SNS publishes (destination is a topic ARN, entry a PublishBatch entry) and SQS sends (destination is a
+    queue URL, entry a SendMessageBatch entry). Both go out in batches of up to 10 entries / 256KB, calls issued in
+    parallel. Failed entries are retried individually unless AWS blames the sender, and failed calls unless the
+    shared RetryPolicy deems the error permanent. The outbox flushes itself once it holds "outbox_max_entries"
+    messages or "outbox_max_bytes" bytes (firefly_aws settings).
+
+    Kinesis records (destination is a stream ARN, entry a PutRecords entry) are aggregated the way the KPL does it
+    and sent with PutRecords. Records are first split by the shard their partition key maps to, assuming the
+    "kinesis_shards" shards split the key space evenly, and each aggregate is sent with an explicit hash key in the
+    middle of that shard's range, so every record with a given partition key stays on one shard and in order. To
+    keep that order, a stream's PutRecords calls go out one at a time, a failure is retried from the first failed
+    record on, and nothing after a record that ultimately failed is sent.
+    """
+    _sns_client = None
+    _sqs_client = None
+    _kinesis_client = None
+    _execution_context: domain.ExecutionContext = None
+    _configuration: ff.Configuration = None
+
+    def __init__(self):
+        config = self._configuration.contexts['firefly_aws']
+        self._max_entries = int(config.get('outbox_max_entries', MAX_ENTRIES))
+        self._max_bytes = int(config.get('outbox_max_bytes', MAX_BYTES))
+        self._concurrency = int(config.get('outbox_concurrency', CONCURRENCY))
+        self._shards = int(config.get('kinesis_shards', 1))
+        self._pending = []
+        self._pending_bytes = 0
+        self._lock = threading.Lock()
+        self._pool = None
+
+    def add(self, destination: str, entry: dict):
+        size = self._entry_size(entry)
+        with self._lock:
+            self._pending.append((destination, entry, size))
+            self._pending_bytes += size
+            full = len(self._pending) >= self._max_entries or self._pending_bytes >= self._max_bytes
+
+        if full:
+            self.flush()
+
+    def flush(self):
+        with self._lock:
+            pending, self._pending, self._pending_bytes = self._pending, [], 0
+        if not pending:
+            return
+
+        jobs = self._jobs(self._batches(pending))
+        if len(jobs) == 1:
+            failures = [self._publish_in_order(jobs[0])]
+        else:
+            failures = list(self._get_pool().map(self._publish_in_order, jobs))
+
+        failures = [f for batch in failures for f in batch]
+        if failures:
+            raise ff.MessageBusError(
+                f'Could not send {len(failures)} of {len(pending)} messages: '
+                + '; '.join(f'{f.get("Code")}: {f.get("Message")}' for f in failures[:5])
+            )
+
+    def _jobs(self, batches: list):
+        # A stream's batches go out one after the other, so later records for a shard never overtake earlier ones.
+        ret = []
+        streams = {}
+        for destination, entries in batches:
+            if not self._is_stream(destination):
+                ret.append([(destination, entries)])
+                continue
+            if destination not in streams:
+                streams[destination] = []
+                ret.append(streams[destination])
+            streams[destination].append((destination, entries))
+
+        return ret
+
+    def _publish_in_order(self, batches: list) -> List[dict]:
+        for i, (destination, entries) in enumerate(batches):
+            failed = self._publish(destination, entries)
+            if failed:
+                held_back = [entry for _, later in batches[i + 1:] for entry in later]
+                return failed + [
+                    {'Code': 'NotSent', 'Message': 'Held back after an earlier record failed'} for _ in held_back
+                ]
+
+        return []
+
+    def _publish(self, destination: str, entries: List[dict]) -> List[dict]:
+        """Sends one batch and returns the entries that ultimately failed."""
+        if self._is_queue(destination):
+            def send(batch):
+                return self._sqs_client.send_message_batch(QueueUrl=destination, Entries=batch)
+        elif self._is_stream(destination):
+            def send(batch):
+                return self._put_records(destination, batch)
+        elif hasattr(self._sns_client, 'publish_batch'):
+            def send(batch):
+                return self._sns_client.publish_batch(TopicArn=destination, PublishBatchRequestEntries=batch)
+        else:
+            return self._publish_individually(destination, entries)
+
+        entries = [dict(entry, Id=str(i)) for i, entry in enumerate(entries)]
+        permanent = []
+        wait = RETRY_WAIT
+        for attempt in range(RETRIES + 1):
+            try:
+                response = send(entries)
+            except (BotoCoreError, ClientError) as e:
+                # The whole call failed; the shared retry policy decides whether trying again can help.
+                code = (getattr(e, 'response', None) or {}).get('Error', {}).get('Code') or e.__class__.__name__
+                failed = [{'Id': entry['Id'], 'Code': code, 'Message': str(e),
+                           'SenderFault': not RetryPolicy.is_transient(e)} for entry in entries]
+            else:
+                failed = response.get('Failed') or []
+
+            permanent.extend(f for f in failed if f.get('SenderFault'))
+            failed = [f for f in failed if not f.get('SenderFault')]
+            if not failed:
+                return permanent
+
+            if self._is_stream(destination):
+                # Resending only the failed records would let them land behind later ones for the same shard, so
+                # everything from the first failure on goes again.
+                position = {entry['Id']: i for i, entry in enumerate(entries)}
+                entries = entries[min(position.get(f['Id'], 0) for f in failed):]
+            else:
+                by_id = {entry['Id']: entry for entry in entries}
+                entries = [by_id[f['Id']] for f in failed if f['Id'] in by_id]
+            if not entries or attempt == RETRIES or not self._execution_context.deadline.can_finish(wait):
+                return permanent + failed
+
+            self.warning('Retrying %d of the messages sent to %s', len(entries), destination)
+            sleep(wait)
+            wait *= 2
+
+    def _publish_individually(self, topic_arn: str, entries: List[dict]) -> List[dict]:
+        # botocore releases before PublishBatch existed.
+        failed = []
+        for entry in entries:
+            try:
+                self._execution_context.deadline.retry(
+                    lambda: self._sns_client.publish(TopicArn=topic_arn, **entry),
+                    wait=RETRY_WAIT, retries=RETRIES + 1, catch=(BotoCoreError, ClientError)
+                )
+            except (BotoCoreError, ClientError) as e:
+                failed.append({'Code': 'ClientError', 'Message': str(e)})
+
+        return failed
+
+    def _put_records(self, stream_arn: str, entries: List[dict]):
+        response = self._kinesis_client.put_records(
+            StreamName=stream_arn.split('/')[-1],
+            Records=[{k: v for k, v in entry.items() if k != 'Id'} for entry in entries]
+        )
+
+        # Results are positional; failures are throttling or internal errors, never the sender's fault.
+        return {'Failed': [
+            {'Id': entry['Id'], 'Code': result['ErrorCode'], 'Message': result.get('ErrorMessage'),
+             'SenderFault': False}
+            for entry, result in zip(entries, response['Records']) if result.get('ErrorCode')
+        ]}
+
+    def _batches(self, pending: list):
+        ret = []
+        open_batches = {}
+        records = {}
+        for destination, entry, size in pending:
+            if self._is_stream(destination):
+                records.setdefault(destination, []).append(entry)
+                continue
+            batch = open_batches.get(destination)
+            if batch is None or len(batch[1]) == BATCH_SIZE or batch[2] + size > BATCH_BYTES:
+                batch = open_batches[destination] = [destination, [], 0]
+                ret.append(batch)
+            batch[1].append(entry)
+            batch[2] += size
+
+        ret = [(destination, entries) for destination, entries, _ in ret]
+        for destination, entries in records.items():
+            ret.extend((destination, batch) for batch in self._put_records_batches(entries))
+
+        return ret
+
+    def _put_records_batches(self, entries: List[dict]):
+        buckets = {}
+        for entry in entries:
+            buckets.setdefault(kinesis_aggregation.bucket(entry['PartitionKey'], self._shards), []).append(entry)
+
+        aggregated = []
+        for bucket, bucket_entries in buckets.items():
+            explicit_hash_key = kinesis_aggregation.bucket_hash_key(bucket, self._shards)
+            for chunk in self._aggregates(bucket_entries):
+                aggregated.append({
+                    'Data': kinesis_aggregation.aggregate([(e['PartitionKey'], e['Data']) for e in chunk]),
+                    'PartitionKey': chunk[0]['PartitionKey'],
+                    'ExplicitHashKey': explicit_hash_key,
+                })
+
+        ret = []
+        batch, batch_bytes = [], 0
+        for record in aggregated:
+            size = self._entry_size(record)
+            if batch and (len(batch) == PUT_RECORDS_SIZE or batch_bytes + size > PUT_RECORDS_BYTES):
+                ret.append(batch)
+                batch, batch_bytes = [], 0
+            batch.append(record)
+            batch_bytes += size
+        if batch:
+            ret.append(batch)
+
+        return ret
+
+    @staticmethod
+    def _aggregates(entries: List[dict]):
+        chunk, chunk_bytes = [], 0
+        for entry in entries:
+            size = kinesis_aggregation.aggregated_size(entry['PartitionKey'], entry['Data'])
+            if chunk and chunk_bytes + size > kinesis_aggregation.MAX_AGGREGATED_BYTES:
+                yield chunk
+                chunk, chunk_bytes = [], 0
+            chunk.append(entry)
+            chunk_bytes += size
+        if chunk:
+            yield chunk
+
+    @staticmethod
+    def _is_queue(destination: str):
+        return destination.startswith('https://')
+
+    @staticmethod
+    def _is_stream(destination: str):
+        return destination.startswith('arn:aws:kinesis:')
+
+    @staticmethod
+    def _entry_size(entry: dict):
+        if 'Data' in entry:
+            return len(entry['Data']) + len(entry['PartitionKey'].encode('utf-8'))
+        size = len(entry.get('Message', entry.get('MessageBody', '')).encode('utf-8'))
+        for name, attribute in (entry.get('MessageAttributes') or {}).items():
+            size += len(name) + len(attribute.get('DataType', '')) + len(attribute.get('StringValue', ''))
+
+        return size
+
+    def _get_pool(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self._concurrency, thread_name_prefix='sns-outbox')
+        return self._pool
@@ -15,12 +15,16 @@
 from __future__ import annotations
 
 import gzip
+import itertools
 import uuid
+from typing import Iterable, Union
 
 import firefly as ff
 import firefly_aws.domain as awsd
 from botocore.exceptions import ClientError
 
+PART_SIZE = 8 * 1024 * 1024
+
 
 class BotoS3Service(awsd.S3Service, ff.LoggerAware):
     _configuration: ff.Configuration = None
@@ -38,7 +42,7 @@ class BotoS3Service(awsd.S3Service, ff.LoggerAware):
             key += '.gz'
             content_encoding = 'gzip'
 
-        key = f'/tmp/{key}'
+        key = f'tmp/{key}'
 
         params = {
             'Body': data,
@@ -55,3 +59,66 @@ class BotoS3Service(awsd.S3Service, ff.LoggerAware):
         return self._s3_client.generate_presigned_url(
             'get_object', Params={'Bucket': self._bucket, 'Key': key}
         )
+
+    def spool_download(self, chunks: Iterable[Union[str, bytes]], max_inline_size: int, content_encoding: str = None,
+                       content_type: str = None):
+        chunks = iter(chunks)
+        buffered = []
+        size = 0
+        for chunk in chunks:
+            buffered.append(chunk)
+            size += len(chunk)
+            if size > max_inline_size:
+                return None, self._multipart_download(
+                    itertools.chain(buffered, chunks), content_encoding=content_encoding, content_type=content_type
+                )
+
+        if len(buffered) > 0 and isinstance(buffered[0], bytes):
+            return b''.join(buffered), None
+        return ''.join(buffered), None
+
+    def _multipart_download(self, chunks: Iterable[Union[str, bytes]], part_size: int = PART_SIZE,
+                            content_encoding: str = None, content_type: str = None):
+        key = f'tmp/{str(uuid.uuid4())}'
+        params = {}
+        if content_encoding is not None:
+            params['ContentEncoding'] = content_encoding
+        if content_type is not None:
+            params['ContentType'] = content_type
+        upload_id = self._s3_client.create_multipart_upload(Bucket=self._bucket, Key=key, **params)['UploadId']
+        parts = []
+        part = bytearray()
+
+        try:
+            for chunk in chunks:
+                part += chunk.encode('utf-8') if isinstance(chunk, str) else chunk
+                if len(part) >= part_size:
+                    parts.append(self._upload_part(key, upload_id, len(parts) + 1, part))
+                    part = bytearray()
+            if len(part) > 0 or len(parts) == 0:
+                parts.append(self._upload_part(key, upload_id, len(parts) + 1, part))
+
+            self._s3_client.complete_multipart_upload(
+                Bucket=self._bucket,
+                Key=key,
+                UploadId=upload_id,
+                MultipartUpload={'Parts': parts}
+            )
+        except Exception:
+            self._s3_client.abort_multipart_upload(Bucket=self._bucket, Key=key, UploadId=upload_id)
+            raise
+
+        return self._s3_client.generate_presigned_url(
+            'get_object', Params={'Bucket': self._bucket, 'Key': key}
+        )
+
+    def _upload_part(self, key: str, upload_id: str, part_number: int, data: bytearray):
+        response = self._s3_client.upload_part(
+            Body=bytes(data),
+            Bucket=self._bucket,
+            Key=key,
+            UploadId=upload_id,
+            PartNumber=part_number
+        )
+
+        return {'ETag': response['ETag'], 'PartNumber': part_number}
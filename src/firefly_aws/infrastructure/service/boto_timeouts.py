@@ -0,0 +1,77 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import threading
+import weakref
+from typing import Optional
+
+from botocore.endpoint import EndpointCreator
+
+import firefly_aws.domain as domain
+
+# Read timeouts are rounded down to one of these so only a handful of copies is ever made of each client.
+TIMEOUT_STEPS = (1, 2, 5, 10, 20, 30, 60, 120, 300, 600, 900)
+
+_clients = weakref.WeakKeyDictionary()
+_lock = threading.Lock()
+
+
+def with_read_timeout(client, seconds: Optional[float]):
+    """
+    Returns a client for the same service whose read timeout fits in the given number of seconds. A client whose own
+    read timeout already fits is returned as it is; otherwise the timeout is rounded down to one of TIMEOUT_STEPS.
+    With less than the smallest step left, domain.LambdaTimedOut is raised rather than starting a call that can't
+    finish. None returns the client unchanged.
+
+    botocore only takes timeouts per client, so a copy of the client is made once per timeout step and cached for as
+    long as the client lives. The copy only gets its own HTTP endpoint: credentials, event hooks (and so stubbers),
+    retries and signing are still the client's own.
+    """
+    if seconds is None or not hasattr(client, '_endpoint'):
+        return client
+    if seconds < TIMEOUT_STEPS[0]:
+        raise domain.LambdaTimedOut('Not enough time left for the call')
+    if client.meta.config.read_timeout <= seconds:
+        return client
+
+    step = max(candidate for candidate in TIMEOUT_STEPS if candidate <= seconds)
+    with _lock:
+        clones = _clients.setdefault(client, {})
+        if step not in clones:
+            clones[step] = _clone(client, step)
+        return clones[step]
+
+
+def _clone(client, read_timeout: int):
+    config = client.meta.config
+    endpoint = client._endpoint
+
+    # copy.copy trips over the client's __getattr__, so the copy is made by hand.
+    ret = object.__new__(type(client))
+    ret.__dict__.update(client.__dict__)
+    ret._endpoint = EndpointCreator(client.meta.events).create_endpoint(
+        client.meta.service_model,
+        region_name=client.meta.region_name,
+        endpoint_url=endpoint.host,
+        verify=getattr(endpoint.http_session, '_verify', None),
+        response_parser_factory=endpoint._response_parser_factory,
+        timeout=(config.connect_timeout, read_timeout),
+        max_pool_connections=config.max_pool_connections,
+        proxies=config.proxies,
+        client_cert=getattr(config, 'client_cert', None)
+    )
+
+    return ret
@@ -18,6 +18,10 @@ import cognitojwt
 import firefly as ff
 import firefly_aws.domain as domain
 from cognitojwt import CognitoJWTException
+from cognitojwt.jwt_sync import get_public_key
+
+# An unsigned token asking for a key id no user pool has ({"alg": "RS256", "kid": ""}.{}.).
+WARM_UP_TOKEN = 'eyJhbGciOiAiUlMyNTYiLCAia2lkIjogIiJ9.e30.'
 
 
 class CognitoJwtDecoder(domain.JwtDecoder, ff.LoggerAware):
@@ -38,3 +42,11 @@ class CognitoJwtDecoder(domain.JwtDecoder, ff.LoggerAware):
         except CognitoJWTException as e:
             self.exception(e)
             raise ff.UnauthenticatedError()
+
+    def warm_up(self):
+        # cognitojwt caches the user pool's public keys after the first fetch. Going through its own lookup fetches
+        # them from wherever decode() will look for them; the lookup then fails to find the key, which is expected.
+        try:
+            get_public_key(WARM_UP_TOKEN, self._region, self._user_pool_id)
+        except CognitoJWTException:
+            pass
@@ -2,9 +2,18 @@ from __future__ import annotations
 
 import firefly as ff
 
+import firefly_aws.domain as domain
+from .boto_timeouts import with_read_timeout
+from .retry_policy import RetryPolicy
+
+# Statements that change nothing, so running them twice is harmless.
+READ_STATEMENTS = ('SELECT', 'SHOW', 'DESCRIBE', 'EXPLAIN')
+
 
 class DataApi(ff.LoggerAware):
     _rds_data_client = None
+    _execution_context: domain.ExecutionContext = None
+    _retry_policy: RetryPolicy = None
     _db_arn: str = None
     _db_secret_arn: str = None
     _db_name: str = None
@@ -18,13 +27,27 @@ class DataApi(ff.LoggerAware):
     def execute(self, sql: str, params: list = None, db_arn: str = None, db_secret_arn: str = None,
                 db_name: str = None):
         params = params or []
-        self.info('%s - %s', sql, str(params))
+        self.debug('%s - %s', sql, domain.Truncated(params))
+
+        deadline = self._execution_context.deadline if self._execution_context is not None else domain.Deadline()
+        deadline.check()
 
-        return self._rds_data_client.execute_statement(
-            resourceArn=(db_arn or self._db_arn),
+        resource_arn = db_arn or self._db_arn
+        execute = lambda: with_read_timeout(self._rds_data_client, deadline.timeout()).execute_statement(
+            resourceArn=resource_arn,
             secretArn=(db_secret_arn or self._db_secret_arn),
             database=(db_name or self._db_name),
             includeResultMetadata=True,
             sql=sql,
             parameters=params
         )
+        if self._retry_policy is None:
+            return execute()
+
+        # A write that timed out may still commit, so only reads are retried after a timeout.
+        return self._retry_policy(resource_arn, execute, retry_timeouts=self._is_read(sql))
+
+    @staticmethod
+    def _is_read(sql: str):
+        words = sql.split(None, 1)
+        return bool(words) and words[0].upper() in READ_STATEMENTS
@@ -49,9 +49,20 @@ class DdbCache(ff.Cache):
     def clear(self):
         raise NotImplemented('DdbCache does not support clear()')
 
-    def increment(self, key: str, amount: int = 1, **kwargs) -> Any:
+    def increment(self, key: str, amount: int = 1, ttl: int = None, **kwargs) -> Any:
         k = key.split('.').pop(0)
         attribute_names, path = self._process_path(key)
+        values = {
+            ':inc': amount,
+            ':zero': 0,
+        }
+
+        # Counters start at zero, so the first increment creates them.
+        expression = f'SET {path} = if_not_exists({path}, :zero) + :inc'
+        if ttl is not None:
+            expression += ', #ttl = :ttl'
+            attribute_names['#ttl'] = 'TimeToLive'
+            values[':ttl'] = (datetime.now() + timedelta(seconds=ttl)).timestamp()
 
         params = {
             'TableName': self._ddb_table,
@@ -59,10 +70,8 @@ class DdbCache(ff.Cache):
                 'pk': k,
                 'sk': 'CacheItem',
             }, as_dict=True),
-            'UpdateExpression': f'SET {path} = {path} + :inc',
-            'ExpressionAttributeValues': json_util.dumps({
-                ':inc': amount,
-            }, as_dict=True),
+            'UpdateExpression': expression,
+            'ExpressionAttributeValues': json_util.dumps(values, as_dict=True),
             'ExpressionAttributeNames': attribute_names,
             'ReturnValues': 'ALL_NEW',
         }
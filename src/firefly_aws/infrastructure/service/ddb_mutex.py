@@ -6,10 +6,13 @@ from time import sleep
 import firefly as ff
 from botocore.exceptions import ClientError
 
+import firefly_aws.domain as domain
+
 
 class DdbMutex(ff.Mutex):
     _ddb_client = None
     _ddb_table: str = None
+    _execution_context: domain.ExecutionContext = None
 
     def acquire(self, key: str, timeout: int = None) -> bool:
         mark = datetime.now()
@@ -29,6 +32,8 @@ class DdbMutex(ff.Mutex):
                 if 'ConditionalCheckFailedException' in str(e):
                     if timeout is not None and (datetime.now() - mark).seconds >= timeout:
                         raise TimeoutError(f'Could not acquire mutex for key: {key}')
+                    if not self._execution_context.deadline.can_finish(1):
+                        raise TimeoutError(f'Could not acquire mutex for key: {key} before the deadline')
                     sleep(1)
                 else:
                     raise e
@@ -0,0 +1,62 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+from typing import Any
+
+import firefly as ff
+from firefly.infrastructure.service.serialization.default_serializer import FireflyEncoder
+
+import firefly_aws.domain as domain
+from .stdlib_json_codec import StdlibJsonCodec
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+class OrjsonCodec(domain.JsonCodec):
+    """
+    JSON codec backed by orjson. Values orjson can't represent (non-string keys it doesn't support, integers wider
+    than 64 bits) are encoded by the standard library instead, so the output is always what FireflyEncoder produces.
+    """
+
+    def __init__(self):
+        if orjson is None:
+            raise ff.FrameworkError('orjson is not installed')
+        self._encoder = FireflyEncoder()
+        self._fallback = StdlibJsonCodec()
+        # Dataclasses are passed through so messages and value objects get their to_dict() treatment.
+        self._options = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATACLASS
+
+    @staticmethod
+    def available() -> bool:
+        return orjson is not None
+
+    def encode(self, data: Any) -> bytes:
+        try:
+            return orjson.dumps(data, default=self._encoder.default, option=self._options)
+        except orjson.JSONEncodeError:
+            return self._fallback.encode(data)
+
+    def decode(self, data):
+        if not isinstance(data, (str, bytes, bytearray, memoryview)):
+            return data
+
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            raise ff.InvalidArgument('Could not deserialize data')
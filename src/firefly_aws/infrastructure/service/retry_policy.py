@@ -0,0 +1,252 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import random
+import threading
+from time import monotonic, sleep
+from typing import Callable, Dict, Tuple
+
+import firefly as ff
+from botocore.exceptions import ClientError, ConnectionError, ReadTimeoutError
+
+import firefly_aws.domain as domain
+
+# Error codes that mean "try again later" rather than "this request is wrong".
+TRANSIENT_CODES = {
+    'Throttling', 'ThrottlingException', 'ThrottledException', 'TooManyRequestsException', 'RequestLimitExceeded',
+    'ProvisionedThroughputExceededException', 'EC2ThrottledException', 'ServiceException', 'ServiceUnavailable',
+    'ServiceUnavailableError', 'ServiceUnavailableException', 'InternalFailure', 'InternalServerError',
+    'InternalServerErrorException', 'ResourceNotReadyException', 'StatementTimeoutException',
+}
+# Transient too, but the request may have been carried out before it timed out.
+TIMEOUT_CODES = {'StatementTimeoutException'}
+# Aurora Serverless answers with a BadRequestException while it resumes.
+TRANSIENT_MESSAGES = ('Communications link failure',)
+
+RETRIES = 3
+BASE_DELAY = .1
+MAX_DELAY = 5.0
+BUDGET_RATIO = .1
+BUDGET_MAX = 10.0
+FAILURE_THRESHOLD = 5
+RESET_TIMEOUT = 10.0
+HALF_OPEN_PROBES = 1
+
+
+class CircuitBreaker:
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = FAILURE_THRESHOLD, reset_timeout: float = RESET_TIMEOUT,
+                 half_open_probes: int = HALF_OPEN_PROBES, on_change: Callable = None):
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._half_open_probes = half_open_probes
+        self._on_change = on_change
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._consecutive_failures = 0
+        self._opened_at = 0.0
+        self._probes = 0
+        self._counters = {'calls': 0, 'successes': 0, 'failures': 0, 'rejected': 0, 'opened': 0}
+
+    @property
+    def state(self):
+        return self._state
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self._state == self.OPEN and monotonic() - self._opened_at >= self._reset_timeout:
+                self._transition(self.HALF_OPEN)
+                self._probes = 0
+            if self._state == self.OPEN or \
+                    (self._state == self.HALF_OPEN and self._probes >= self._half_open_probes):
+                self._counters['rejected'] += 1
+                return False
+            if self._state == self.HALF_OPEN:
+                self._probes += 1
+            self._counters['calls'] += 1
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self._counters['successes'] += 1
+            self._consecutive_failures = 0
+            if self._state == self.HALF_OPEN:
+                self._transition(self.CLOSED)
+
+    def record_failure(self):
+        with self._lock:
+            self._counters['failures'] += 1
+            self._consecutive_failures += 1
+            if self._state == self.HALF_OPEN or \
+                    (self._state == self.CLOSED and self._consecutive_failures >= self._failure_threshold):
+                self._opened_at = monotonic()
+                self._counters['opened'] += 1
+                self._transition(self.OPEN)
+
+    def metrics(self) -> dict:
+        with self._lock:
+            return dict(self._counters, state=self._state, consecutive_failures=self._consecutive_failures)
+
+    def _transition(self, state: str):
+        previous, self._state = self._state, state
+        if self._on_change is not None:
+            self._on_change(previous, state)
+
+
+class RetryBudget:
+    """
+    Token bucket shared by all callers of a target: every retry spends a token and every success earns back a
+    fraction of one, so retries stay a bounded share of the traffic while a dependency is struggling.
+    """
+
+    def __init__(self, ratio: float = BUDGET_RATIO, max_tokens: float = BUDGET_MAX):
+        self._ratio = ratio
+        self._max_tokens = max_tokens
+        self._tokens = max_tokens
+        self._lock = threading.Lock()
+        self.denied = 0
+
+    def deposit(self):
+        with self._lock:
+            self._tokens = min(self._max_tokens, self._tokens + self._ratio)
+
+    def withdraw(self) -> bool:
+        with self._lock:
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return True
+            self.denied += 1
+            return False
+
+    @property
+    def tokens(self):
+        return self._tokens
+
+
+class RetryPolicy(ff.LoggerAware):
+    """
+    Retries transient AWS errors with exponential backoff and full jitter, within a per-target retry budget and the
+    invocation's deadline, behind a per-target circuit breaker. Breakers and budgets are shared by everything in the
+    container. Tuned with the firefly_aws settings retry_attempts, retry_base_delay, retry_max_delay,
+    retry_budget_ratio, retry_budget_max, circuit_failure_threshold, circuit_reset_timeout and
+    circuit_half_open_probes.
+    """
+    _execution_context: domain.ExecutionContext = None
+    _configuration: ff.Configuration = None
+
+    def __init__(self):
+        config = self._configuration.contexts['firefly_aws'] if self._configuration is not None else {}
+        self._retries = int(config.get('retry_attempts', RETRIES))
+        self._base_delay = float(config.get('retry_base_delay', BASE_DELAY))
+        self._max_delay = float(config.get('retry_max_delay', MAX_DELAY))
+        self._budget_ratio = float(config.get('retry_budget_ratio', BUDGET_RATIO))
+        self._budget_max = float(config.get('retry_budget_max', BUDGET_MAX))
+        self._failure_threshold = int(config.get('circuit_failure_threshold', FAILURE_THRESHOLD))
+        self._reset_timeout = float(config.get('circuit_reset_timeout', RESET_TIMEOUT))
+        self._half_open_probes = int(config.get('circuit_half_open_probes', HALF_OPEN_PROBES))
+        self._targets: Dict[str, Tuple[CircuitBreaker, RetryBudget]] = {}
+        self._lock = threading.Lock()
+        self._random = random.Random()
+
+    def __call__(self, target: str, cb: Callable, retry_timeouts: bool = True):
+        """
+        Calls cb, retrying transient failures. Set retry_timeouts to False for calls that are not safe to repeat
+        once the request may have reached the target (e.g. invoking a command).
+        """
+        breaker, budget = self._target(target)
+        deadline = self._execution_context.deadline if self._execution_context is not None else domain.Deadline()
+        attempt = 0
+        while True:
+            deadline.check()
+            if not breaker.allow():
+                raise domain.CircuitOpen(f'Circuit for {target} is open')
+
+            try:
+                ret = cb()
+            except Exception as e:
+                transient = self.is_transient(e)
+                if transient:
+                    breaker.record_failure()
+                else:
+                    # The target answered; the request itself is at fault.
+                    breaker.record_success()
+                if not transient or (self.is_timeout(e) and not retry_timeouts) or attempt >= self._retries:
+                    raise
+
+                wait = self._random.uniform(0, min(self._max_delay, self._base_delay * 2 ** attempt))
+                if not deadline.can_finish(wait) or not budget.withdraw():
+                    raise
+                self.info('Retrying %s in %.3fs after %s', target, wait, e.__class__.__name__)
+                sleep(wait)
+                attempt += 1
+            else:
+                breaker.record_success()
+                budget.deposit()
+                return ret
+
+    def breaker(self, target: str) -> CircuitBreaker:
+        return self._target(target)[0]
+
+    def metrics(self) -> dict:
+        with self._lock:
+            targets = dict(self._targets)
+
+        return {
+            name: dict(breaker.metrics(), retry_tokens=round(budget.tokens, 2), retries_denied=budget.denied)
+            for name, (breaker, budget) in targets.items()
+        }
+
+    @staticmethod
+    def is_transient(error: Exception) -> bool:
+        if isinstance(error, (ConnectionError, ReadTimeoutError)):
+            return True
+        if not isinstance(error, ClientError):
+            return False
+
+        response = getattr(error, 'response', None) or {}
+        if response.get('Error', {}).get('Code') in TRANSIENT_CODES:
+            return True
+        if response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0) in (429, 500, 502, 503, 504):
+            return True
+        return any(m in str(error) for m in TRANSIENT_MESSAGES)
+
+    @staticmethod
+    def is_timeout(error: Exception) -> bool:
+        if isinstance(error, ReadTimeoutError):
+            return True
+        response = getattr(error, 'response', None) or {}
+        return isinstance(error, ClientError) and response.get('Error', {}).get('Code') in TIMEOUT_CODES
+
+    def _target(self, target: str):
+        ret = self._targets.get(target)
+        if ret is None:
+            with self._lock:
+                ret = self._targets.get(target)
+                if ret is None:
+                    ret = self._targets[target] = (
+                        CircuitBreaker(
+                            self._failure_threshold, self._reset_timeout, self._half_open_probes,
+                            on_change=lambda previous, state: self.warning(
+                                'Circuit for %s changed from %s to %s', target, previous, state
+                            )
+                        ),
+                        RetryBudget(self._budget_ratio, self._budget_max),
+                    )
+
+        return ret
@@ -36,6 +36,12 @@ class S3FileSystem(ff.FileSystem, ff.LoggerAware):
         params = {}
         if file.content_type is not None:
             params['ContentType'] = file.content_type
+
+        if hasattr(file.content, 'read'):
+            # Streams file objects (e.g. uploaded parts) in chunks, using a multipart upload for large ones.
+            self._s3_client.upload_fileobj(file.content, bucket, file_name, ExtraArgs=params)
+            return
+
         self._s3_client.put_object(
             Bucket=bucket,
             Key=file_name,
@@ -0,0 +1,39 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import json
+from typing import Any
+
+import firefly as ff
+from firefly.infrastructure.service.serialization.default_serializer import FireflyEncoder
+
+import firefly_aws.domain as domain
+
+
+class StdlibJsonCodec(domain.JsonCodec):
+    def encode(self, data: Any) -> bytes:
+        return json.dumps(data, cls=FireflyEncoder, skipkeys=True, separators=(',', ':')).encode('utf-8')
+
+    def decode(self, data):
+        if isinstance(data, memoryview):
+            data = data.tobytes()
+        if not isinstance(data, (str, bytes, bytearray)):
+            return data
+
+        try:
+            return json.loads(data)
+        except ValueError:
+            raise ff.InvalidArgument('Could not deserialize data')
@@ -0,0 +1,206 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import re
+import sre_constants
+import sre_parse
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple, Union
+
+import firefly as ff
+import firefly.infrastructure as ffi
+
+import firefly_aws.domain as domain
+
+PLACEHOLDER = re.compile(r'^{(\w+)(?::(.+))?}$')
+ROUTE_CACHE_SIZE = 1024
+SLASH = ord('/')
+# Character categories that include "/".
+SLASH_CATEGORIES = (
+    sre_constants.CATEGORY_NOT_DIGIT, sre_constants.CATEGORY_NOT_WORD, sre_constants.CATEGORY_NOT_SPACE,
+    sre_constants.CATEGORY_NOT_LINEBREAK,
+)
+
+
+class _Node:
+    __slots__ = ('static', 'params', 'routes')
+
+    def __init__(self):
+        self.static = {}
+        self.params = []
+        self.routes = {}
+
+
+class TrieRestRouter(domain.RouteIndex):
+    """
+    Prefix trie keyed by method and static path segments. Routes the trie can't express (wildcards, placeholders
+    mixed with static text, requirements that may match a "/") are handed to the Routes library instead.
+    """
+
+    def __init__(self, cache_size: int = ROUTE_CACHE_SIZE):
+        self._root = _Node()
+        self._fallback = ffi.RoutesRestRouter()
+        self._has_fallback_routes = False
+        self._cache = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def register(self, route: str, endpoint: ff.HttpEndpoint):
+        segments = self._segments(route)
+        node = self._root
+        for segment in segments:
+            if '{' not in segment and ':' not in segment and '*' not in segment:
+                node = node.static.setdefault(segment, _Node())
+                continue
+
+            match = PLACEHOLDER.match(segment)
+            if match is None:
+                self._fallback.register(route, endpoint)
+                self._has_fallback_routes = True
+                return
+
+            name, requirement = match.groups()
+            if requirement is not None and not _segment_local(requirement):
+                # Routes matches requirements against the whole path, so they may span several segments.
+                self._fallback.register(route, endpoint)
+                self._has_fallback_routes = True
+                return
+            pattern = re.compile(f'^(?:{requirement})$') if requirement is not None else None
+            for param_name, param_pattern, child in node.params:
+                if param_name == name and getattr(param_pattern, 'pattern', None) == getattr(pattern, 'pattern', None):
+                    node = child
+                    break
+            else:
+                child = _Node()
+                node.params.append((name, pattern, child))
+                node = child
+
+        node.routes[endpoint.method.lower()] = domain.IndexedRoute.from_endpoint(endpoint)
+        with self._lock:
+            self._cache.clear()
+
+    def match(self, route: str, method: str = 'get') -> Union[Tuple[ff.HttpEndpoint, dict], Tuple[None, None]]:
+        indexed_route, params = self.lookup(route, method)
+        if indexed_route is None:
+            return None, None
+
+        return indexed_route.endpoint, params
+
+    def lookup(self, route: str, method: str = 'get') -> Tuple[Optional[domain.IndexedRoute], Optional[dict]]:
+        method = method.lower()
+        key = (method, route)
+        with self._lock:
+            if key in self._cache:
+                self._cache.move_to_end(key)
+                indexed_route, params = self._cache[key]
+                return indexed_route, dict(params)
+
+        segments = self._segments(route)
+        found = self._search(self._root, segments, 0, method, {})
+        if found is None and method != 'any':
+            found = self._search(self._root, segments, 0, 'any', {})
+        if found is None and self._has_fallback_routes:
+            endpoint, params = self._fallback.match(route, method)
+            if endpoint is not None:
+                found = domain.IndexedRoute.from_endpoint(endpoint), params
+
+        if found is None:
+            return None, None
+
+        with self._lock:
+            self._cache[key] = found
+            if len(self._cache) > self._cache_size:
+                self._cache.popitem(last=False)
+
+        return found[0], dict(found[1])
+
+    def _search(self, node: _Node, segments: list, index: int, method: str, params: dict):
+        if index == len(segments):
+            if method in node.routes:
+                return node.routes[method], params
+            return None
+
+        segment = segments[index]
+        child = node.static.get(segment)
+        if child is not None:
+            found = self._search(child, segments, index + 1, method, params)
+            if found is not None:
+                return found
+
+        for name, pattern, child in node.params:
+            if pattern is not None and pattern.match(segment) is None:
+                continue
+            found = self._search(child, segments, index + 1, method, dict(params, **{name: segment}))
+            if found is not None:
+                return found
+
+        return None
+
+    @staticmethod
+    def _segments(route: str):
+        return [segment for segment in route.split('/') if segment != '']
+
+
+def _segment_local(requirement: str) -> bool:
+    """Whether the regex can only ever match within one path segment, i.e. nothing it matches contains a "/"."""
+    try:
+        return not _matches_slash(sre_parse.parse(requirement))
+    except (sre_constants.error, TypeError, ValueError):
+        return False
+
+
+def _matches_slash(pattern) -> bool:
+    for op, av in pattern:
+        if op == sre_constants.LITERAL:
+            if av == SLASH:
+                return True
+        elif op == sre_constants.NOT_LITERAL:
+            if av != SLASH:
+                return True
+        elif op == sre_constants.IN:
+            if _set_matches_slash(av):
+                return True
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT):
+            if _matches_slash(av[2]):
+                return True
+        elif op == sre_constants.SUBPATTERN:
+            if _matches_slash(av[-1]):
+                return True
+        elif op == sre_constants.BRANCH:
+            if any(_matches_slash(branch) for branch in av[1]):
+                return True
+        elif op not in (sre_constants.AT, sre_constants.GROUPREF):
+            # ANY and anything not understood here.
+            return True
+
+    return False
+
+
+def _set_matches_slash(items) -> bool:
+    negate = bool(items) and items[0][0] == sre_constants.NEGATE
+    found = False
+    for op, av in items:
+        if op == sre_constants.LITERAL:
+            found = found or av == SLASH
+        elif op == sre_constants.RANGE:
+            found = found or av[0] <= SLASH <= av[1]
+        elif op == sre_constants.CATEGORY:
+            found = found or av in SLASH_CATEGORIES
+        elif op != sre_constants.NEGATE:
+            return True
+
+    return found != negate
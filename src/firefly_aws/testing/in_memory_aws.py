@@ -0,0 +1,639 @@
+#  Copyright (c) 2020 JD Williams
+#
+#  This file is part of Firefly, a Python SOA framework built by JD Williams. Firefly is free software; you can
+#  redistribute it and/or modify it under the terms of the GNU General Public License as published by the
+#  Free Software Foundation; either version 3 of the License, or (at your option) any later version.
+#
+#  Firefly is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY; without even the
+#  implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the GNU General
+#  Public License for more details. You should have received a copy of the GNU Lesser General Public
+#  License along with this program.  If not, see <http://www.gnu.org/licenses/>.
+#
+#  You should have received a copy of the GNU General Public License along with Firefly. If not, see
+#  <http://www.gnu.org/licenses/>.
+
+from __future__ import annotations
+
+import hashlib
+import heapq
+import io
+import json
+import random
+import threading
+import uuid
+from collections import deque
+from datetime import datetime, timezone
+from time import monotonic, sleep, time
+from typing import Callable, Dict, List, Optional
+
+from botocore.exceptions import ClientError
+
+import firefly_aws.domain as domain
+
+DEFAULT_VISIBILITY_TIMEOUT = 30
+DEFAULT_FUNCTION_TIMEOUT = 900
+
+
+def _error(code: str, operation: str, status: int = 400, message: str = None):
+    return ClientError({
+        'Error': {'Code': code, 'Message': message or code},
+        'ResponseMetadata': {'HTTPStatusCode': status},
+    }, operation)
+
+
+class Faults:
+    """
+    Latency and failures injected into every API call of a stand-in service. Failed calls raise a 503
+    ServiceUnavailable ClientError; in batch calls each entry fails independently instead, the way AWS reports partial
+    failures. Restrict injection to some calls with operations, e.g. {'SendMessageBatch', 'Invoke'}.
+    """
+
+    def __init__(self, latency: float = 0.0, failure_rate: float = 0.0, seed: int = None, operations: set = None):
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.operations = operations
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def __call__(self, operation: str):
+        if self.latency > 0:
+            sleep(self.latency)
+        if self.fails(operation):
+            raise _error('ServiceUnavailable', operation, 503, 'Injected failure')
+
+    def fails(self, operation: str) -> bool:
+        if self.failure_rate <= 0 or (self.operations is not None and operation not in self.operations):
+            return False
+        with self._lock:
+            return self._random.random() < self.failure_rate
+
+
+class _Queue:
+    def __init__(self, name: str, arn: str, url: str, visibility_timeout: float):
+        self.name = name
+        self.arn = arn
+        self.url = url
+        self.visibility_timeout = visibility_timeout
+        self.redrive: Optional[dict] = None
+        self.ready = deque()
+        self.in_flight: Dict[str, dict] = {}
+        self.timeouts = []
+        self.condition = threading.Condition()
+
+
+class InMemorySqs:
+    """Standard SQS queues with visibility timeouts, long polling and redrive to a dead-letter queue."""
+
+    def __init__(self, region: str = 'us-east-1', account_id: str = '000000000000', faults: Faults = None,
+                 clock: Callable[[], float] = monotonic):
+        self.faults = faults or Faults()
+        self._region = region
+        self._account_id = account_id
+        self._clock = clock
+        self._queues: Dict[str, _Queue] = {}
+
+    def create_queue(self, QueueName: str, Attributes: dict = None, **kwargs):
+        attributes = Attributes or {}
+        if QueueName not in self._queues:
+            self._queues[QueueName] = _Queue(
+                QueueName,
+                f'arn:aws:sqs:{self._region}:{self._account_id}:{QueueName}',
+                f'https://sqs.{self._region}.amazonaws.com/{self._account_id}/{QueueName}',
+                float(attributes.get('VisibilityTimeout', DEFAULT_VISIBILITY_TIMEOUT))
+            )
+        queue = self._queues[QueueName]
+        if 'RedrivePolicy' in attributes:
+            policy = attributes['RedrivePolicy']
+            queue.redrive = json.loads(policy) if isinstance(policy, str) else policy
+
+        return {'QueueUrl': queue.url}
+
+    def get_queue_url(self, QueueName: str, **kwargs):
+        self.faults('GetQueueUrl')
+        if QueueName not in self._queues:
+            raise _error('AWS.SimpleQueueService.NonExistentQueue', 'GetQueueUrl')
+        return {'QueueUrl': self._queues[QueueName].url}
+
+    def send_message(self, QueueUrl: str, MessageBody: str, MessageAttributes: dict = None, **kwargs):
+        self.faults('SendMessage')
+        return {'MessageId': self._enqueue(self.queue(QueueUrl), MessageBody, MessageAttributes)}
+
+    def send_message_batch(self, QueueUrl: str, Entries: List[dict]):
+        self.faults('SendMessageBatch')
+        queue = self.queue(QueueUrl)
+        successful, failed = [], []
+        for entry in Entries:
+            if self.faults.fails('SendMessageBatchEntry'):
+                failed.append({
+                    'Id': entry['Id'], 'SenderFault': False, 'Code': 'InternalError', 'Message': 'Injected failure'
+                })
+            else:
+                message_id = self._enqueue(queue, entry['MessageBody'], entry.get('MessageAttributes'))
+                successful.append({'Id': entry['Id'], 'MessageId': message_id})
+
+        return {'Successful': successful, 'Failed': failed}
+
+    def receive_message(self, QueueUrl: str, MaxNumberOfMessages: int = 1, VisibilityTimeout: float = None,
+                        WaitTimeSeconds: float = 0, **kwargs):
+        self.faults('ReceiveMessage')
+        queue = self.queue(QueueUrl)
+        visibility_timeout = queue.visibility_timeout if VisibilityTimeout is None else VisibilityTimeout
+        ends_at = monotonic() + WaitTimeSeconds
+
+        with queue.condition:
+            while True:
+                messages = self._receive(queue, MaxNumberOfMessages, visibility_timeout)
+                remaining = ends_at - monotonic()
+                if messages or remaining <= 0:
+                    break
+                queue.condition.wait(remaining)
+
+        return {'Messages': messages} if messages else {}
+
+    def delete_message(self, QueueUrl: str, ReceiptHandle: str):
+        self.faults('DeleteMessage')
+        queue = self.queue(QueueUrl)
+        with queue.condition:
+            queue.in_flight.pop(ReceiptHandle, None)
+
+    def delete_message_batch(self, QueueUrl: str, Entries: List[dict]):
+        self.faults('DeleteMessageBatch')
+        queue = self.queue(QueueUrl)
+        with queue.condition:
+            for entry in Entries:
+                queue.in_flight.pop(entry['ReceiptHandle'], None)
+
+        return {'Successful': [{'Id': e['Id']} for e in Entries], 'Failed': []}
+
+    def change_message_visibility(self, QueueUrl: str, ReceiptHandle: str, VisibilityTimeout: float):
+        self.faults('ChangeMessageVisibility')
+        queue = self.queue(QueueUrl)
+        with queue.condition:
+            message = queue.in_flight.get(ReceiptHandle)
+            if message is None:
+                raise _error('ReceiptHandleIsInvalid', 'ChangeMessageVisibility')
+            message['visible_at'] = self._clock() + VisibilityTimeout
+            heapq.heappush(queue.timeouts, (message['visible_at'], ReceiptHandle))
+
+    def queue(self, url_or_arn: str) -> _Queue:
+        name = url_or_arn.rsplit('/', 1)[-1].rsplit(':', 1)[-1]
+        if name not in self._queues:
+            raise _error('AWS.SimpleQueueService.NonExistentQueue', 'GetQueueUrl')
+        return self._queues[name]
+
+    def depth(self, url_or_arn: str) -> dict:
+        queue = self.queue(url_or_arn)
+        with queue.condition:
+            return {'visible': len(queue.ready), 'in_flight': len(queue.in_flight)}
+
+    def _enqueue(self, queue: _Queue, body: str, attributes: dict = None):
+        message = {
+            'MessageId': str(uuid.uuid4()),
+            'Body': body,
+            'MD5OfBody': hashlib.md5(body.encode('utf-8')).hexdigest(),
+            'MessageAttributes': attributes or {},
+            'SentTimestamp': str(int(time() * 1000)),
+            'ReceiveCount': 0,
+        }
+        with queue.condition:
+            queue.ready.append(message)
+            queue.condition.notify()
+
+        return message['MessageId']
+
+    def _receive(self, queue: _Queue, count: int, visibility_timeout: float) -> List[dict]:
+        now = self._clock()
+        while queue.timeouts and queue.timeouts[0][0] <= now:
+            _, handle = heapq.heappop(queue.timeouts)
+            message = queue.in_flight.get(handle)
+            if message is not None and message['visible_at'] <= now:
+                del queue.in_flight[handle]
+                queue.ready.append(message)
+
+        ret = []
+        while queue.ready and len(ret) < count:
+            message = queue.ready.popleft()
+            if queue.redrive is not None and message['ReceiveCount'] >= int(queue.redrive['maxReceiveCount']):
+                self._enqueue(self.queue(queue.redrive['deadLetterTargetArn']), message['Body'],
+                              message['MessageAttributes'])
+                continue
+
+            message['ReceiveCount'] += 1
+            message['visible_at'] = now + visibility_timeout
+            handle = str(uuid.uuid4())
+            queue.in_flight[handle] = message
+            heapq.heappush(queue.timeouts, (message['visible_at'], handle))
+            ret.append({
+                'MessageId': message['MessageId'],
+                'ReceiptHandle': handle,
+                'MD5OfBody': message['MD5OfBody'],
+                'Body': message['Body'],
+                'Attributes': {
+                    'ApproximateReceiveCount': str(message['ReceiveCount']),
+                    'SentTimestamp': message['SentTimestamp'],
+                },
+                'MessageAttributes': message['MessageAttributes'],
+            })
+
+        return ret
+
+
+class InMemorySns:
+    """SNS topics delivering to SQS subscriptions, honouring subscription filter policies on message attributes."""
+
+    def __init__(self, sqs: InMemorySqs, region: str = 'us-east-1', account_id: str = '000000000000',
+                 faults: Faults = None):
+        self.faults = faults or Faults()
+        self._sqs = sqs
+        self._region = region
+        self._account_id = account_id
+        self._topics: Dict[str, List[dict]] = {}
+
+    def create_topic(self, Name: str, **kwargs):
+        arn = f'arn:aws:sns:{self._region}:{self._account_id}:{Name}'
+        self._topics.setdefault(arn, [])
+        return {'TopicArn': arn}
+
+    def subscribe(self, TopicArn: str, Protocol: str, Endpoint: str, Attributes: dict = None, **kwargs):
+        if Protocol != 'sqs':
+            raise _error('InvalidParameter', 'Subscribe', message=f'Protocol {Protocol} is not supported')
+        if TopicArn not in self._topics:
+            raise _error('NotFound', 'Subscribe', 404)
+
+        attributes = Attributes or {}
+        policy = attributes.get('FilterPolicy')
+        subscription = {
+            'SubscriptionArn': f'{TopicArn}:{uuid.uuid4()}',
+            'queue': self._sqs.queue(Endpoint),
+            'filter_policy': json.loads(policy) if isinstance(policy, str) else policy,
+            'raw': str(attributes.get('RawMessageDelivery', 'false')).lower() == 'true',
+        }
+        self._topics[TopicArn].append(subscription)
+
+        return {'SubscriptionArn': subscription['SubscriptionArn']}
+
+    def publish(self, TopicArn: str, Message: str, MessageAttributes: dict = None, Subject: str = None, **kwargs):
+        self.faults('Publish')
+        return {'MessageId': self._deliver(TopicArn, Message, MessageAttributes or {}, Subject)}
+
+    def publish_batch(self, TopicArn: str, PublishBatchRequestEntries: List[dict]):
+        self.faults('PublishBatch')
+        successful, failed = [], []
+        for entry in PublishBatchRequestEntries:
+            if self.faults.fails('PublishBatchEntry'):
+                failed.append({
+                    'Id': entry['Id'], 'SenderFault': False, 'Code': 'InternalError', 'Message': 'Injected failure'
+                })
+            else:
+                message_id = self._deliver(
+                    TopicArn, entry['Message'], entry.get('MessageAttributes') or {}, entry.get('Subject')
+                )
+                successful.append({'Id': entry['Id'], 'MessageId': message_id})
+
+        return {'Successful': successful, 'Failed': failed}
+
+    def _deliver(self, topic_arn: str, message: str, attributes: dict, subject: Optional[str]):
+        if topic_arn not in self._topics:
+            raise _error('NotFound', 'Publish', 404, 'Topic does not exist')
+
+        message_id = str(uuid.uuid4())
+        for subscription in self._topics[topic_arn]:
+            if not matches_filter_policy(subscription['filter_policy'], attributes):
+                continue
+            if subscription['raw']:
+                body = message
+            else:
+                body = json.dumps({
+                    'Type': 'Notification',
+                    'MessageId': message_id,
+                    'TopicArn': topic_arn,
+                    'Subject': subject,
+                    'Message': message,
+                    'Timestamp': datetime.now(timezone.utc).isoformat(timespec='milliseconds').replace('+00:00', 'Z'),
+                    'MessageAttributes': {
+                        k: {'Type': v['DataType'], 'Value': v.get('StringValue')} for k, v in attributes.items()
+                    },
+                })
+            self._sqs._enqueue(subscription['queue'], body, attributes if subscription['raw'] else None)
+
+        return message_id
+
+
+def matches_filter_policy(policy: Optional[dict], attributes: dict) -> bool:
+    """SNS attribute filter policies: every key must match, and a key matches when any of its conditions do."""
+    if not policy:
+        return True
+
+    for key, conditions in policy.items():
+        attribute = attributes.get(key)
+        if not isinstance(conditions, list):
+            conditions = [conditions]
+        if not any(_matches_condition(c, attribute) for c in conditions):
+            return False
+
+    return True
+
+
+def _matches_condition(condition, attribute: Optional[dict]) -> bool:
+    if isinstance(condition, dict) and 'exists' in condition:
+        return (attribute is not None) is bool(condition['exists'])
+    if attribute is None:
+        return False
+
+    values = [attribute.get('StringValue')]
+    if attribute.get('DataType') == 'String.Array':
+        values = json.loads(values[0])
+
+    for value in values:
+        if isinstance(condition, dict):
+            if 'prefix' in condition and isinstance(value, str) and value.startswith(condition['prefix']):
+                return True
+            if 'anything-but' in condition:
+                excluded = condition['anything-but']
+                excluded = excluded if isinstance(excluded, list) else [excluded]
+                if value not in excluded and str(value) not in [str(e) for e in excluded]:
+                    return True
+            if 'numeric' in condition and _matches_numeric(condition['numeric'], value):
+                return True
+        elif isinstance(condition, bool) or condition is None:
+            continue
+        elif isinstance(condition, (int, float)):
+            try:
+                if float(value) == condition:
+                    return True
+            except (TypeError, ValueError):
+                pass
+        elif value == condition:
+            return True
+
+    return False
+
+
+def _matches_numeric(expression: list, value) -> bool:
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return False
+
+    operators = {
+        '=': lambda a, b: a == b, '<': lambda a, b: a < b, '<=': lambda a, b: a <= b,
+        '>': lambda a, b: a > b, '>=': lambda a, b: a >= b,
+    }
+    for i in range(0, len(expression), 2):
+        if not operators[expression[i]](value, float(expression[i + 1])):
+            return False
+    return True
+
+
+class LambdaContext:
+    """The parts of the Lambda context object that handlers read."""
+
+    def __init__(self, function_name: str, region: str, account_id: str, timeout: float = DEFAULT_FUNCTION_TIMEOUT,
+                 memory_limit_in_mb: int = 1024):
+        self.function_name = function_name
+        self.function_version = '$LATEST'
+        self.invoked_function_arn = f'arn:aws:lambda:{region}:{account_id}:function:{function_name}'
+        self.memory_limit_in_mb = memory_limit_in_mb
+        self.aws_request_id = str(uuid.uuid4())
+        self.log_group_name = f'/aws/lambda/{function_name}'
+        self.log_stream_name = self.aws_request_id
+        self._expires_at = monotonic() + timeout
+
+    def get_remaining_time_in_millis(self):
+        return max(0, int((self._expires_at - monotonic()) * 1000))
+
+
+class InMemoryLambda:
+    """
+    Functions are plain callables taking (event, context). SQS event source mappings are polled by poll() or drain(),
+    which build the same event records Lambda does and honour ReportBatchItemFailures.
+    """
+
+    def __init__(self, sqs: InMemorySqs, region: str = 'us-east-1', account_id: str = '000000000000',
+                 faults: Faults = None):
+        self.faults = faults or Faults()
+        self._sqs = sqs
+        self._region = region
+        self._account_id = account_id
+        self._functions: Dict[str, dict] = {}
+        self._mappings: List[dict] = []
+        self._async_invocations = deque()
+
+    def register(self, function_name: str, handler: Callable, timeout: float = DEFAULT_FUNCTION_TIMEOUT):
+        self._functions[function_name] = {'handler': handler, 'timeout': timeout}
+
+    def invoke(self, FunctionName: str, InvocationType: str = 'RequestResponse', Payload=b'', **kwargs):
+        self.faults('Invoke')
+        if FunctionName not in self._functions:
+            raise _error('ResourceNotFoundException', 'Invoke', 404, f'Function not found: {FunctionName}')
+
+        payload = Payload.encode('utf-8') if isinstance(Payload, str) else Payload
+        if InvocationType == 'Event':
+            self._async_invocations.append((FunctionName, payload))
+            return {'StatusCode': 202, 'Payload': io.BytesIO(b'')}
+
+        try:
+            result = self._call(FunctionName, json.loads(payload or b'null'))
+        except Exception as e:
+            return {
+                'StatusCode': 200,
+                'FunctionError': 'Unhandled',
+                'ExecutedVersion': '$LATEST',
+                'Payload': io.BytesIO(json.dumps({'errorMessage': str(e), 'errorType': e.__class__.__name__}).encode()),
+            }
+
+        return {'StatusCode': 200, 'ExecutedVersion': '$LATEST', 'Payload': io.BytesIO(json.dumps(result).encode())}
+
+    def create_event_source_mapping(self, EventSourceArn: str, FunctionName: str, BatchSize: int = 10,
+                                    FunctionResponseTypes: List[str] = None, **kwargs):
+        mapping = {
+            'UUID': str(uuid.uuid4()),
+            'EventSourceArn': self._sqs.queue(EventSourceArn).arn,
+            'FunctionName': FunctionName,
+            'BatchSize': BatchSize,
+            'ReportBatchItemFailures': 'ReportBatchItemFailures' in (FunctionResponseTypes or []),
+        }
+        self._mappings.append(mapping)
+        return {'UUID': mapping['UUID'], 'State': 'Enabled'}
+
+    def poll(self) -> int:
+        """Runs one batch per event source mapping, plus queued async invocations. Returns the records handled."""
+        handled = 0
+        while self._async_invocations:
+            function_name, payload = self._async_invocations.popleft()
+            try:
+                self._call(function_name, json.loads(payload or b'null'))
+            except Exception:
+                pass
+            handled += 1
+
+        for mapping in self._mappings:
+            handled += self._poll_mapping(mapping)
+
+        return handled
+
+    def drain(self, timeout: float = 60.0, idle: float = 0.0) -> int:
+        """
+        Polls until every mapped queue is empty, including messages waiting out a visibility timeout, or until
+        timeout. Set idle to also stop once nothing has been received for that many seconds.
+        """
+        handled = 0
+        ends_at = monotonic() + timeout
+        last_activity = monotonic()
+        while monotonic() < ends_at:
+            count = self.poll()
+            handled += count
+            if count:
+                last_activity = monotonic()
+                continue
+
+            pending = [self._sqs.depth(m['EventSourceArn']) for m in self._mappings]
+            if not any(d['visible'] or d['in_flight'] for d in pending):
+                break
+            if idle and monotonic() - last_activity >= idle:
+                break
+            sleep(.001)
+
+        return handled
+
+    def _poll_mapping(self, mapping: dict) -> int:
+        queue = self._sqs.queue(mapping['EventSourceArn'])
+        messages = self._sqs.receive_message(QueueUrl=queue.url, MaxNumberOfMessages=mapping['BatchSize']) \
+            .get('Messages', [])
+        if not messages:
+            return 0
+
+        records = [{
+            'messageId': m['MessageId'],
+            'receiptHandle': m['ReceiptHandle'],
+            'body': m['Body'],
+            'attributes': dict(m['Attributes'], SenderId=self._account_id),
+            'messageAttributes': {
+                k: {'stringValue': v.get('StringValue'), 'dataType': v['DataType']}
+                for k, v in m['MessageAttributes'].items()
+            },
+            'md5OfBody': m['MD5OfBody'],
+            'eventSource': 'aws:sqs',
+            'eventSourceARN': queue.arn,
+            'awsRegion': self._region,
+        } for m in messages]
+
+        try:
+            result = self._call(mapping['FunctionName'], {'Records': records})
+        except Exception:
+            # The whole batch becomes visible again once its visibility timeout runs out.
+            return len(records)
+
+        failed = set()
+        if mapping['ReportBatchItemFailures'] and isinstance(result, dict):
+            failed = {f['itemIdentifier'] for f in result.get('batchItemFailures') or []}
+        self._sqs.delete_message_batch(QueueUrl=queue.url, Entries=[
+            {'Id': str(i), 'ReceiptHandle': r['receiptHandle']}
+            for i, r in enumerate(records) if r['messageId'] not in failed
+        ])
+
+        return len(records)
+
+    def _call(self, function_name: str, event):
+        function = self._functions[function_name]
+        context = LambdaContext(function_name, self._region, self._account_id, function['timeout'])
+        return function['handler'](event, context)
+
+
+class InMemoryS3:
+    """Objects kept in a dict, for payloads offloaded by the transport."""
+
+    def __init__(self, faults: Faults = None):
+        self.faults = faults or Faults()
+        self.objects: Dict[tuple, bytes] = {}
+
+    def put_object(self, Bucket: str, Key: str, Body=b'', **kwargs):
+        self.faults('PutObject')
+        if hasattr(Body, 'read'):
+            Body = Body.read()
+        self.objects[(Bucket, Key)] = Body.encode('utf-8') if isinstance(Body, str) else Body
+        return {'ETag': f'"{hashlib.md5(self.objects[(Bucket, Key)]).hexdigest()}"'}
+
+    def get_object(self, Bucket: str, Key: str, **kwargs):
+        self.faults('GetObject')
+        if (Bucket, Key) not in self.objects:
+            raise _error('NoSuchKey', 'GetObject', 404)
+        body = self.objects[(Bucket, Key)]
+        return {'Body': io.BytesIO(body), 'ContentLength': len(body)}
+
+    def head_object(self, Bucket: str, Key: str, **kwargs):
+        self.faults('HeadObject')
+        if (Bucket, Key) not in self.objects:
+            raise _error('404', 'HeadObject', 404, 'Not Found')
+        return {'ContentLength': len(self.objects[(Bucket, Key)])}
+
+    def delete_object(self, Bucket: str, Key: str, **kwargs):
+        self.faults('DeleteObject')
+        self.objects.pop((Bucket, Key), None)
+        return {}
+
+
+class InMemoryAws(domain.ResourceNameAware):
+    """
+    An in-process stand-in for the SNS -> SQS -> Lambda flow, for exercising BotoMessageTransport and LambdaExecutor
+    without AWS. Inject clients() into the transport and outbox in place of the boto3 clients, and deploy_context()
+    each context the way the agent provisions it. Latency and failure rates apply to every service, and can be
+    overridden per service through its faults attribute.
+    """
+
+    def __init__(self, project: str = 'firefly', ff_environment: str = 'local', region: str = 'us-east-1',
+                 account_id: str = '000000000000', latency: float = 0.0, failure_rate: float = 0.0, seed: int = None,
+                 clock: Callable[[], float] = monotonic):
+        self._project = project
+        self._ff_environment = ff_environment
+        self._region = region
+        self._account_id = account_id
+        faults = Faults(latency, failure_rate, seed)
+        self.sqs = InMemorySqs(region, account_id, faults, clock)
+        self.sns = InMemorySns(self.sqs, region, account_id, faults)
+        self.lambda_ = InMemoryLambda(self.sqs, region, account_id, faults)
+        self.s3 = InMemoryS3(faults)
+
+    def clients(self) -> dict:
+        return {'sns_client': self.sns, 'sqs_client': self.sqs, 'lambda_client': self.lambda_, 's3_client': self.s3}
+
+    def deploy_context(self, context: str, sync_handler: Callable = None, async_handler: Callable = None,
+                       subscriptions: Dict[str, List[str]] = None, batch_size: int = 1,
+                       visibility_timeout: float = DEFAULT_VISIBILITY_TIMEOUT, max_receive_count: int = 2):
+        """
+        Creates the context's topic, queue, dead-letter queue and functions. subscriptions maps a context name to the
+        event names this context listens to; the queue subscribes to that context's topic with a _name filter.
+        """
+        dlq = self.sqs.create_queue(QueueName=f'{self._queue_name(context)}Dlq', Attributes={
+            'VisibilityTimeout': str(visibility_timeout),
+        })
+        queue = self.sqs.create_queue(QueueName=self._queue_name(context), Attributes={
+            'VisibilityTimeout': str(visibility_timeout),
+            'RedrivePolicy': json.dumps({
+                'deadLetterTargetArn': self.sqs.queue(dlq['QueueUrl']).arn,
+                'maxReceiveCount': max_receive_count,
+            }),
+        })
+        self.sns.create_topic(Name=self._topic_name(context))
+
+        if sync_handler is not None:
+            self.lambda_.register(self._lambda_function_name(context, 'Sync'), sync_handler)
+        if async_handler is not None:
+            self.lambda_.register(self._lambda_function_name(context, 'Async'), async_handler)
+            self.lambda_.create_event_source_mapping(
+                EventSourceArn=self.sqs.queue(queue['QueueUrl']).arn,
+                FunctionName=self._lambda_function_name(context, 'Async'),
+                BatchSize=batch_size,
+                FunctionResponseTypes=['ReportBatchItemFailures']
+            )
+
+        for context_name, names in (subscriptions or {}).items():
+            topic_arn = self.sns.create_topic(Name=self._topic_name(context_name))['TopicArn']
+            self.sns.subscribe(
+                TopicArn=topic_arn,
+                Protocol='sqs',
+                Endpoint=self.sqs.queue(queue['QueueUrl']).arn,
+                Attributes={'FilterPolicy': json.dumps({'_name': list(names)})}
+            )
+
+        return queue['QueueUrl']
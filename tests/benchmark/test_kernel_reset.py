@@ -0,0 +1,56 @@
+from time import perf_counter
+from unittest.mock import MagicMock
+
+import firefly as ff
+from firefly_aws.domain import ResetKernel
+
+NUM_REPOSITORIES = 50
+INVOCATIONS = 5000
+
+
+class Repository:
+    def __init__(self):
+        self.reset()
+
+    def reset(self):
+        self._entities = []
+        self._deletions = []
+        self._entity_hashes = {}
+        self._query_details = {}
+        self._state = 'empty'
+
+
+def test_reset_overhead():
+    results = {}
+    for mode in ('full', 'incremental', 'debug'):
+        sut = _build(mode)
+        repositories = list(sut._registry._cache.values())
+
+        start = perf_counter()
+        for i in range(INVOCATIONS):
+            # A typical request: authenticated, one repository used.
+            sut._kernel.user = ff.User()
+            sut._kernel.http_request = {'headers': {}}
+            repositories[i % NUM_REPOSITORIES]._entities.append(i)
+            sut()
+        results[mode] = (perf_counter() - start) / INVOCATIONS * 1_000_000
+
+        assert sut._kernel.user is None
+        assert not any(r._entities for r in repositories)
+
+    print()
+    for mode, micros in results.items():
+        print(f'{mode:<15}{micros:>10.2f} us/invocation ({NUM_REPOSITORIES} repositories)')
+
+
+def _build(mode: str):
+    ResetKernel._configuration = MagicMock(contexts={'firefly_aws': {'kernel_reset': mode}})
+    try:
+        ret = ResetKernel()
+    finally:
+        ResetKernel._configuration = None
+    ret._kernel = ff.Kernel()
+    ret._registry = MagicMock()
+    ret._registry._cache = {i: Repository() for i in range(NUM_REPOSITORIES)}
+
+    return ret
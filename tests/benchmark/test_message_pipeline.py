@@ -0,0 +1,101 @@
+import random
+from time import perf_counter
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import firefly.infrastructure as ffi
+from firefly.domain.service.messaging.message_factory import MessageFactory
+from firefly_aws.application import Container
+from firefly_aws.domain import ExecutionContext, LambdaExecutor, LoadPayload
+from firefly_aws.infrastructure import BotoMessageTransport, BotoOutbox, StdlibJsonCodec
+from firefly_aws.testing import InMemoryAws
+
+MESSAGES = 1000
+SCENARIOS = (
+    # name, per-call latency (s), batch size, handler failure rate
+    ('no latency', 0.0, 1, 0.0),
+    ('no latency', 0.0, 10, 0.0),
+    ('2ms per call', .002, 10, 0.0),
+    ('5% failures', 0.0, 10, .05),
+)
+
+
+def test_messages_per_second():
+    results = []
+    for name, latency, batch_size, failure_rate in SCENARIOS:
+        aws = InMemoryAws(project='todo-app', ff_environment='dev', latency=latency, seed=1)
+        executor, handled = _executor(failure_rate)
+        aws.deploy_context(
+            'billing', async_handler=executor.run, subscriptions={'todo': ['TodoCreated']}, batch_size=batch_size,
+            visibility_timeout=.01, max_receive_count=5
+        )
+        transport = _transport(aws)
+
+        start = perf_counter()
+        # A producer invocation: events are buffered in the outbox and published in batches when it ends.
+        transport._execution_context.context = MagicMock()
+        for i in range(MESSAGES):
+            transport.dispatch(MessageFactory().event('todo.TodoCreated', {'id': i}))
+        transport._outbox.flush()
+        published = perf_counter() - start
+        aws.lambda_.drain(timeout=60)
+        elapsed = perf_counter() - start
+
+        assert len(handled) == MESSAGES
+        results.append((name, batch_size, MESSAGES / published, MESSAGES / elapsed))
+
+    print(f'\n{"scenario":<16}{"batch":>6}{"published/s":>14}{"delivered/s":>14}')
+    for name, batch_size, published, delivered in results:
+        print(f'{name:<16}{batch_size:>6}{published:>14.0f}{delivered:>14.0f}')
+
+
+def _transport(aws: InMemoryAws):
+    BotoOutbox._configuration = MagicMock(contexts={'firefly_aws': {}})
+    try:
+        outbox = BotoOutbox()
+    finally:
+        BotoOutbox._configuration = None
+    outbox._sns_client = aws.sns
+    outbox._sqs_client = aws.sqs
+    outbox._logger = MagicMock()
+
+    ret = BotoMessageTransport()
+    ret._project = 'todo-app'
+    ret._ff_environment = 'dev'
+    ret._json_codec = StdlibJsonCodec()
+    ret._store_large_payloads_in_s3 = lambda payload, **kwargs: payload
+    ret._execution_context = outbox._execution_context = ExecutionContext()
+    ret._outbox = outbox
+    ret._region = aws._region
+    ret._account_id = aws._account_id
+
+    return ret
+
+
+def _executor(failure_rate: float):
+    handled = set()
+    rng = random.Random(1)
+
+    def dispatch(message, data=None):
+        if rng.random() < failure_rate:
+            raise RuntimeError('Injected failure')
+        handled.add(message.id)
+
+    ret = Container().mock(LambdaExecutor)
+    ret._serializer = ffi.JsonSerializer()
+    ret._serializer._message_factory = MessageFactory()
+    ret._json_codec = StdlibJsonCodec()
+    ret._system_bus = MagicMock(dispatch=dispatch)
+    ret._access_log = MagicMock()
+    ret._boot_profiler = MagicMock(finish=lambda: None)
+    ret._outbox = MagicMock()
+    ret._load_payload = MagicMock(is_reference=LoadPayload.is_reference)
+    ret._execution_context = ExecutionContext()
+    ret._configuration = MagicMock(contexts={'firefly_aws': {}})
+    ret._context = 'billing'
+    ret._context_map = MagicMock(contexts=[
+        SimpleNamespace(name='billing', event_listeners={'Listener': ['todo.TodoCreated']}),
+    ])
+    ret._logger = MagicMock()
+
+    return ret, handled
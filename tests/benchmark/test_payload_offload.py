@@ -0,0 +1,83 @@
+import json
+import random
+from time import perf_counter, sleep
+from unittest.mock import MagicMock
+
+import firefly.infrastructure as ffi
+from firefly.domain.service.messaging.message_factory import MessageFactory
+from firefly_aws.domain import LoadPayload, StoreLargePayloadsInS3
+from firefly_aws.infrastructure import StdlibJsonCodec
+
+# Round trip assumed for each S3 request made from inside Lambda.
+S3_LATENCY = .015
+MESSAGES = 20
+
+
+class FakeS3:
+    def __init__(self):
+        self.objects = {}
+        self.requests = 0
+
+    def put_object(self, Body, Bucket, Key):
+        self.requests += 1
+        sleep(S3_LATENCY)
+        self.objects[Key] = Body
+
+    def get_object(self, Bucket, Key):
+        self.requests += 1
+        sleep(S3_LATENCY)
+        return {'Body': MagicMock(read=lambda: self.objects[Key])}
+
+
+def test_publish_consume_latency():
+    results = []
+    for size_name, items in (('100KB', 1_000), ('500KB', 5_000), ('1MB', 10_000)):
+        payload = _payload(items)
+        for codec in ('none', 'gzip'):
+            s3 = FakeS3()
+            store, load = _services(s3, codec)
+
+            start = perf_counter()
+            for i in range(MESSAGES):
+                envelope = store(payload, name='TodosImported', context='todo', type_='event', id_=str(i))
+                message = load(json.loads(envelope))
+            elapsed = (perf_counter() - start) / MESSAGES * 1000
+
+            assert message.to_dict()['items'] == json.loads(payload)['items']
+            results.append((size_name, codec, len(payload), len(envelope), elapsed, s3.requests / MESSAGES))
+
+    print(f'\nS3 latency assumed: {S3_LATENCY * 1000:.0f} ms/request')
+    print(f'{"payload":<10}{"codec":<8}{"raw bytes":>12}{"sent bytes":>12}{"ms/message":>12}{"S3 req/msg":>12}')
+    for size_name, codec, raw, sent, millis, requests in results:
+        print(f'{size_name:<10}{codec:<8}{raw:>12}{sent:>12}{millis:>12.2f}{requests:>12.1f}')
+
+
+def _payload(items: int):
+    rng = random.Random(items)
+    return json.dumps({
+        '_name': 'TodosImported',
+        '_type': 'event',
+        '_context': 'todo',
+        'items': [{
+            'id': f'{rng.getrandbits(64):016x}',
+            'name': f'Todo number {i}',
+            'done': rng.random() < .5,
+            'tags': rng.sample(['home', 'work', 'errand', 'urgent', 'someday'], 2),
+            'created_on': f'2021-0{rng.randint(1, 9)}-1{rng.randint(0, 9)}T12:00:00',
+        } for i in range(items)],
+    })
+
+
+def _services(s3: FakeS3, codec: str):
+    store = StoreLargePayloadsInS3()
+    store._s3_client = s3
+    store._json_codec = StdlibJsonCodec()
+    store._configuration = MagicMock(contexts={'firefly_aws': {'payload_codec': codec}})
+
+    load = LoadPayload()
+    load._s3_client = s3
+    load._json_codec = StdlibJsonCodec()
+    load._serializer = ffi.JsonSerializer()
+    load._serializer._message_factory = MessageFactory()
+
+    return store, load
@@ -0,0 +1,67 @@
+import json
+from time import perf_counter, sleep
+from unittest.mock import MagicMock
+
+import firefly.infrastructure as ffi
+from firefly.domain.service.messaging.message_factory import MessageFactory
+from firefly_aws.domain import LoadPayload, StoreLargePayloadsInS3
+from firefly_aws.infrastructure import StdlibJsonCodec
+from firefly_aws.testing import InMemoryAws
+
+# Round trip assumed for each S3 request made from inside Lambda, and time spent handling each record.
+S3_LATENCY = .015
+HANDLING_TIME = .005
+BATCH_SIZE = 10
+
+
+def test_batch_latency():
+    aws = InMemoryAws()
+    store, load = _services(aws)
+    envelopes = {
+        f'message-{i}': json.loads(store(_payload(i), name='TodosImported', context='todo', type_='event', id_=str(i)))
+        for i in range(BATCH_SIZE)
+    }
+    aws.s3.faults.latency = S3_LATENCY
+
+    start = perf_counter()
+    for envelope in envelopes.values():
+        load(envelope)
+        sleep(HANDLING_TIME)
+    serial = perf_counter() - start
+
+    start = perf_counter()
+    with load.prefetch(envelopes) as prefetched:
+        for key in envelopes:
+            prefetched.take(key)
+            sleep(HANDLING_TIME)
+            prefetched.done(key)
+    concurrent = perf_counter() - start
+
+    assert concurrent < serial
+    print(f'\n{BATCH_SIZE} records, {S3_LATENCY * 1000:.0f} ms/S3 request, {HANDLING_TIME * 1000:.0f} ms handling')
+    print(f'{"serial":<12}{serial * 1000:>10.1f} ms/batch')
+    print(f'{"prefetched":<12}{concurrent * 1000:>10.1f} ms/batch')
+
+
+def _payload(seed: int):
+    return json.dumps({
+        '_name': 'TodosImported',
+        '_type': 'event',
+        '_context': 'todo',
+        'items': [{'id': f'{seed}-{i}', 'name': f'Todo number {i}', 'done': i % 3 == 0} for i in range(10_000)],
+    })
+
+
+def _services(aws: InMemoryAws):
+    store = StoreLargePayloadsInS3()
+    store._s3_client = aws.s3
+    store._json_codec = StdlibJsonCodec()
+    store._configuration = MagicMock(contexts={'firefly_aws': {'max_inline_payload_size': 1_000}})
+
+    load = LoadPayload()
+    load._s3_client = aws.s3
+    load._json_codec = StdlibJsonCodec()
+    load._serializer = ffi.JsonSerializer()
+    load._serializer._message_factory = MessageFactory()
+
+    return store, load
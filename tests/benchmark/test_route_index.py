@@ -0,0 +1,58 @@
+import random
+from time import perf_counter
+
+import firefly as ff
+import firefly.infrastructure as ffi
+from firefly_aws.infrastructure import TrieRestRouter
+
+NUM_CONTEXTS = 10
+RESOURCES_PER_CONTEXT = 13
+MATCHES = 500
+
+
+def test_route_match_latency():
+    routes = _routes()
+    assert len(routes) >= 500
+
+    requests = [(_concrete(route), method) for route, method in random.Random(1).choices(routes, k=MATCHES)]
+    results = {}
+    for name, router, warm_up in (
+        ('routes (current)', ffi.RoutesRestRouter(), requests[:1]),
+        ('trie, uncached', TrieRestRouter(cache_size=0), requests[:1]),
+        ('trie, cached', TrieRestRouter(), requests),
+    ):
+        for route, method in routes:
+            router.register(route, ff.HttpEndpoint(route=route, method=method, message=f'{method}:{route}'))
+        for route, method in warm_up:
+            router.match(route, method)
+
+        start = perf_counter()
+        matches = [router.match(route, method)[0] for route, method in requests]
+        results[name] = ((perf_counter() - start) / MATCHES * 1_000_000, [m.message for m in matches])
+
+    print()
+    for name, (micros, _) in results.items():
+        print(f'{name:<20}{micros:>10.1f} us/match')
+
+    expected = results['routes (current)'][1]
+    assert results['trie, uncached'][1] == expected
+    assert results['trie, cached'][1] == expected
+
+
+def _routes():
+    ret = []
+    for c in range(NUM_CONTEXTS):
+        for r in range(RESOURCES_PER_CONTEXT):
+            base = f'/context-{c}/resource-{r}'
+            ret.extend([
+                (base, 'GET'),
+                (base, 'POST'),
+                (f'{base}/{{id}}', 'GET'),
+                (f'{base}/{{id}}', 'PUT'),
+                (f'{base}/{{id}}/children/{{child_id}}', 'GET'),
+            ])
+    return ret
+
+
+def _concrete(route: str):
+    return route.replace('{id}', 'a1b2c3').replace('{child_id}', 'd4e5f6')
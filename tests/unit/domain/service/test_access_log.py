@@ -0,0 +1,84 @@
+import json
+import logging
+from unittest.mock import MagicMock
+
+import pytest
+from firefly_aws.domain import AccessLog, ExecutionContext, Truncated
+from firefly_aws.infrastructure import StdlibJsonCodec
+
+
+def test_one_record_per_invocation(sut):
+    sut.start(request_id='abc', cold_start=True)
+    sut.annotate(route='GET /todos', message='todo.GetTodos')
+    sut.finish({'statusCode': 200, 'body': '[1,2]'})
+
+    sut._logger.info.assert_called_once()
+    record = json.loads(sut._logger.info.call_args[0][1])
+    assert record.pop('latency_ms') >= 0
+    assert record == {
+        'event_type': 'access-log',
+        'request_id': 'abc',
+        'cold_start': True,
+        'route': 'GET /todos',
+        'message': 'todo.GetTodos',
+        'status': 200,
+        'response_bytes': 5,
+    }
+
+
+def test_record_can_be_disabled(sut):
+    sut._configuration.contexts['firefly_aws']['access_log'] = False
+
+    sut.start()
+    sut.finish({'statusCode': 200})
+
+    sut._logger.info.assert_not_called()
+
+
+def test_payloads_are_skipped_below_debug(sut):
+    sut.start()
+    sut.payload('Event', {'body': 'x'})
+
+    sut._logger.debug.assert_not_called()
+
+
+def test_payloads_are_truncated(sut):
+    sut._logger.get_level.return_value = logging.DEBUG
+    sut._configuration.contexts['firefly_aws']['payload_log_max_length'] = 10
+
+    sut.start()
+    sut.payload('Event', 'x' * 100)
+
+    assert str(sut._logger.debug.call_args[0][2]) == 'xxxxxxxxxx... [truncated]'
+
+
+def test_payloads_are_sampled(sut):
+    sut._logger.get_level.return_value = logging.DEBUG
+    sut._configuration.contexts['firefly_aws']['payload_log_sample_rate'] = 0
+
+    sut.start()
+    sut.payload('Event', {'body': 'x'})
+
+    sut._logger.debug.assert_not_called()
+
+
+@pytest.mark.parametrize('data,expected', [
+    ('short', 'short'),
+    (b'\xc3\xbcber long', '\xfcber... [truncated]'),
+    ([1, 2, 3], '[1, 2... [truncated]'),
+])
+def test_truncated(data, expected):
+    assert str(Truncated(data, 5)) == expected
+
+
+@pytest.fixture()
+def sut():
+    ret = AccessLog()
+    ret._configuration = MagicMock()
+    ret._configuration.contexts = {'firefly_aws': {}}
+    ret._execution_context = ExecutionContext()
+    ret._json_codec = StdlibJsonCodec()
+    ret._logger = MagicMock()
+    ret._logger.get_level.return_value = logging.INFO
+
+    return ret
@@ -0,0 +1,80 @@
+import importlib
+import json
+import sys
+
+import pytest
+from firefly_aws.domain import BootProfiler
+from firefly_aws.domain.service.boot_profiler import _TimedImportFinder
+
+
+def test_spans_are_recorded(sut):
+    with sut.span('di', 'LambdaExecutor'):
+        pass
+
+    report = sut.report()
+
+    assert report['event_type'] == 'boot-timeline'
+    assert [(s['phase'], s['name']) for s in report['spans']] == [('di', 'LambdaExecutor')]
+    assert 'di' in report['totals_ms']
+
+
+def test_finish_writes_timeline_once(sut, tmp_path):
+    sut._file_name = str(tmp_path / 'boot.json')
+    with sut.span('boto3', 'client:s3'):
+        pass
+
+    timeline = sut.finish()
+
+    assert json.loads((tmp_path / 'boot.json').read_text()) == timeline
+    assert sut.finish() is None
+
+
+def test_disabled_profiler_records_nothing():
+    profiler = BootProfiler(enabled=False)
+    with profiler.span('di', 'Foo'):
+        pass
+
+    assert profiler.finish() is None
+    assert profiler.report()['spans'] == []
+
+
+def test_module_imports_are_timed(sut, tmp_path):
+    (tmp_path / 'profiled_module.py').write_text('x = 1\n')
+    finder = _TimedImportFinder(sut)
+    sys.path.insert(0, str(tmp_path))
+    sys.meta_path.insert(0, finder)
+    try:
+        importlib.import_module('profiled_module')
+    finally:
+        sys.meta_path.remove(finder)
+        sys.path.remove(str(tmp_path))
+        sys.modules.pop('profiled_module', None)
+
+    assert ('import', 'profiled_module') in [(s['phase'], s['name']) for s in sut.report()['spans']]
+
+
+def test_shared_loaders_are_left_untouched(sut, tmp_path):
+    for name in ('first_module', 'second_module'):
+        (tmp_path / f'{name}.py').write_text('x = 1\n')
+    finder = _TimedImportFinder(sut)
+    sys.path.insert(0, str(tmp_path))
+    sys.meta_path.insert(0, finder)
+    try:
+        first = importlib.import_module('first_module')
+        second = importlib.import_module('second_module')
+    finally:
+        sys.meta_path.remove(finder)
+        sys.path.remove(str(tmp_path))
+        sys.modules.pop('first_module', None)
+        sys.modules.pop('second_module', None)
+
+    assert 'exec_module' not in vars(first.__loader__._loader)
+    assert first.__loader__.get_filename('first_module').endswith('first_module.py')
+    names = [s['name'] for s in sut.report()['spans'] if s['phase'] == 'import']
+    assert names.count('first_module') == 1 and names.count('second_module') == 1
+    assert second.x == 1
+
+
+@pytest.fixture()
+def sut():
+    return BootProfiler(enabled=True)
@@ -0,0 +1,55 @@
+from time import monotonic
+from unittest.mock import MagicMock, patch
+
+import pytest
+from firefly_aws.domain import Deadline, LambdaTimedOut
+
+
+def test_unbounded():
+    deadline = Deadline()
+
+    assert deadline.remaining() is None
+    assert deadline.expired() is False
+    assert deadline.can_finish(10_000) is True
+    assert deadline.timeout(60) == 60
+
+
+def test_from_context_leaves_safety_margin():
+    context = MagicMock()
+    context.get_remaining_time_in_millis.return_value = 10_000
+
+    deadline = Deadline.from_context(context, 2000)
+
+    assert 7.9 < deadline.remaining() <= 8
+    assert deadline.timeout(60) <= 8
+    assert deadline.timeout(5) == 5
+    assert deadline.can_finish(7) is True
+    assert deadline.can_finish(9) is False
+
+
+def test_expired_deadline_raises():
+    deadline = Deadline(monotonic() - 1)
+
+    assert deadline.remaining() == 0
+    with pytest.raises(LambdaTimedOut):
+        deadline.check()
+
+
+@patch('firefly_aws.domain.service.deadline.sleep')
+def test_retry_stops_when_the_wait_would_pass_the_deadline(sleep):
+    deadline = Deadline(monotonic() + 3)
+    cb = MagicMock(side_effect=RuntimeError('boom'))
+
+    with pytest.raises(RuntimeError):
+        deadline.retry(cb, wait=2)
+
+    assert cb.call_count == 2
+    sleep.assert_called_once_with(2)
+
+
+@patch('firefly_aws.domain.service.deadline.sleep')
+def test_retry_returns_first_success(sleep):
+    cb = MagicMock(side_effect=[RuntimeError('boom'), 'ok'])
+
+    assert Deadline().retry(cb, wait=1) == 'ok'
+    sleep.assert_called_once_with(1)
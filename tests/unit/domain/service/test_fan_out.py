@@ -0,0 +1,91 @@
+from time import monotonic, sleep
+from unittest.mock import MagicMock
+
+import firefly as ff
+import pytest
+from firefly_aws.domain import Deadline, ExecutionContext, FanOut, IsolateKernelState, LambdaTimedOut
+
+
+def test_calls_run_concurrently_and_keep_their_order(sut):
+    sut._system_bus.request.side_effect = _slow(lambda name, data: (name, data))
+
+    start = monotonic()
+    results = sut.request_many([('todo.GetTodo', {'id': i}) for i in range(5)])
+
+    assert results == [('todo.GetTodo', {'id': i}) for i in range(5)]
+    assert monotonic() - start < .25
+
+
+def test_failures_are_returned_in_place(sut):
+    error = ff.MessageBusError('boom')
+    sut._system_bus.invoke.side_effect = lambda name, data=None, async_=False: _raise(error) if name == 'b' else name
+
+    assert sut.invoke_many(['a', 'b', 'c']) == ['a', error, 'c']
+
+
+def test_failures_can_be_raised(sut):
+    sut._system_bus.invoke.side_effect = lambda name, data=None, async_=False: _raise(ff.MessageBusError(name))
+
+    with pytest.raises(ff.MessageBusError):
+        sut.invoke_many(['a', 'b'], return_exceptions=False)
+
+
+def test_calls_past_the_deadline_time_out(sut):
+    sut._system_bus.request.side_effect = lambda name, criteria=None, data=None: sleep(.3 if name == 'slow' else 0)
+    sut._execution_context.deadline = Deadline(monotonic() + .1)
+
+    fast, slow = sut.request_many(['fast', 'slow'])
+
+    assert fast is None
+    assert isinstance(slow, LambdaTimedOut)
+
+
+def test_workers_get_isolated_copies_of_the_kernel_state(sut):
+    sut._isolate_kernel_state = IsolateKernelState()
+    sut._isolate_kernel_state._kernel = sut._kernel
+    sut._kernel.user = ff.User(id='abc')
+
+    def request(name, criteria=None, data=None):
+        user = sut._kernel.user.id
+        sut._kernel.user = ff.User(id=name)
+        return user
+    sut._system_bus.request.side_effect = request
+
+    assert sut.request_many(['a', 'b']) == ['abc', 'abc']
+    assert sut._kernel.user.id == 'abc'
+
+
+def test_the_pool_is_reused(sut):
+    sut.request_many(['a', 'b'])
+    pool = sut._pool
+    sut.request_many(['c'])
+
+    assert sut._pool is pool
+    sut._isolate_kernel_state.assert_called_once()
+
+
+def _slow(cb):
+    def wrapper(name, criteria=None, data=None):
+        sleep(.1)
+        return cb(name, data)
+    return wrapper
+
+
+def _raise(error: Exception):
+    raise error
+
+
+@pytest.fixture()
+def sut():
+    FanOut._configuration = MagicMock(contexts={'firefly_aws': {}})
+    try:
+        ret = FanOut()
+    finally:
+        FanOut._configuration = None
+    ret._system_bus = MagicMock()
+    ret._kernel = ff.Kernel()
+    ret._isolate_kernel_state = MagicMock()
+    ret._reset_kernel = MagicMock()
+    ret._execution_context = ExecutionContext()
+
+    return ret
@@ -0,0 +1,102 @@
+import threading
+
+import firefly as ff
+import pytest
+from firefly_aws.domain import IsolateKernelState
+
+
+def test_state_is_local_to_each_thread(sut):
+    kernel = sut._kernel
+    kernel.user = 'main'
+    seen = {}
+
+    def run():
+        seen['before'] = kernel.user
+        kernel.user = 'worker'
+        seen['after'] = kernel.user
+
+    sut()
+    thread = threading.Thread(target=run)
+    thread.start()
+    thread.join()
+
+    assert kernel.user == 'main'
+    assert seen == {'before': None, 'after': 'worker'}
+
+
+def test_isolation_is_idempotent(sut):
+    kernel_class = sut().__class__
+
+    assert sut().__class__ is kernel_class
+    assert isinstance(sut._kernel, ff.Kernel)
+
+
+def test_repository_state_is_local_to_each_thread(sut):
+    repository = sut._registry._cache['todo']
+    repository._entities.append('main')
+
+    sut()
+    seen = _in_thread(lambda: (list(repository._entities), repository._entities.append('worker'))[0])
+
+    assert seen == []
+    assert repository._entities == ['main']
+    assert repository._state == 'empty'
+
+
+def test_repositories_created_later_are_isolated(sut):
+    sut()
+    repository = sut._registry(ff.AggregateRoot)
+    repository._deletions.append('main')
+
+    assert _in_thread(lambda: list(repository._deletions)) == []
+    assert isinstance(repository, Repository)
+
+
+def test_unit_of_work_is_local_to_each_thread(sut):
+    sut._transaction_handler._level = 1
+    sut._transaction_handler._event_buffer.append('main')
+
+    sut()
+
+    assert _in_thread(lambda: (sut._transaction_handler._level, sut._transaction_handler._event_buffer)) == (0, [])
+    assert sut._transaction_handler._level == 1
+
+
+class Repository:
+    def __init__(self):
+        self._entities = []
+        self._deletions = []
+        self._entity_hashes = {}
+
+
+class TransactionHandler:
+    def __init__(self):
+        self._level = 0
+        self._event_buffer = []
+
+
+class Registry:
+    def __init__(self):
+        self._cache = {'todo': Repository()}
+
+    def __call__(self, entity):
+        return self._cache.setdefault(entity, Repository())
+
+
+def _in_thread(cb):
+    ret = []
+    thread = threading.Thread(target=lambda: ret.append(cb()))
+    thread.start()
+    thread.join()
+
+    return ret[0]
+
+
+@pytest.fixture()
+def sut():
+    ret = IsolateKernelState()
+    ret._kernel = ff.Kernel()
+    ret._registry = Registry()
+    ret._transaction_handler = TransactionHandler()
+
+    return ret
@@ -0,0 +1,59 @@
+import base64
+import hashlib
+
+from firefly_aws.domain.service import kinesis_aggregation
+
+
+def test_records_survive_a_round_trip():
+    records = [('todo-1', b'{"a": 1}'), ('todo-2', b''), ('todo-1', b'x' * 300)]
+
+    assert kinesis_aggregation.deaggregate(kinesis_aggregation.aggregate(records)) == records
+
+
+def test_partition_keys_are_stored_once():
+    data = kinesis_aggregation.aggregate([('todo-1', b'a'), ('todo-1', b'b'), ('todo-2', b'c')])
+
+    assert data.count(b'todo-1') == 1
+
+
+def test_aggregated_size_bounds_what_a_record_adds():
+    before = kinesis_aggregation.aggregate([('a', b'1')])
+    after = kinesis_aggregation.aggregate([('a', b'1'), ('todo-2', b'x' * 200)])
+
+    assert len(after) - len(before) <= kinesis_aggregation.aggregated_size('todo-2', b'x' * 200)
+
+
+def test_plain_records_are_not_deaggregated():
+    assert kinesis_aggregation.deaggregate(b'{"_name": "TodoCreated"}') is None
+    assert kinesis_aggregation.deaggregate_record(base64.b64encode(b'{"_name": "TodoCreated"}').decode()) is None
+    assert kinesis_aggregation.deaggregate_record('{"_name": "TodoCreated"}') is None
+
+
+def test_records_with_a_bad_digest_are_not_deaggregated():
+    data = bytearray(kinesis_aggregation.aggregate([('todo-1', b'a')]))
+    data[-1] ^= 1
+
+    assert kinesis_aggregation.deaggregate(bytes(data)) is None
+
+
+def test_unknown_fields_are_skipped():
+    # explicit_hash_key_table (2) and a Record's explicit_hash_key_index (2) and tags (4), as the KPL may write them.
+    body = b'\x0a\x01k' + b'\x12\x01' + b'7' + b'\x1a\x0b\x08\x00\x10\x00\x1a\x01d\x22\x02\x0a\x00'
+    data = kinesis_aggregation.MAGIC + body + hashlib.md5(body).digest()
+
+    assert kinesis_aggregation.deaggregate(data) == [('k', b'd')]
+
+
+def test_bucket_hash_keys_stay_in_their_bucket():
+    for shards in (1, 3, 8):
+        for bucket in range(shards):
+            key = int(kinesis_aggregation.bucket_hash_key(bucket, shards))
+            assert key * shards >> 128 == bucket
+
+
+def test_kinesis_events_setting():
+    assert kinesis_aggregation.partition_key_fields({}) == {}
+    assert kinesis_aggregation.partition_key_fields({'kinesis_events': ['todo.TodoCreated']}) == \
+        {'todo.TodoCreated': 'id'}
+    assert kinesis_aggregation.partition_key_fields({'kinesis_events': {'todo.TodoCreated': 'todo_id'}}) == \
+        {'todo.TodoCreated': 'todo_id'}
@@ -1,12 +1,527 @@
+import base64
+import gzip
+import io
+import json
+from contextlib import nullcontext
+from datetime import datetime
+from types import SimpleNamespace
+from unittest.mock import MagicMock
+
+import firefly as ff
 import pytest
-from firefly_aws.domain import LambdaExecutor
+from firefly.domain.service.messaging.message_factory import MessageFactory
+from firefly_aws.domain import Deadline, ExecutionContext, LambdaExecutor, LoadPayload, ResponseCompressor
 from firefly_aws.application import Container
+from firefly_aws.domain.service import kinesis_aggregation
 import firefly.infrastructure as ff_infra
+from firefly_aws.infrastructure import StdlibJsonCodec
+
+SEQUENCE_NUMBER = '49590338271490256608559692538361571095921575989136588898'
+
+
+def test_async_event_reports_only_failed_records(sut):
+    sut._system_bus.dispatch.side_effect = [None, RuntimeError('boom'), None]
+
+    response = sut._handle_async_event(_sqs_event({'a': 1}, {'b': 2}, {'c': 3}))
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+    assert sut._system_bus.dispatch.call_count == 3
+
+
+def test_async_event_with_no_failures(sut):
+    response = sut._handle_async_event(_sqs_event({'a': 1}))
+
+    assert response == {'batchItemFailures': []}
+
+
+def test_loaded_payloads_are_released_once_handled(sut):
+    reference = {'PAYLOAD_KEY': 'tmp/ab/abc.json.gz', 'PAYLOAD_RELEASE': True}
+    sut._load_payload.return_value = ff.Event()
+    sut._configuration.contexts = {'firefly_aws': {}}
+
+    sut._handle_async_event(_sqs_event(reference))
+
+    assert sut._load_payload.release.call_args[0][0] == reference
+
+
+def test_payloads_are_not_released_when_handling_fails(sut):
+    sut._load_payload.return_value = ff.Event()
+    sut._configuration.contexts = {'firefly_aws': {}}
+    sut._system_bus.dispatch.side_effect = RuntimeError('boom')
+
+    sut._handle_async_event(_sqs_event({'PAYLOAD_KEY': 'tmp/ab/abc.json.gz', 'PAYLOAD_RELEASE': True}))
+
+    sut._load_payload.release.assert_not_called()
+
+
+def test_referenced_payloads_in_a_batch_are_prefetched(sut):
+    sut._configuration.contexts = {'firefly_aws': {}}
+    prefetched = MagicMock(take=MagicMock(return_value=ff.Event()))
+    prefetched.__contains__.return_value = True
+    sut._load_payload.prefetch.return_value = nullcontext(prefetched)
+
+    sut._handle_async_event(_sqs_event({'PAYLOAD_KEY': 'a.json.gz'}, {'b': 2}, {'PAYLOAD_KEY': 'c.json.gz'}))
+
+    assert list(sut._load_payload.prefetch.call_args[0][0]) == ['message-0', 'message-2']
+    assert [c[0][0] for c in prefetched.take.call_args_list] == ['message-0', 'message-2']
+    assert prefetched.done.call_count == 3
+    sut._load_payload.assert_not_called()
+
+
+def test_aggregated_kinesis_records_are_dispatched_as_events(sut):
+    sut._serializer._message_factory = MessageFactory()
+    data = kinesis_aggregation.aggregate([
+        ('todo-1', json.dumps({'_name': 'TodoCreated', '_type': 'event', '_context': 'todo'}).encode()),
+        ('todo-2', json.dumps({'_name': 'TodoDeleted', '_type': 'event', '_context': 'todo'}).encode()),
+    ])
+
+    response = sut._handle_async_event(_kinesis_event(data))
+
+    assert response == {'batchItemFailures': []}
+    assert [str(c[0][0]) for c in sut._system_bus.dispatch.call_args_list] == ['todo.TodoCreated', 'todo.TodoDeleted']
+    sut._system_bus.invoke.assert_not_called()
+
+
+def test_failed_aggregated_records_are_reported_by_sequence_number(sut):
+    sut._serializer._message_factory = MessageFactory()
+    sut._system_bus.dispatch.side_effect = [None, RuntimeError('boom')]
+    data = kinesis_aggregation.aggregate([('todo-1', b'{"_name": "A", "_type": "event", "_context": "todo"}')] * 2)
+
+    response = sut._handle_async_event(_kinesis_event(data))
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': SEQUENCE_NUMBER}]}
+    assert sut._system_bus.dispatch.call_count == 2
+
+
+def test_unhandled_events_are_acknowledged_without_parsing(sut):
+    _listen(sut, 'todo.TodoCreated')
+    sut._serializer = MagicMock()
+    event = {'Records': [
+        {'messageId': 'message-0', 'body': json.dumps({'Message': 'not json', 'MessageAttributes': _attributes(
+            'TodoDeleted', 'Value'
+        )})},
+        {'messageId': 'message-1', 'body': 'not json', 'messageAttributes': _attributes('TodoDeleted', 'stringValue')},
+    ]}
+
+    assert sut._handle_async_event(event) == {'batchItemFailures': []}
+    sut._serializer.deserialize.assert_not_called()
+    sut._system_bus.dispatch.assert_not_called()
+
+
+def test_handled_events_are_dispatched(sut):
+    _listen(sut, 'todo.TodoCreated')
+    sut._serializer._message_factory = MessageFactory()
+    message = {'_name': 'TodoCreated', '_type': 'event', '_context': 'todo'}
+    event = {'Records': [{'messageId': 'message-0', 'body': json.dumps({
+        'Message': json.dumps(message), 'MessageAttributes': _attributes('TodoCreated', 'Value')
+    })}]}
+
+    sut._handle_async_event(event)
+
+    assert str(sut._system_bus.dispatch.call_args[0][0]) == 'todo.TodoCreated'
+
+
+def test_commands_are_never_filtered(sut):
+    _listen(sut, 'todo.TodoCreated')
+    sut._serializer._message_factory = MessageFactory()
+    message = {'_name': 'CreateTodo', '_type': 'command', '_context': 'todo'}
+    record = {'messageId': 'message-0', 'body': json.dumps(message),
+              'messageAttributes': _attributes('CreateTodo', 'stringValue', type_='command')}
+
+    sut._handle_async_event({'Records': [record]})
+
+    assert str(sut._system_bus.invoke.call_args[0][0]) == 'todo.CreateTodo'
+
+
+def test_unhandled_aggregated_records_are_skipped(sut):
+    _listen(sut, 'todo.TodoCreated')
+    sut._serializer._message_factory = MessageFactory()
+    data = kinesis_aggregation.aggregate([
+        ('todo-1', json.dumps({'_name': 'TodoDeleted', '_type': 'event', '_context': 'todo'}).encode()),
+        ('todo-1', json.dumps({'_name': 'TodoCreated', '_type': 'event', '_context': 'todo'}).encode()),
+    ])
+
+    sut._handle_async_event(_kinesis_event(data))
+
+    assert [str(c[0][0]) for c in sut._system_bus.dispatch.call_args_list] == ['todo.TodoCreated']
+
+
+def test_adaptive_memory_router_forwards_messages_as_received(sut):
+    _listen(sut, 'todo.TodoCreated')
+    sut._serializer = MagicMock()
+    sut._message_factory = MessageFactory()
+    sut._configuration.contexts = {'firefly_aws': {'memory_async': 'adaptive'}}
+    sut._execution_context.context = MagicMock(function_name=sut._lambda_function_name('todo', 'Async'))
+    body = json.dumps({'PAYLOAD_KEY': 'tmp/ab/abc.json.gz', '_name': 'TodoCreated'})
+    event = {'Records': [{'messageId': 'message-0', 'body': json.dumps({
+        'Message': body, 'MessageAttributes': _attributes('TodoCreated', 'Value')
+    })}]}
+
+    sut._handle_async_event(event)
+
+    message = sut._system_bus.dispatch.call_args[0][0]
+    assert str(message) == 'todo.TodoCreated'
+    assert message._raw_body == body
+    assert message.headers['external'] is True
+    sut._serializer.deserialize.assert_not_called()
+    sut._load_payload.assert_not_called()
+
+
+def test_null_message_does_not_abort_batch(sut):
+    response = sut._handle_async_event(_sqs_event(None, {'b': 2}))
+
+    assert response == {'batchItemFailures': []}
+    sut._system_bus.dispatch.assert_called_once()
+
+
+def test_records_are_handled_concurrently(sut):
+    sut._configuration.contexts = {'firefly_aws': {'record_concurrency': 4}}
+    sut._system_bus.dispatch.side_effect = lambda event, data: _fail_on(event, 'b')
+
+    response = sut._handle_async_event(_sqs_event({'a': 1}, {'b': 2}, {'c': 3}, {'d': 4}))
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-1'}]}
+    assert sut._system_bus.dispatch.call_count == 4
+    sut._isolate_kernel_state.assert_called_once()
+
+
+def test_kinesis_records_are_handled_in_order(sut):
+    sut._serializer._message_factory = MessageFactory()
+    sut._configuration.contexts = {'firefly_aws': {'record_concurrency': 4}, 'todo': {}}
+    names = ['TodoCreated', 'TodoUpdated', 'TodoDeleted']
+    records = [_kinesis_event(kinesis_aggregation.aggregate([
+        ('todo-1', json.dumps({'_name': name, '_type': 'event', '_context': 'todo'}).encode())
+    ]))['Records'][0] for name in names]
+
+    sut._handle_async_event({'Records': records})
+
+    assert [str(c[0][0]) for c in sut._system_bus.dispatch.call_args_list] == [f'todo.{n}' for n in names]
+    assert sut._record_pool is None
+
+
+def test_kinesis_records_after_a_failure_are_left_for_the_retry(sut):
+    sut._serializer._message_factory = MessageFactory()
+    sut._system_bus.dispatch.side_effect = [None, RuntimeError('boom'), None, None]
+    records = []
+    for i in range(4):
+        record = _kinesis_event(kinesis_aggregation.aggregate([
+            ('todo-1', json.dumps({'_name': f'Todo{i}', '_type': 'event', '_context': 'todo'}).encode())
+        ]))['Records'][0]
+        record['kinesis']['sequenceNumber'] = str(i)
+        records.append(record)
+
+    response = sut._handle_async_event({'Records': records})
+
+    assert sut._system_bus.dispatch.call_count == 2
+    assert response == {'batchItemFailures': [{'itemIdentifier': str(i)} for i in (1, 2, 3)]}
+
+
+def test_records_are_not_started_past_the_deadline(sut):
+    sut._execution_context.deadline = Deadline(0)
+
+    response = sut._handle_async_event(_sqs_event({'a': 1}, {'b': 2}))
+
+    assert response == {'batchItemFailures': [{'itemIdentifier': 'message-0'}, {'itemIdentifier': 'message-1'}]}
+    sut._system_bus.dispatch.assert_not_called()
+
+
+def test_only_first_invocation_is_a_cold_start(sut):
+    sut._boot_profiler.finish.return_value = None
+    cold_starts = []
+    sut._do_run = lambda event, context: cold_starts.append(sut._execution_context.cold_start)
+
+    sut.run({}, None)
+    sut.run({}, None)
+
+    assert cold_starts == [True, False]
+    sut._boot_profiler.finish.assert_called_once()
+
+
+def test_invocation_is_access_logged(sut):
+    sut._do_run = MagicMock(return_value={'statusCode': 200})
+    sut._boot_profiler.finish.return_value = None
+
+    sut.run({}, MagicMock(aws_request_id='abc'))
+
+    sut._access_log.start.assert_called_once_with(request_id='abc', cold_start=True)
+    sut._access_log.finish.assert_called_once_with({'statusCode': 200})
+
+
+def test_outbox_is_flushed_when_the_invocation_fails(sut):
+    sut._do_run = MagicMock(side_effect=RuntimeError('boom'))
+    sut._boot_profiler.finish.return_value = None
+    sut._outbox.flush.side_effect = ff.MessageBusError('unreachable')
+
+    with pytest.raises(RuntimeError):
+        sut.run({}, MagicMock())
+
+    sut._outbox.flush.assert_called_once()
+
+
+def test_warmer_returns_before_touching_the_kernel(sut):
+    sut._kernel = MagicMock()
+
+    assert sut._do_run({'firefly_warmer': True}, MagicMock()) == {'warmed': True}
+
+    sut._warm_up.assert_called_once()
+    sut._kernel.reset.assert_not_called()
+
+
+def test_parse_route():
+    assert LambdaExecutor._parse_route('/api/v2/todo/todos') == ('/todo/todos', '2')
+    assert LambdaExecutor._parse_route('/api/todo/todos') == ('/todo/todos', '1')
+    assert LambdaExecutor._parse_route('/todo/todos') == ('/todo/todos', '1')
+
+
+@pytest.mark.parametrize('data', [
+    [{'a': 1}, {'b': [1, 2]}],
+    {'data': [1, 2, 3], 'total': 3, 'nested': {'x': None}},
+    {1: 'non-string key'},
+    [],
+    'string',
+    None,
+])
+def test_streamed_serialization_matches_codec(sut, data):
+    assert b''.join(sut._iter_serialized(data)) == sut._json_codec.encode(data)
+
+
+def test_sync_response_is_plain_json(sut):
+    sut._store_large_payloads_in_s3.side_effect = lambda payload, **kwargs: payload
+
+    response = sut._to_lambda_response({'at': datetime(2020, 1, 1)}, MagicMock(), 'query')
+
+    assert response == {'at': '2020-01-01T00:00:00'}
+
+
+def test_http_response_spills_to_s3(sut):
+    sut._s3_service.spool_download.return_value = (None, 'https://bucket.s3.amazonaws.com/tmp/abc')
+    sut._context = 'todo'
+    sut._configuration.contexts = {'firefly_aws': {}, 'todo': {}}
+
+    response = sut._handle_http_response([1, 2, 3])
+
+    assert response['statusCode'] == 303
+    assert response['headers']['Location'] == 'https://bucket.s3.amazonaws.com/tmp/abc'
+
+
+def test_http_response_is_compressed(sut):
+    sut._s3_service.spool_download.side_effect = lambda chunks, **kwargs: (b''.join(chunks), None)
+    sut._response_compressor = ResponseCompressor()
+    sut._kernel.http_request = {'headers': {'Accept-Encoding': 'gzip, deflate;q=0.5'}}
+    sut._context = 'todo'
+    sut._configuration.contexts = {'firefly_aws': {}, 'todo': {'compression_min_size': 10}}
+    data = [{'id': i} for i in range(100)]
+
+    response = sut._handle_http_response(data)
+
+    assert response['isBase64Encoded'] is True
+    assert response['headers']['Content-Encoding'] == 'gzip'
+    assert response['headers']['Vary'] == 'Accept-Encoding'
+    assert json.loads(gzip.decompress(base64.b64decode(response['body']))) == data
+
+
+def test_small_http_response_is_not_compressed(sut):
+    sut._s3_service.spool_download.side_effect = lambda chunks, **kwargs: (b''.join(chunks), None)
+    sut._response_compressor = ResponseCompressor()
+    sut._kernel.http_request = {'headers': {'accept-encoding': 'gzip'}}
+    sut._context = 'todo'
+    sut._configuration.contexts = {'firefly_aws': {}, 'todo': {}}
+
+    response = sut._handle_http_response({'id': 1})
+
+    assert response['isBase64Encoded'] is False
+    assert 'Content-Encoding' not in response['headers']
+    assert json.loads(response['body']) == {'id': 1}
+
+
+def test_file_response_is_returned_as_binary(sut):
+    _http_request(sut)
+
+    response = sut._handle_http_response(ff.File(name='a.png', content=b'\x89PNG', content_type='image/png'))
+
+    assert response['statusCode'] == 200
+    assert response['isBase64Encoded'] is True
+    assert base64.b64decode(response['body']) == b'\x89PNG'
+    assert response['headers']['Content-Type'] == 'image/png'
+
+
+@pytest.mark.parametrize('header,status,content_range,body', [
+    ('bytes=2-4', 206, 'bytes 2-4/10', b'234'),
+    ('bytes=7-', 206, 'bytes 7-9/10', b'789'),
+    ('bytes=-2', 206, 'bytes 8-9/10', b'89'),
+    ('bytes=5-100', 206, 'bytes 5-9/10', b'56789'),
+    ('bytes=0-1,4-5', 200, None, b'0123456789'),
+    ('bytes=10-', 416, 'bytes */10', b''),
+])
+def test_binary_range_requests(sut, header, status, content_range, body):
+    _http_request(sut, Range=header)
+
+    response = sut._handle_http_response(b'0123456789')
+
+    assert response['statusCode'] == status
+    assert response['headers'].get('Content-Range') == content_range
+    assert base64.b64decode(response['body']) == body
+
+
+def test_large_binary_response_redirects_to_s3(sut):
+    _http_request(sut)
+    sut._s3_service.spool_download.return_value = (None, 'https://bucket.s3.amazonaws.com/tmp/abc')
+
+    response = sut._handle_http_response(ff.File(name='a.pdf', content=io.BytesIO(b'x' * 4_500_001)))
+
+    assert response['statusCode'] == 303
+    assert response['headers']['Location'] == 'https://bucket.s3.amazonaws.com/tmp/abc'
+    assert response['body'] == ''
+    assert sut._s3_service.spool_download.call_args[1]['content_type'] == 'application/octet-stream'
+
+
+def test_get_response_has_etag(sut):
+    _json_request(sut)
+
+    first = sut._handle_http_response([{'id': 1}], conditional=True)
+    second = sut._handle_http_response([{'id': 1}], conditional=True)
+    changed = sut._handle_http_response([{'id': 2}], conditional=True)
+
+    assert first['headers']['ETag'].startswith('"')
+    assert first['headers']['ETag'] == second['headers']['ETag']
+    assert first['headers']['ETag'] != changed['headers']['ETag']
+
+
+@pytest.mark.parametrize('if_none_match,status', [
+    (None, 200),
+    ('"abc"', 200),
+    ('"abc", {etag}', 304),
+    ('W/{etag}', 304),
+    ('*', 304),
+])
+def test_if_none_match(sut, if_none_match, status):
+    _json_request(sut)
+    etag = sut._handle_http_response({'id': 1}, conditional=True)['headers']['ETag']
+    if if_none_match is not None:
+        _json_request(sut, **{'If-None-Match': if_none_match.format(etag=etag)})
+
+    response = sut._handle_http_response({'id': 1}, conditional=True)
+
+    assert response['statusCode'] == status
+    assert response['headers']['ETag'] == etag
+    if status == 304:
+        assert response['body'] == ''
+
+
+def test_compressed_etag_matches_on_revalidation(sut):
+    _json_request(sut, **{'Accept-Encoding': 'gzip'})
+    sut._configuration.contexts['todo']['compression_min_size'] = 10
+    data = [{'id': i} for i in range(100)]
+    etag = sut._handle_http_response(data, conditional=True)['headers']['ETag']
+    _json_request(sut, **{'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    sut._configuration.contexts['todo']['compression_min_size'] = 10
+
+    response = sut._handle_http_response(data, conditional=True)
+
+    assert etag.endswith('-gzip"')
+    assert response['statusCode'] == 304
+
+
+def test_envelope_version_skips_serialization(sut):
+    _json_request(sut, **{'If-None-Match': '"v3"'})
+
+    envelope = ff.Envelope.wrap({'id': 1})
+    envelope.headers['version'] = 3
+
+    response = sut._handle_http_response(envelope, conditional=True)
+
+    assert response['statusCode'] == 304
+    assert response['headers']['ETag'] == '"v3"'
+    sut._s3_service.spool_download.assert_not_called()
+
+
+@pytest.mark.parametrize('if_modified_since,status', [
+    ('Wed, 01 Jan 2020 12:00:00 GMT', 304),
+    ('Wed, 01 Jan 2020 13:00:00 GMT', 304),
+    ('Wed, 01 Jan 2020 11:59:59 GMT', 200),
+    ('not a date', 200),
+])
+def test_if_modified_since(sut, if_modified_since, status):
+    _json_request(sut, **{'If-Modified-Since': if_modified_since})
+    envelope = ff.Envelope.wrap({'id': 1})
+    envelope.headers['last_modified'] = datetime(2020, 1, 1, 12, 0, 0, 500)
+
+    response = sut._handle_http_response(envelope, conditional=True)
+
+    assert response['statusCode'] == status
+    assert response['headers']['Last-Modified'] == 'Wed, 01 Jan 2020 12:00:00 GMT'
+
+
+def test_non_get_responses_are_not_conditional(sut):
+    _json_request(sut, **{'If-None-Match': '*'})
+
+    response = sut._handle_http_response({'id': 1})
+
+    assert response['statusCode'] == 200
+    assert 'ETag' not in response['headers']
+
+
+def _json_request(sut, **headers):
+    _http_request(sut, **headers)
+    sut._response_compressor = ResponseCompressor()
+    sut._s3_service.spool_download.side_effect = lambda chunks, **kwargs: (b''.join(chunks), None)
+
+
+def _http_request(sut, **headers):
+    sut._kernel.http_request = {'headers': headers}
+    sut._context = 'todo'
+    sut._configuration.contexts = {'firefly_aws': {}, 'todo': {}}
+
+
+def _fail_on(message: dict, key: str):
+    if key in message:
+        raise RuntimeError('boom')
+
+
+def _sqs_event(*messages):
+    return {
+        'Records': [{
+            'messageId': f'message-{i}',
+            'eventSource': 'aws:sqs',
+            'body': json.dumps({'Message': json.dumps(message)}),
+        } for i, message in enumerate(messages)]
+    }
+
+
+def _listen(sut, *event_names):
+    sut._context = 'todo'
+    sut._context_map = MagicMock(contexts=[SimpleNamespace(name='todo', event_listeners={'Listener': event_names})])
+
+
+def _attributes(name: str, key: str, type_: str = 'event'):
+    return {k: {key: v, 'DataType' if key == 'Value' else 'dataType': 'String'}
+            for k, v in {'_name': name, '_type': type_, '_context': 'todo'}.items()}
+
+
+def _kinesis_event(data: bytes):
+    return {
+        'Records': [{
+            'eventSource': 'aws:kinesis',
+            'kinesis': {
+                'partitionKey': 'todo-1',
+                'sequenceNumber': SEQUENCE_NUMBER,
+                'data': base64.b64encode(data).decode(),
+            },
+        }]
+    }
 
 
 @pytest.fixture()
 def sut():
     ret = Container().mock(LambdaExecutor)
     ret._serializer = ff_infra.JsonSerializer()
+    ret._json_codec = StdlibJsonCodec()
+    ret._system_bus = MagicMock()
+    ret._access_log = MagicMock()
+    ret._s3_service = MagicMock()
+    ret._outbox = MagicMock()
+    ret._load_payload = MagicMock(is_reference=LoadPayload.is_reference)
+    ret._execution_context = ExecutionContext()
+    ret._context_map = MagicMock(contexts=[])
 
     return ret
@@ -0,0 +1,66 @@
+import base64
+import io
+from unittest.mock import MagicMock
+
+import pytest
+from firefly_aws.domain import Base64Reader, ParseMultipart
+
+
+@pytest.mark.parametrize('read_size', [1, 2, 5, 64, 1000])
+def test_base64_reader(read_size):
+    data = bytes(range(256)) * 3
+    reader = Base64Reader(base64.b64encode(data).decode('ascii'))
+
+    chunks = iter(lambda: reader.read(read_size), b'')
+
+    assert b''.join(chunks) == data
+
+
+def test_fields_and_files(sut):
+    small = b'small file'
+    large = bytes(range(256)) * 20
+
+    ret = sut(HEADER, _encode({'title': 'Hello'}, {'small': small, 'large': large}))
+
+    assert ret['title'] == 'Hello'
+    assert ret['small'].name == 'small.bin'
+    assert ret['small'].content_type == 'application/octet-stream'
+    assert bytes(ret['small'].content.getbuffer()) == small
+    assert ret['small'].content.read() == small
+    assert ret['large'].content.getbuffer() is None
+    assert len(ret['large'].content) == len(large)
+    assert ret['large'].content.read() == large
+
+
+def test_unencoded_body(sut):
+    body = base64.b64decode(_encode({'title': 'Hello'}, {}))
+
+    assert sut(HEADER, body.decode('utf-8'), is_base64_encoded=False) == {'title': 'Hello'}
+
+
+HEADER = 'multipart/form-data; boundary=xyz'
+
+
+def _encode(fields: dict, files: dict):
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--xyz\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode('utf-8'))
+    for name, content in files.items():
+        body.write(
+            f'--xyz\r\nContent-Disposition: form-data; name="{name}"; filename="{name}.bin"\r\n'
+            f'Content-Type: application/octet-stream\r\n\r\n'.encode('utf-8')
+        )
+        body.write(content + b'\r\n')
+    body.write(b'--xyz--\r\n')
+
+    return base64.b64encode(body.getvalue()).decode('ascii')
+
+
+@pytest.fixture()
+def sut():
+    ret = ParseMultipart()
+    ret._configuration = MagicMock()
+    ret._configuration.contexts = {'firefly_aws': {'multipart_memory_limit': 1024}}
+    ret._logger = MagicMock()
+
+    return ret
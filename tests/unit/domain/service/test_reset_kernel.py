@@ -0,0 +1,83 @@
+from unittest.mock import MagicMock
+
+import firefly as ff
+import pytest
+from firefly_aws.domain import ResetKernel
+
+
+class Repository:
+    def __init__(self):
+        self.reset = MagicMock(side_effect=self._reset)
+        self._reset()
+
+    def _reset(self):
+        self._entities = []
+        self._deletions = []
+        self._entity_hashes = {}
+
+
+def test_incremental_reset_only_touches_dirty_state(sut):
+    sut._mode = 'incremental'
+    clean, dirty = sut._registry._cache.values()
+    dirty._entities.append(object())
+    sut._kernel.user = ff.User()
+
+    sut()
+
+    assert sut._kernel.user is None
+    dirty.reset.assert_called_once()
+    clean.reset.assert_not_called()
+
+
+def test_full_reset_touches_everything(sut):
+    sut._mode = 'full'
+
+    sut()
+
+    for repository in sut._registry._cache.values():
+        repository.reset.assert_called_once()
+
+
+def test_debug_mode_detects_leaks(sut):
+    sut._mode = 'debug'
+    sut._kernel.reset = MagicMock(side_effect=lambda: setattr(sut._kernel, 'tenant', None))
+    sut._kernel.tenant = 'acme'
+
+    with pytest.raises(ff.FrameworkError):
+        sut()
+
+
+def test_debug_mode_passes_when_clean(sut):
+    sut._mode = 'debug'
+    sut._kernel.http_request = {'headers': {}}
+
+    sut()
+
+    assert sut._kernel.http_request is None
+
+
+def test_full_is_the_default():
+    assert _build({})._mode == 'full'
+
+
+def test_invalid_mode():
+    with pytest.raises(ff.ConfigurationError):
+        _build({'kernel_reset': 'sometimes'})
+
+
+def _build(config: dict):
+    ResetKernel._configuration = MagicMock(contexts={'firefly_aws': config})
+    try:
+        return ResetKernel()
+    finally:
+        ResetKernel._configuration = None
+
+
+@pytest.fixture()
+def sut():
+    ret = _build({})
+    ret._kernel = ff.Kernel()
+    ret._registry = MagicMock()
+    ret._registry._cache = {'a': Repository(), 'b': Repository()}
+
+    return ret
@@ -0,0 +1,145 @@
+from unittest.mock import MagicMock
+from datetime import date
+
+import firefly as ff
+import firefly.infrastructure as ffi
+import pytest
+from firefly.domain.service.messaging.message_factory import MessageFactory
+from firefly_aws.application import ResponseCachingMiddleware
+from firefly_aws.domain import ResponseCache
+from firefly_aws.infrastructure import StdlibJsonCodec
+
+POLICIES = {
+    'todo.GetTodos': {'ttl': 60, 'vary_by': ['params', 'tenant'], 'invalidated_by': ['todo.TodoUpdated']},
+}
+
+
+def test_second_request_is_served_from_memory(sut, handler):
+    sut(_query(page=1), handler)
+    response = sut(_query(page=1), handler)
+
+    assert response == [{'id': 1}]
+    handler.assert_called_once()
+
+
+def test_responses_vary_by_declared_values(sut, handler):
+    sut(_query(page=1), handler)
+    sut(_query(page=2), handler)
+    sut._response_cache._kernel.user.tenant = 'other'
+    sut(_query(page=1), handler)
+
+    assert handler.call_count == 3
+
+
+def test_other_containers_read_the_shared_cache(sut, handler, shared):
+    sut(_query(page=1), handler)
+    other = _build(shared)
+
+    response = other(_query(page=1), handler)
+
+    assert response == [{'id': 1}]
+    handler.assert_called_once()
+
+
+def test_events_invalidate_across_containers(sut, shared):
+    handler = MagicMock(side_effect=[['old'], ['new']])
+    other = _build(shared)
+    sut(_query(page=1), handler)
+
+    other(MessageFactory().event('todo.TodoUpdated', {'id': 1}), lambda m: None)
+    sut._response_cache._generations.clear()
+
+    assert other(_query(page=1), handler) == ['new']
+    assert sut(_query(page=1), handler) == ['new']
+    assert handler.call_count == 2
+
+
+def test_results_invalidated_while_running_are_not_cached(sut, shared):
+    def handler(message):
+        sut(MessageFactory().event('todo.TodoUpdated', {'id': 1}), lambda m: None)
+        return ['stale']
+    sut(_query(page=1), handler)
+
+    assert sut(_query(page=1), MagicMock(return_value=['fresh'])) == ['fresh']
+
+
+def test_responses_that_do_not_round_trip_are_not_cached(sut):
+    handler = MagicMock(return_value={'due': date(2020, 1, 1)})
+
+    sut(_query(page=1), handler)
+
+    assert sut(_query(page=1), handler) == {'due': date(2020, 1, 1)}
+    assert handler.call_count == 2
+
+
+def test_undeclared_queries_are_not_cached(sut, handler):
+    sut(MessageFactory().query('todo.GetUsers'), handler)
+    sut(MessageFactory().query('todo.GetUsers'), handler)
+
+    assert handler.call_count == 2
+
+
+def test_envelopes_are_not_cached(sut):
+    handler = MagicMock(side_effect=lambda m: ff.Envelope.wrap([{'id': 1}]))
+
+    sut(_query(page=1), handler)
+    sut(_query(page=1), handler)
+
+    assert handler.call_count == 2
+
+
+def test_shared_cache_failures_fall_back_to_the_handler(sut, handler, shared):
+    sut._response_cache._cache.get.side_effect = RuntimeError('throttled')
+
+    assert sut(_query(page=1), handler) == [{'id': 1}]
+
+
+def test_unknown_vary_by_is_rejected(shared):
+    with pytest.raises(ff.ConfigurationError):
+        _build(shared, {'todo.GetTodos': {'vary_by': ['ip']}})(_query(page=1), MagicMock())
+
+
+def _query(**data):
+    return MessageFactory().query('todo.GetTodos', data=data)
+
+
+def _build(shared: dict, policies: dict = None):
+    configuration = MagicMock(contexts={
+        'firefly_aws': {},
+        'todo': {'response_cache': policies or POLICIES},
+    })
+    ResponseCache._configuration = configuration
+    try:
+        cache = ResponseCache()
+    finally:
+        ResponseCache._configuration = None
+    cache._configuration = configuration
+    cache._cache = MagicMock()
+    cache._cache.get.side_effect = shared.get
+    cache._cache.set.side_effect = lambda key, value, **kwargs: shared.update({key: value})
+    cache._kernel = MagicMock(user=ff.User(id='abc', tenant='acme'))
+    cache._json_codec = StdlibJsonCodec()
+    cache._serializer = ffi.JsonSerializer()
+    cache._serializer._message_factory = MessageFactory()
+    cache._logger = MagicMock()
+
+    ret = ResponseCachingMiddleware()
+    ret._response_cache = cache
+    ret._logger = MagicMock()
+
+    return ret
+
+
+@pytest.fixture()
+def handler():
+    return MagicMock(return_value=[{'id': 1}])
+
+
+@pytest.fixture()
+def shared():
+    return {}
+
+
+@pytest.fixture()
+def sut(shared):
+    return _build(shared)
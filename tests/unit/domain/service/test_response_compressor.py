@@ -0,0 +1,38 @@
+import gzip
+import zlib
+
+import pytest
+from firefly_aws.domain import ResponseCompressor
+
+
+@pytest.mark.parametrize('header,expected', [
+    (None, None),
+    ('', None),
+    ('identity', None),
+    ('gzip', 'gzip'),
+    ('deflate, gzip', 'gzip'),
+    ('gzip;q=0.5, deflate', 'deflate'),
+    ('gzip;q=0, *', 'deflate'),
+    ('GZIP', 'gzip'),
+])
+def test_negotiate(sut, header, expected):
+    sut.available_encodings = lambda: ('gzip', 'deflate')
+
+    assert sut.negotiate(header) == expected
+
+
+def test_gzip(sut):
+    compressed = b''.join(sut.compress(iter(['{"a": ', b'1}']), 'gzip'))
+
+    assert gzip.decompress(compressed) == b'{"a": 1}'
+
+
+def test_deflate(sut):
+    compressed = b''.join(sut.compress(iter(['{"a": 1}']), 'deflate'))
+
+    assert zlib.decompress(compressed) == b'{"a": 1}'
+
+
+@pytest.fixture()
+def sut():
+    return ResponseCompressor()
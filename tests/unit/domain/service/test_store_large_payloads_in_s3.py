@@ -0,0 +1,238 @@
+import json
+from datetime import datetime, timedelta, timezone
+from time import perf_counter, sleep
+from unittest.mock import MagicMock
+
+import firefly as ff
+import firefly.infrastructure as ffi
+import pytest
+from firefly.domain.service.messaging.message_factory import MessageFactory
+from firefly_aws.domain import LoadPayload, StoreLargePayloadsInS3
+from firefly_aws.infrastructure import StdlibJsonCodec
+
+SMALL = {'_name': 'TodoCreated', '_type': 'event', '_context': 'todo', 'name': 'x'}
+
+
+def test_small_payloads_are_sent_as_is(store, s3):
+    assert json.loads(store(json.dumps(SMALL), **_envelope())) == SMALL
+    assert s3 == {}
+
+
+def test_compressible_payloads_are_inlined(store, load, s3):
+    message = _message(5_000)
+
+    envelope = json.loads(store(json.dumps(message), **_envelope()))
+
+    assert envelope['PAYLOAD_CODEC'] == 'gzip'
+    assert s3 == {}
+    assert LoadPayload.is_reference(envelope)
+    assert load(envelope).to_dict()['items'] == message['items']
+
+
+def test_payloads_too_large_to_inline_are_stored_compressed(store, load, s3):
+    store._configuration.contexts['firefly_aws']['max_inline_payload_size'] = 1_000
+    message = _message(5_000)
+
+    envelope = json.loads(store(json.dumps(message), **_envelope()))
+
+    assert envelope['PAYLOAD_KEY'].endswith('.json.gz')
+    assert len(s3[envelope['PAYLOAD_KEY']]) < len(json.dumps(message))
+    assert load(envelope).to_dict()['items'] == message['items']
+
+
+def test_compression_can_be_disabled(store, load, s3):
+    store._configuration.contexts['firefly_aws']['payload_codec'] = 'none'
+    message = _message(5_000)
+
+    envelope = json.loads(store(json.dumps(message), **_envelope()))
+
+    assert envelope['PAYLOAD_KEY'].endswith('.json')
+    assert load(envelope['PAYLOAD_KEY']).to_dict()['items'] == message['items']
+
+
+def test_unavailable_codecs_are_rejected(store):
+    store._configuration.contexts['firefly_aws']['payload_codec'] = 'lz4'
+
+    with pytest.raises(ff.ConfigurationError):
+        store(json.dumps(_message(5_000)), **_envelope())
+
+
+def test_stored_payloads_are_content_addressed_and_sharded(store, s3_client):
+    store._configuration.contexts['firefly_aws']['max_inline_payload_size'] = 1_000
+    payload = json.dumps(_message(5_000))
+
+    first = json.loads(store(payload, **_envelope()))
+    second = json.loads(store(payload, **_envelope()))
+
+    digest = first['PAYLOAD_KEY'].rsplit('/', 1)[-1].split('.')[0]
+    assert first['PAYLOAD_KEY'] == f'tmp/{digest[:2]}/{digest}.json.gz'
+    assert second['PAYLOAD_KEY'] == first['PAYLOAD_KEY']
+    s3_client.put_object.assert_called_once()
+    s3_client.head_object.assert_not_called()
+
+
+def test_keys_evicted_from_the_lru_are_checked_with_head(store, s3_client):
+    store._configuration.contexts['firefly_aws'].update(max_inline_payload_size=1_000, payload_index_size=1)
+    first, second = json.dumps(_message(5_000)), json.dumps(_message(5_001))
+    store(first, **_envelope())
+    store(second, **_envelope())
+
+    store(first, **_envelope())
+
+    s3_client.head_object.assert_called_once()
+    assert s3_client.put_object.call_count == 2
+
+
+def test_shared_dedupe_finds_objects_written_by_other_containers(store, s3_client):
+    store._configuration.contexts['firefly_aws'].update(max_inline_payload_size=1_000, payload_dedupe='shared')
+    payload = json.dumps(_message(5_000))
+    store(payload, **_envelope())
+    store._index = None
+
+    store(payload, **_envelope())
+
+    # One HEAD finding nothing before the first upload, one finding the object.
+    assert s3_client.head_object.call_count == 2
+    s3_client.put_object.assert_called_once()
+
+
+def test_objects_close_to_expiring_are_uploaded_again(store, s3_client, s3):
+    store._configuration.contexts['firefly_aws'].update(max_inline_payload_size=1_000, payload_dedupe='shared')
+    payload = json.dumps(_message(5_000))
+    store(payload, **_envelope())
+    store._index = None
+    s3_client.head_object.side_effect = lambda Bucket, Key: {
+        'LastModified': datetime.now(timezone.utc) - timedelta(hours=20),
+    }
+
+    store(payload, **_envelope())
+
+    assert s3_client.put_object.call_count == 2
+
+
+def test_released_payloads_are_deleted_and_stored_again_when_needed(store, load, s3_client, s3):
+    store._configuration.contexts['firefly_aws'].update(max_inline_payload_size=1_000, payload_early_delete=True)
+    payload = json.dumps(_message(5_000))
+
+    envelope = json.loads(store(payload, consumers=1, **_envelope()))
+    load(envelope)
+    load.release(envelope)
+
+    assert s3 == {}
+    envelope = json.loads(store(payload, consumers=1, **_envelope()))
+    assert load(envelope).to_dict()['items'] == _message(5_000)['items']
+    assert s3_client.put_object.call_count == 2
+
+
+def test_released_payloads_do_not_take_other_uploads_with_them(store, load, s3):
+    store._configuration.contexts['firefly_aws'].update(max_inline_payload_size=1_000, payload_early_delete=True)
+    payload = json.dumps(_message(5_000))
+
+    first = json.loads(store(payload, consumers=1, **_envelope()))
+    second = json.loads(store(payload, consumers=1, **_envelope()))
+    load.release(first)
+
+    assert first['PAYLOAD_KEY'] != second['PAYLOAD_KEY']
+    assert list(s3) == [second['PAYLOAD_KEY']]
+    assert load(second).to_dict()['items'] == _message(5_000)['items']
+
+
+def test_payloads_with_unknown_consumers_are_not_released(store, load, s3):
+    store._configuration.contexts['firefly_aws'].update(max_inline_payload_size=1_000, payload_early_delete=True)
+
+    envelope = json.loads(store(json.dumps(_message(5_000)), **_envelope()))
+    load.release(envelope)
+
+    assert 'PAYLOAD_RELEASE' not in envelope
+    assert list(s3) == [envelope['PAYLOAD_KEY']]
+
+
+def test_prefetched_payloads_load_concurrently(store, load, s3_client):
+    store._configuration.contexts['firefly_aws']['max_inline_payload_size'] = 1_000
+    envelopes = {i: json.loads(store(json.dumps(_message(5_000 + i)), **_envelope())) for i in range(4)}
+    get_object = s3_client.get_object.side_effect
+    s3_client.get_object.side_effect = lambda **kwargs: sleep(.05) or get_object(**kwargs)
+
+    start = perf_counter()
+    with load.prefetch(envelopes) as prefetched:
+        loaded = [prefetched.take(i) for i in range(4)]
+
+    assert perf_counter() - start < .15
+    assert [len(m.to_dict()['items']) for m in loaded] == [5_000, 5_001, 5_002, 5_003]
+
+
+def test_prefetching_stops_at_the_memory_cap(store, load, s3_client):
+    store._configuration.contexts['firefly_aws']['max_inline_payload_size'] = 1_000
+    envelopes = {i: json.loads(store(json.dumps(_message(5_000 + i)), **_envelope())) for i in range(4)}
+    load._configuration = MagicMock(contexts={'firefly_aws': {'payload_prefetch_max_bytes': 1}})
+
+    with load.prefetch(envelopes) as prefetched:
+        sleep(.05)
+        # Only the first payload is admitted while nothing has been taken.
+        assert s3_client.get_object.call_count == 1
+        for i in range(4):
+            prefetched.take(i)
+            prefetched.done(i)
+
+        assert s3_client.get_object.call_count == 4
+        assert prefetched.used == 0
+
+
+def _message(items: int):
+    return dict(SMALL, items=[{'id': i, 'name': f'todo {i}', 'done': i % 2 == 0} for i in range(items)])
+
+
+def _raise(e: Exception):
+    raise e
+
+
+def _envelope():
+    return {'name': 'TodoCreated', 'context': 'todo', 'type_': 'event', 'id_': 'abc'}
+
+
+@pytest.fixture()
+def s3():
+    return {}
+
+
+@pytest.fixture()
+def s3_client(s3):
+    ret = MagicMock()
+    ret.put_object.side_effect = lambda Body, Bucket, Key: s3.update({Key: Body})
+    ret.get_object.side_effect = lambda Bucket, Key: {'Body': MagicMock(read=lambda: s3[Key])}
+    ret.head_object.side_effect = lambda Bucket, Key: {'LastModified': datetime.now(timezone.utc)} \
+        if Key in s3 else _raise(KeyError(Key))
+    ret.delete_object.side_effect = lambda Bucket, Key: s3.pop(Key)
+    return ret
+
+
+@pytest.fixture()
+def cache():
+    counters = {}
+
+    def increment(key, amount=1, **kwargs):
+        counters[key] = counters.get(key, 0) + amount
+        return counters[key]
+
+    return MagicMock(increment=increment, decrement=lambda key, amount=1: increment(key, -amount))
+
+
+@pytest.fixture()
+def store(s3_client, cache):
+    ret = StoreLargePayloadsInS3()
+    ret._s3_client = s3_client
+    ret._cache = cache
+    ret._json_codec = StdlibJsonCodec()
+    ret._configuration = MagicMock(contexts={'firefly_aws': {}})
+    return ret
+
+
+@pytest.fixture()
+def load(s3_client, cache):
+    ret = LoadPayload()
+    ret._s3_client = s3_client
+    ret._cache = cache
+    ret._json_codec = StdlibJsonCodec()
+    ret._serializer = ffi.JsonSerializer()
+    ret._serializer._message_factory = MessageFactory()
+    return ret
@@ -0,0 +1,34 @@
+from unittest.mock import MagicMock
+
+import pytest
+from firefly_aws.domain import WarmUp
+
+
+def test_configured_services_are_warmed(sut):
+    sut._container.jwt_decoder = MagicMock()
+    sut._container.s3_client = object()
+
+    sut()
+
+    sut._container.jwt_decoder.warm_up.assert_called_once()
+
+
+def test_failures_do_not_break_the_warmer(sut):
+    sut._container.jwt_decoder = MagicMock()
+    sut._container.jwt_decoder.warm_up.side_effect = RuntimeError('no network')
+    del sut._container.s3_client
+
+    sut()
+
+    assert sut._logger.warning.call_count == 2
+
+
+@pytest.fixture()
+def sut():
+    ret = WarmUp()
+    ret._container = MagicMock()
+    ret._configuration = MagicMock()
+    ret._configuration.contexts = {'firefly_aws': {'warm': ['jwt_decoder', 's3_client']}}
+    ret._logger = MagicMock()
+
+    return ret
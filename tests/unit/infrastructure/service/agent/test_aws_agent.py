@@ -0,0 +1,121 @@
+import json
+from unittest.mock import MagicMock
+
+import pytest
+from troposphere import Template
+from troposphere.awslambda import Function, Code
+from troposphere.sqs import Queue
+from firefly_aws.infrastructure import AwsAgent
+
+
+def test_no_warmer_or_provisioned_concurrency_by_default(sut, template, context):
+    assert sut._add_provisioned_concurrency(template, context, MagicMock()) is None
+    sut._add_warmer(template, context, MagicMock())
+
+    assert template.resources == {}
+
+
+def test_warmer_rule(sut, template, context):
+    context.config['extensions']['firefly_aws'] = {'warmer': {'schedule': 'rate(10 minutes)'}}
+
+    sut._add_warmer(template, context, _function(template))
+
+    resources = _resources(template)
+    rule = resources['ProjectDevTodoFunctionWarmerRule']['Properties']
+    assert rule['ScheduleExpression'] == 'rate(10 minutes)'
+    assert json.loads(rule['Targets'][0]['Input']) == {'firefly_warmer': True}
+    assert resources['ProjectDevTodoFunctionWarmerPermission']['Properties']['Principal'] == 'events.amazonaws.com'
+
+
+def test_provisioned_concurrency_with_auto_scaling(sut, template, context):
+    context.config['extensions']['firefly_aws'] = {'provisioned_concurrency': {'min': 2, 'max': 10}}
+
+    alias = sut._add_provisioned_concurrency(template, context, _function(template))
+
+    resources = _resources(template)
+    assert alias.Name == 'live'
+    assert alias.ProvisionedConcurrencyConfig.ProvisionedConcurrentExecutions == 2
+    assert resources['ProjectDevTodoFunctionSyncScalableTarget']['Properties']['MaxCapacity'] == 10
+    assert any(name.startswith('ProjectDevTodoFunctionSyncVersion') for name in resources)
+
+
+def test_version_only_changes_with_the_function(sut, context):
+    sut._aws_config['provisioned_concurrency'] = 1
+
+    def version(code):
+        template = Template()
+        function = template.add_resource(Function('Sync', Code=Code(ZipFile=code), Handler='h', Role='r'))
+        sut._add_provisioned_concurrency(template, context, function)
+        return [name for name in _resources(template) if name.startswith('ProjectDevTodoFunctionSyncVersion')]
+
+    assert version('x') == version('x')
+    assert version('x') != version('y')
+
+
+def test_fixed_provisioned_concurrency(sut, template, context):
+    sut._aws_config['provisioned_concurrency'] = 3
+
+    alias = sut._add_provisioned_concurrency(template, context, _function(template))
+
+    assert alias.ProvisionedConcurrencyConfig.ProvisionedConcurrentExecutions == 3
+    assert 'ProjectDevTodoFunctionSyncScalableTarget' not in template.resources
+
+
+def test_no_event_stream_by_default(sut, template, context):
+    assert sut._add_event_stream(template, context) is None
+
+
+def test_event_stream_and_mappings(sut, template, context):
+    sut._aws_config.update({'kinesis_events': ['todo.TodoCreated'], 'kinesis_shards': 2})
+    sut._context_map = MagicMock(contexts=['todo', 'billing'])
+    dlq = template.add_resource(Queue('Dlq'))
+
+    stream = sut._add_event_stream(template, context)
+    sut._add_event_stream_mapping(template, context, 'todo', _function(template), dlq, stream)
+    context.name = 'billing'
+    sut._add_event_stream_mapping(template, context, 'todo', _function(template, 'BillingAsync'), dlq)
+
+    resources = _resources(template)
+    stream = resources['ProjectDevTodoEventStream']['Properties']
+    assert stream == {'Name': 'ProjectDevTodoEventStream', 'ShardCount': 2}
+    mapping = resources['ProjectDevBillingTodoEventStreamMapping']
+    assert mapping['Properties']['EventSourceArn'] == \
+        'arn:aws:kinesis:us-east-1:123456789012:stream/ProjectDevTodoEventStream'
+    assert mapping['Properties']['FunctionName'] == 'ProjectDevBillingAsync'
+    assert mapping['Properties']['StartingPosition'] == 'LATEST'
+    assert 'ProjectDevTodoEventStream' not in mapping['DependsOn']
+    assert 'ProjectDevTodoEventStream' in resources['ProjectDevTodoTodoEventStreamMapping']['DependsOn']
+
+
+def _function(template, title='Sync'):
+    return template.add_resource(Function(title, Code=Code(ZipFile='x'), Handler='h', Role='r', Runtime='python3.7'))
+
+
+def _resources(template):
+    return json.loads(template.to_json())['Resources']
+
+
+@pytest.fixture()
+def sut():
+    ret = AwsAgent.__new__(AwsAgent)
+    ret._aws_config = {}
+    ret._project = 'project'
+    ret._ff_environment = 'dev'
+    ret._region = 'us-east-1'
+    ret._account_id = '123456789012'
+
+    return ret
+
+
+@pytest.fixture()
+def template():
+    return Template()
+
+
+@pytest.fixture()
+def context():
+    ret = MagicMock()
+    ret.name = 'todo'
+    ret.config = {'extensions': {}}
+
+    return ret
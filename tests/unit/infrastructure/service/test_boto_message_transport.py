@@ -0,0 +1,102 @@
+from unittest.mock import MagicMock
+
+import firefly as ff
+import pytest
+from firefly.domain.service.messaging.message_factory import MessageFactory
+from firefly_aws.domain import CircuitOpen, ExecutionContext
+from firefly_aws.infrastructure import BotoMessageTransport
+
+
+def test_queue_urls_are_resolved_once(sut):
+    for _ in range(3):
+        sut.invoke(_async_command())
+
+    sut._sqs_client.get_queue_url.assert_called_once_with(QueueName='TodoAppDevTodoQueue')
+    assert [c[0][0] for c in sut._outbox.add.call_args_list] == ['https://sqs/TodoAppDevTodoQueue'] * 3
+
+
+def test_sends_are_buffered_during_an_invocation(sut):
+    sut._execution_context.context = MagicMock()
+
+    sut.invoke(_async_command())
+    sut.dispatch(MessageFactory().event('todo.TodoCreated', {'id': 1}))
+
+    assert sut._outbox.add.call_count == 2
+    sut._outbox.flush.assert_not_called()
+
+
+def test_sends_are_flushed_immediately_outside_of_an_invocation(sut):
+    sut.dispatch(MessageFactory().event('todo.TodoCreated', {'id': 1}))
+
+    sut._outbox.flush.assert_called_once()
+    topic_arn, entry = sut._outbox.add.call_args[0]
+    assert topic_arn == 'arn:aws:sns:us-east-1:123:TodoAppDevTodoTopic'
+    assert entry['MessageAttributes']['_name']['StringValue'] == 'TodoCreated'
+
+
+def test_open_circuits_surface_as_message_bus_errors(sut):
+    sut._retry_policy = MagicMock(side_effect=CircuitOpen('Circuit for TodoAppDevTodoSync is open'))
+
+    with pytest.raises(ff.MessageBusError):
+        sut.request(MessageFactory().query('todo.GetTodos'))
+
+    target, _ = sut._retry_policy.call_args[0]
+    assert target == 'TodoAppDevTodoSync'
+    assert sut._retry_policy.call_args[1] == {'retry_timeouts': True}
+
+
+def test_kinesis_events_are_put_on_the_context_stream(sut):
+    sut._configuration = MagicMock(contexts={'firefly_aws': {'kinesis_events': {'todo.TodoCreated': 'todo_id'}}})
+
+    sut.dispatch(MessageFactory().event('todo.TodoCreated', {'todo_id': 'todo-1'}))
+    sut.dispatch(MessageFactory().event('todo.TodoDeleted', {'todo_id': 'todo-1'}))
+
+    (stream_arn, entry), (topic_arn, _) = [c[0] for c in sut._outbox.add.call_args_list]
+    assert stream_arn == 'arn:aws:kinesis:us-east-1:123:stream/TodoAppDevTodoEventStream'
+    assert entry == {'Data': b'{}', 'PartitionKey': 'todo-1'}
+    assert topic_arn == 'arn:aws:sns:us-east-1:123:TodoAppDevTodoTopic'
+
+
+def test_queued_messages_carry_their_attributes(sut):
+    sut.invoke(_async_command())
+
+    _, entry = sut._outbox.add.call_args[0]
+    assert {k: v['StringValue'] for k, v in entry['MessageAttributes'].items()} == \
+        {'_name': 'CreateTodo', '_type': 'command', '_context': 'todo'}
+
+
+def test_forwarded_messages_are_sent_as_received(sut):
+    message = _async_command()
+    setattr(message, '_memory', 1024)
+    setattr(message, '_raw_body', '{"PAYLOAD_KEY": "tmp/ab/abc.json.gz"}')
+    sut._store_large_payloads_in_s3 = MagicMock()
+
+    sut.invoke(message)
+
+    queue_url, entry = sut._outbox.add.call_args[0]
+    assert queue_url == 'https://sqs/TodoAppDevTodo1024Queue'
+    assert entry['MessageBody'] == '{"PAYLOAD_KEY": "tmp/ab/abc.json.gz"}'
+    sut._store_large_payloads_in_s3.assert_not_called()
+
+
+def _async_command():
+    ret = MessageFactory().command('todo.CreateTodo', {'name': 'x'})
+    setattr(ret, '_async', True)
+    return ret
+
+
+@pytest.fixture()
+def sut():
+    ret = BotoMessageTransport()
+    ret._project = 'todo-app'
+    ret._ff_environment = 'dev'
+    ret._region = 'us-east-1'
+    ret._account_id = '123'
+    ret._json_codec = MagicMock(encode=lambda message: b'{}')
+    ret._store_large_payloads_in_s3 = lambda payload, **kwargs: payload
+    ret._execution_context = ExecutionContext()
+    ret._outbox = MagicMock()
+    ret._sqs_client = MagicMock()
+    ret._sqs_client.get_queue_url.side_effect = lambda QueueName: {'QueueUrl': f'https://sqs/{QueueName}'}
+
+    return ret
@@ -0,0 +1,268 @@
+from unittest.mock import MagicMock
+
+import firefly as ff
+import pytest
+from botocore.exceptions import ClientError, ReadTimeoutError
+from firefly_aws.domain import ExecutionContext
+from firefly_aws.domain.service import kinesis_aggregation
+from firefly_aws.infrastructure import BotoOutbox
+
+STREAM = 'arn:aws:kinesis:us-east-1:123:stream/TodoAppDevTodoEventStream'
+
+
+def test_nothing_is_sent_until_flushed(sut):
+    sut.add('topic', _entry('a'))
+
+    sut._sns_client.publish_batch.assert_not_called()
+
+
+def test_entries_are_batched_per_topic(sut):
+    for i in range(23):
+        sut.add('topic-a', _entry(str(i)))
+    sut.add('topic-b', _entry('b'))
+
+    sut.flush()
+
+    calls = sut._sns_client.publish_batch.call_args_list
+    sizes = sorted((c[1]['TopicArn'], len(c[1]['PublishBatchRequestEntries'])) for c in calls)
+    assert sizes == [('topic-a', 3), ('topic-a', 10), ('topic-a', 10), ('topic-b', 1)]
+    assert [e['Message'] for e in calls[0][1]['PublishBatchRequestEntries']] == [str(i) for i in range(10)]
+
+
+def test_queue_sends_use_send_message_batch(sut):
+    sut._sqs_client.send_message_batch.return_value = {
+        'Successful': [{'Id': '0'}], 'Failed': [{'Id': '1', 'Code': 'InternalError', 'SenderFault': False}],
+    }
+    sut.add('https://sqs/queue', {'MessageBody': 'a'})
+    sut.add('https://sqs/queue', {'MessageBody': 'b'})
+
+    with pytest.raises(ff.MessageBusError):
+        sut.flush()
+
+    first, retry = sut._sqs_client.send_message_batch.call_args_list[:2]
+    assert first[1] == {'QueueUrl': 'https://sqs/queue', 'Entries': [
+        {'MessageBody': 'a', 'Id': '0'}, {'MessageBody': 'b', 'Id': '1'},
+    ]}
+    assert retry[1]['Entries'] == [{'MessageBody': 'b', 'Id': '1'}]
+    sut._sns_client.publish_batch.assert_not_called()
+
+
+def test_batches_respect_the_byte_limit(sut):
+    for i in range(3):
+        sut.add('topic', _entry('x' * 100_000))
+
+    sut.flush()
+
+    assert sut._sns_client.publish_batch.call_count == 2
+
+
+def test_outbox_flushes_when_full(sut):
+    sut._max_entries = 5
+
+    for i in range(5):
+        sut.add('topic', _entry(str(i)))
+
+    sut._sns_client.publish_batch.assert_called_once()
+
+
+def test_failed_entries_are_retried(sut):
+    sut._sns_client.publish_batch.side_effect = [
+        {'Successful': [{'Id': '0'}], 'Failed': [{'Id': '1', 'Code': 'InternalError', 'SenderFault': False}]},
+        {'Successful': [{'Id': '1'}], 'Failed': []},
+    ]
+    sut.add('topic', _entry('a'))
+    sut.add('topic', _entry('b'))
+
+    sut.flush()
+
+    retried = sut._sns_client.publish_batch.call_args_list[1][1]['PublishBatchRequestEntries']
+    assert [e['Message'] for e in retried] == ['b']
+
+
+def test_sender_faults_are_not_retried(sut):
+    sut._sns_client.publish_batch.return_value = {
+        'Successful': [], 'Failed': [{'Id': '0', 'Code': 'InvalidParameter', 'SenderFault': True}],
+    }
+    sut.add('topic', _entry('a'))
+
+    with pytest.raises(ff.MessageBusError):
+        sut.flush()
+    sut._sns_client.publish_batch.assert_called_once()
+
+
+def test_throttled_batches_are_retried(sut):
+    sut._sns_client.publish_batch.side_effect = [
+        ClientError({'Error': {'Code': 'Throttling'}}, 'PublishBatch'),
+        {'Successful': [{'Id': '0'}], 'Failed': []},
+    ]
+    sut.add('topic', _entry('a'))
+
+    sut.flush()
+
+    assert sut._sns_client.publish_batch.call_count == 2
+
+
+def test_permanent_batch_errors_are_not_retried(sut):
+    sut._sns_client.publish_batch.side_effect = ClientError({'Error': {'Code': 'AuthorizationError'}}, 'PublishBatch')
+    sut.add('topic', _entry('a'))
+
+    with pytest.raises(ff.MessageBusError, match='AuthorizationError'):
+        sut.flush()
+    sut._sns_client.publish_batch.assert_called_once()
+
+
+def test_connection_errors_are_retried(sut):
+    sut._sns_client.publish_batch.side_effect = [
+        ReadTimeoutError(endpoint_url='https://sns'),
+        {'Successful': [{'Id': '0'}], 'Failed': []},
+    ]
+    sut.add('topic', _entry('a'))
+
+    sut.flush()
+
+    assert sut._sns_client.publish_batch.call_count == 2
+
+
+def test_sender_faults_do_not_stop_the_other_retries(sut):
+    sut._sns_client.publish_batch.side_effect = [
+        {'Successful': [], 'Failed': [
+            {'Id': '0', 'Code': 'InvalidParameter', 'SenderFault': True},
+            {'Id': '1', 'Code': 'InternalError', 'SenderFault': False},
+        ]},
+        {'Successful': [{'Id': '1'}], 'Failed': []},
+    ]
+    sut.add('topic', _entry('a'))
+    sut.add('topic', _entry('b'))
+
+    with pytest.raises(ff.MessageBusError, match='Could not send 1 of 2'):
+        sut.flush()
+
+    retried = sut._sns_client.publish_batch.call_args_list[1][1]['PublishBatchRequestEntries']
+    assert [e['Message'] for e in retried] == ['b']
+
+
+def test_older_clients_publish_individually(sut):
+    sut._sns_client = MagicMock(spec=['publish'])
+    sut.add('topic', _entry('a'))
+    sut.add('topic', _entry('b'))
+
+    sut.flush()
+
+    assert [c[1]['Message'] for c in sut._sns_client.publish.call_args_list] == ['a', 'b']
+
+
+def test_stream_records_are_aggregated_per_shard(sut):
+    sut._shards = 4
+    for i in range(40):
+        sut.add(STREAM, {'Data': f'{{"i": {i}}}'.encode(), 'PartitionKey': f'todo-{i % 8}'})
+
+    sut.flush()
+
+    kwargs = sut._kinesis_client.put_records.call_args[1]
+    assert kwargs['StreamName'] == 'TodoAppDevTodoEventStream'
+    assert len(kwargs['Records']) <= 4
+    received = []
+    for record in kwargs['Records']:
+        bucket = int(record['ExplicitHashKey']) * 4 >> 128
+        records = kinesis_aggregation.deaggregate(record['Data'])
+        assert all(kinesis_aggregation.bucket(key, 4) == bucket for key, _ in records)
+        received.extend(records)
+    # Each partition key's records arrive in the order they were added.
+    for n in range(8):
+        assert [d for k, d in received if k == f'todo-{n}'] == [f'{{"i": {i}}}'.encode() for i in range(n, 40, 8)]
+    sut._sns_client.publish_batch.assert_not_called()
+
+
+def test_aggregated_records_are_capped_in_size(sut):
+    for i in range(5):
+        sut.add(STREAM, {'Data': b'x' * 20_000, 'PartitionKey': 'todo-1'})
+
+    sut.flush()
+
+    records = sut._kinesis_client.put_records.call_args[1]['Records']
+    assert [len(kinesis_aggregation.deaggregate(r['Data'])) for r in records] == [2, 2, 1]
+
+
+def test_failed_stream_records_are_retried(sut):
+    sut._kinesis_client.put_records.side_effect = [
+        {'FailedRecordCount': 1, 'Records': [{'ErrorCode': 'ProvisionedThroughputExceededException'}]},
+        {'FailedRecordCount': 0, 'Records': [{'SequenceNumber': '1', 'ShardId': 'shardId-000000000000'}]},
+    ]
+    sut.add(STREAM, {'Data': b'{}', 'PartitionKey': 'todo-1'})
+
+    sut.flush()
+
+    first, retry = sut._kinesis_client.put_records.call_args_list
+    assert first[1]['Records'] == retry[1]['Records']
+    assert 'Id' not in retry[1]['Records'][0]
+
+
+def test_stream_records_are_resent_from_the_first_failure(sut):
+    sut._kinesis_client.put_records.side_effect = [
+        {'FailedRecordCount': 1, 'Records': [
+            {'SequenceNumber': '1'}, {'ErrorCode': 'ProvisionedThroughputExceededException'}, {'SequenceNumber': '2'},
+        ]},
+        {'FailedRecordCount': 0, 'Records': [{'SequenceNumber': '3'}, {'SequenceNumber': '4'}]},
+    ]
+    sut._shards = 3
+    keys = _keys_per_bucket(3)
+    for key in keys:
+        sut.add(STREAM, {'Data': key.encode(), 'PartitionKey': key})
+
+    sut.flush()
+
+    first, retry = sut._kinesis_client.put_records.call_args_list
+    assert retry[1]['Records'] == first[1]['Records'][1:]
+
+
+def test_stream_batches_are_held_back_after_a_failure(sut):
+    sut._kinesis_client.put_records.side_effect = lambda StreamName, Records: {
+        'FailedRecordCount': 1, 'Records': [{'ErrorCode': 'InternalFailure'} for _ in Records],
+    }
+    sut._execution_context = MagicMock()
+    sut._execution_context.deadline.can_finish.return_value = False
+    sut._max_bytes = 100 * 1024 * 1024
+    # Over PutRecords' 5MB, so two calls are needed.
+    for i in range(7):
+        sut.add(STREAM, {'Data': b'x' * 800_000, 'PartitionKey': 'todo-1'})
+
+    with pytest.raises(ff.MessageBusError):
+        sut.flush()
+
+    sut._kinesis_client.put_records.assert_called_once()
+
+
+def _keys_per_bucket(shards: int):
+    ret = {}
+    i = 0
+    while len(ret) < shards:
+        ret.setdefault(kinesis_aggregation.bucket(f'todo-{i}', shards), f'todo-{i}')
+        i += 1
+    return [ret[bucket] for bucket in range(shards)]
+
+
+def _entry(message: str):
+    return {
+        'Message': message,
+        'MessageAttributes': {'_name': {'DataType': 'String', 'StringValue': 'TodoUpdated'}},
+    }
+
+
+@pytest.fixture()
+def sut():
+    BotoOutbox._configuration = MagicMock(contexts={'firefly_aws': {}})
+    try:
+        ret = BotoOutbox()
+    finally:
+        BotoOutbox._configuration = None
+    ret._sns_client = MagicMock()
+    ret._sns_client.publish_batch.return_value = {'Successful': [], 'Failed': []}
+    ret._sqs_client = MagicMock()
+    ret._kinesis_client = MagicMock()
+    ret._kinesis_client.put_records.side_effect = lambda StreamName, Records: {
+        'FailedRecordCount': 0, 'Records': [{'SequenceNumber': '1'} for _ in Records],
+    }
+    ret._execution_context = ExecutionContext()
+    ret._logger = MagicMock()
+
+    return ret
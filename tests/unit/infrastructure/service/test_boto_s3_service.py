@@ -0,0 +1,49 @@
+from unittest.mock import MagicMock
+
+import pytest
+from firefly_aws.infrastructure import BotoS3Service
+
+
+def test_small_payloads_are_returned_inline(sut):
+    assert sut.spool_download(iter(['[1', ', 2]']), max_inline_size=10) == ('[1, 2]', None)
+    sut._s3_client.create_multipart_upload.assert_not_called()
+
+
+def test_large_payloads_are_streamed_in_parts(sut):
+    chunks = ['x' * 3 for _ in range(5)]
+
+    body, url = sut.spool_download(iter(chunks), max_inline_size=4)
+    assert body is None
+    assert url == 'https://download'
+
+    uploaded = b''.join(c[1]['Body'] for c in sut._s3_client.upload_part.call_args_list)
+    assert uploaded == b'x' * 15
+    # Under the prefix the bucket's lifecycle rule expires.
+    assert sut._s3_client.create_multipart_upload.call_args[1]['Key'].startswith('tmp/')
+    assert sut._s3_client.complete_multipart_upload.call_args[1]['MultipartUpload'] == {'Parts': [
+        {'ETag': 'etag', 'PartNumber': 1},
+    ]}
+
+
+def test_multipart_upload_is_aborted_on_error(sut):
+    def chunks():
+        yield 'x' * 10
+        raise RuntimeError('serialization failed')
+
+    with pytest.raises(RuntimeError):
+        sut.spool_download(chunks(), max_inline_size=4)
+
+    sut._s3_client.abort_multipart_upload.assert_called_once()
+    sut._s3_client.complete_multipart_upload.assert_not_called()
+
+
+@pytest.fixture()
+def sut():
+    ret = BotoS3Service()
+    ret._bucket = 'bucket'
+    ret._s3_client = MagicMock()
+    ret._s3_client.create_multipart_upload.return_value = {'UploadId': 'upload'}
+    ret._s3_client.upload_part.return_value = {'ETag': 'etag'}
+    ret._s3_client.generate_presigned_url.return_value = 'https://download'
+
+    return ret
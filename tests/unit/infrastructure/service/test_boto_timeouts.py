@@ -0,0 +1,52 @@
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+from firefly_aws.domain import LambdaTimedOut
+from firefly_aws.infrastructure.service.boto_timeouts import with_read_timeout
+
+
+def _client():
+    return boto3.session.Session(
+        aws_access_key_id='key', aws_secret_access_key='secret', region_name='us-east-1'
+    ).client('lambda')
+
+
+def test_none_returns_the_client():
+    client = _client()
+
+    assert with_read_timeout(client, None) is client
+
+
+def test_clones_are_cached_per_step():
+    client = _client()
+
+    clone = with_read_timeout(client, 7.5)
+
+    assert clone is not client
+    assert with_read_timeout(client, 6) is clone
+    assert with_read_timeout(client, 12) is not clone
+    assert clone._endpoint.http_session._timeout.read_timeout == 5
+
+
+def test_the_clients_own_timeout_is_kept_when_it_fits():
+    client = _client()
+
+    assert with_read_timeout(client, 600) is client
+
+
+def test_calls_that_cannot_finish_are_not_started():
+    with pytest.raises(LambdaTimedOut):
+        with_read_timeout(_client(), .5)
+
+
+def test_clones_keep_the_clients_hooks_and_credentials():
+    client = _client()
+    clone = with_read_timeout(client, 30)
+    stubber = Stubber(client)
+    stubber.add_response('get_account_settings', {})
+
+    with stubber:
+        assert clone.get_account_settings() == {}
+    assert clone._request_signer is client._request_signer
+    assert client._endpoint.http_session._timeout.read_timeout == 60
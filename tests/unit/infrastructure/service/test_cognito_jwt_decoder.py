@@ -0,0 +1,19 @@
+import json
+
+from cognitojwt.jwt_sync import get_keys
+
+from firefly_aws.infrastructure.service.cognito_jwt_decoder import CognitoJwtDecoder
+
+
+def test_warm_up_caches_the_keys_decode_looks_up(tmp_path, monkeypatch):
+    keys = tmp_path / 'jwks.json'
+    keys.write_text(json.dumps({'keys': [{'kid': 'abc'}]}))
+    monkeypatch.setenv('AWS_COGNITO_JWKS_PATH', str(keys))
+    # Older cognitojwt releases read it under this misspelt name.
+    monkeypatch.setenv('AWS_COGNITO_JWSK_PATH', str(keys))
+    get_keys.cache_clear()
+
+    CognitoJwtDecoder().warm_up()
+
+    assert get_keys(str(keys)) == [{'kid': 'abc'}]
+    assert get_keys.cache_info().hits == 1
@@ -0,0 +1,34 @@
+from time import monotonic
+from unittest.mock import MagicMock, patch
+
+import pytest
+from botocore.exceptions import ClientError
+from firefly_aws.domain import Deadline, ExecutionContext
+from firefly_aws.infrastructure import DdbMutex
+
+
+def test_acquire(sut):
+    assert sut.acquire('key') is True
+
+
+@patch('firefly_aws.infrastructure.service.ddb_mutex.sleep')
+def test_acquire_gives_up_before_the_deadline(sleep, sut):
+    sut._ddb_client.put_item.side_effect = ClientError(
+        {'Error': {'Code': 'ConditionalCheckFailedException', 'Message': ''}}, 'PutItem'
+    )
+    sut._execution_context.deadline = Deadline(monotonic() + 0.5)
+
+    with pytest.raises(TimeoutError):
+        sut.acquire('key')
+
+    sleep.assert_not_called()
+
+
+@pytest.fixture()
+def sut():
+    ret = DdbMutex()
+    ret._ddb_client = MagicMock()
+    ret._ddb_table = 'table'
+    ret._execution_context = ExecutionContext()
+
+    return ret
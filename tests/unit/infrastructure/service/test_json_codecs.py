@@ -0,0 +1,57 @@
+from datetime import datetime
+
+import firefly as ff
+import pytest
+from firefly_aws.infrastructure import OrjsonCodec, StdlibJsonCodec
+
+
+class Point(ff.ValueObject):
+    x: int = ff.required()
+    at: datetime = ff.optional()
+
+
+DATA = {
+    'point': Point(x=1, at=datetime(2020, 1, 2, 3, 4, 5)),
+    'points': [Point(x=2)],
+    1: 'non-string key',
+    'big': 2 ** 70,
+    'text': 'ünïcode',
+}
+
+
+def test_codecs_agree(codec):
+    assert codec.encode(DATA) == StdlibJsonCodec().encode(DATA)
+
+
+def test_round_trip(codec):
+    assert codec.decode(codec.encode(DATA)) == {
+        'point': {'x': 1, 'at': '2020-01-02T03:04:05'},
+        'points': [{'x': 2, 'at': None}],
+        '1': 'non-string key',
+        'big': 2 ** 70,
+        'text': 'ünïcode',
+    }
+
+
+@pytest.mark.parametrize('data', ['{"a": 1}', b'{"a": 1}', bytearray(b'{"a": 1}'), memoryview(b'{"a": 1}')])
+def test_decode_accepts_text_and_bytes(codec, data):
+    assert codec.decode(data) == {'a': 1}
+
+
+def test_decoded_data_is_passed_through(codec):
+    data = {'a': 1}
+
+    assert codec.decode(data) is data
+
+
+def test_invalid_json(codec):
+    with pytest.raises(ff.InvalidArgument):
+        codec.decode(b'{not json')
+
+
+@pytest.fixture(params=['stdlib', 'orjson'])
+def codec(request):
+    if request.param == 'orjson':
+        pytest.importorskip('orjson')
+        return OrjsonCodec()
+    return StdlibJsonCodec()
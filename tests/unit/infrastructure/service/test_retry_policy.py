@@ -0,0 +1,160 @@
+from time import monotonic
+from unittest.mock import MagicMock, patch
+
+import pytest
+from botocore.exceptions import ClientError, EndpointConnectionError, ReadTimeoutError
+from firefly_aws.domain import CircuitOpen, Deadline, ExecutionContext
+from firefly_aws.infrastructure import DataApi, RetryPolicy
+from firefly_aws.infrastructure.service.retry_policy import CircuitBreaker
+
+THROTTLED = ClientError({'Error': {'Code': 'TooManyRequestsException'}}, 'Invoke')
+BAD_REQUEST = ClientError({'Error': {'Code': 'ValidationException'}}, 'Invoke')
+
+
+def test_transient_errors_are_retried(sut, sleep):
+    cb = MagicMock(side_effect=[THROTTLED, EndpointConnectionError(endpoint_url='x'), 'ok'])
+
+    assert sut('fn', cb) == 'ok'
+    assert cb.call_count == 3
+    assert sleep.call_count == 2
+
+
+def test_waits_use_full_jitter_on_an_exponential_ceiling(sut, sleep):
+    sut._random = MagicMock(uniform=MagicMock(return_value=0))
+    cb = MagicMock(side_effect=[THROTTLED, THROTTLED, THROTTLED, 'ok'])
+
+    sut('fn', cb)
+
+    assert [c[0] for c in sut._random.uniform.call_args_list] == [(0, .1), (0, .2), (0, .4)]
+
+
+def test_other_errors_are_raised_immediately(sut, sleep):
+    cb = MagicMock(side_effect=BAD_REQUEST)
+
+    with pytest.raises(ClientError):
+        sut('fn', cb)
+
+    cb.assert_called_once()
+    assert sut.breaker('fn').metrics()['failures'] == 0
+
+
+def test_aurora_resuming_is_transient():
+    assert RetryPolicy.is_transient(ClientError(
+        {'Error': {'Code': 'BadRequestException', 'Message': 'Communications link failure'}}, 'ExecuteStatement'
+    ))
+
+
+def test_retry_budget_limits_retries_across_calls(sut, sleep):
+    sut._targets.clear()
+    sut._budget_max = 2
+    sut._failure_threshold = 100
+    cb = MagicMock(side_effect=THROTTLED)
+
+    for _ in range(3):
+        with pytest.raises(ClientError):
+            sut('fn', cb)
+
+    assert sleep.call_count == 2
+    assert sut.metrics()['fn']['retries_denied'] == 3
+
+
+def test_retries_stop_at_the_deadline(sut, sleep):
+    sut._random = MagicMock(uniform=MagicMock(return_value=.1))
+    sut._execution_context.deadline = Deadline(monotonic() + .05)
+
+    with pytest.raises(ClientError):
+        sut('fn', MagicMock(side_effect=THROTTLED))
+
+    sleep.assert_not_called()
+
+
+def test_breaker_opens_and_rejects_calls(sut, sleep):
+    cb = MagicMock(side_effect=THROTTLED)
+    with pytest.raises(ClientError):
+        sut('fn', cb)
+
+    with pytest.raises(CircuitOpen):
+        sut('fn', cb)
+
+    assert cb.call_count == 5
+    assert sut.metrics()['fn']['state'] == CircuitBreaker.OPEN
+    assert sut.metrics()['fn']['rejected'] == 1
+    assert sut('other', lambda: 'ok') == 'ok'
+
+
+def test_half_open_probe_closes_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=0)
+    breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.allow() is True
+    assert breaker.allow() is False
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.metrics()['opened'] == 1
+
+
+def test_failed_probe_reopens_the_breaker():
+    breaker = CircuitBreaker(failure_threshold=1, reset_timeout=60)
+    breaker.record_failure()
+    breaker._opened_at -= 60
+
+    assert breaker.allow() is True
+    breaker.record_failure()
+
+    assert breaker.allow() is False
+    assert breaker.metrics()['opened'] == 2
+
+
+def test_timeouts_are_not_retried_for_unsafe_calls(sut, sleep):
+    cb = MagicMock(side_effect=ReadTimeoutError(endpoint_url='x'))
+
+    with pytest.raises(ReadTimeoutError):
+        sut('fn', cb, retry_timeouts=False)
+
+    cb.assert_called_once()
+    assert sut.breaker('fn').metrics()['failures'] == 1
+
+
+def test_statement_timeouts_are_only_retried_for_safe_calls(sut, sleep):
+    timeout = ClientError({'Error': {'Code': 'StatementTimeoutException'}}, 'ExecuteStatement')
+    cb = MagicMock(side_effect=timeout)
+
+    with pytest.raises(ClientError):
+        sut('db', cb, retry_timeouts=False)
+    cb.assert_called_once()
+
+    cb = MagicMock(side_effect=[timeout, 'ok'])
+    assert sut('db', cb) == 'ok'
+
+
+def test_data_api_only_retries_reads_after_a_timeout():
+    data_api = DataApi('arn', 'secret', 'db')
+    data_api._rds_data_client = MagicMock()
+    data_api._retry_policy = MagicMock()
+    data_api._logger = MagicMock()
+
+    data_api.execute('  select * from todos')
+    data_api.execute('UPDATE todos SET done = true')
+
+    assert [c[1]['retry_timeouts'] for c in data_api._retry_policy.call_args_list] == [True, False]
+
+
+@pytest.fixture()
+def sleep():
+    with patch('firefly_aws.infrastructure.service.retry_policy.sleep') as ret:
+        yield ret
+
+
+@pytest.fixture()
+def sut():
+    RetryPolicy._configuration = MagicMock(contexts={'firefly_aws': {}})
+    try:
+        ret = RetryPolicy()
+    finally:
+        RetryPolicy._configuration = None
+    ret._execution_context = ExecutionContext()
+    ret._logger = MagicMock()
+
+    return ret
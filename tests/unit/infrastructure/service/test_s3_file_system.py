@@ -0,0 +1,31 @@
+import io
+from unittest.mock import MagicMock
+
+import firefly as ff
+import pytest
+from firefly_aws.infrastructure import S3FileSystem
+
+
+def test_write_bytes(sut):
+    sut.write(ff.File(name='a.txt', content=b'abc', content_type='text/plain'), 'bucket/path')
+
+    sut._s3_client.put_object.assert_called_once_with(
+        Bucket='bucket', Key='path/a.txt', Body=b'abc', ContentType='text/plain'
+    )
+
+
+def test_write_streams_file_objects(sut):
+    content = io.BytesIO(b'abc')
+
+    sut.write(ff.File(name='a.txt', content=content), 'bucket/path')
+
+    sut._s3_client.upload_fileobj.assert_called_once_with(content, 'bucket', 'path/a.txt', ExtraArgs={})
+    sut._s3_client.put_object.assert_not_called()
+
+
+@pytest.fixture()
+def sut():
+    ret = S3FileSystem()
+    ret._s3_client = MagicMock()
+
+    return ret
@@ -0,0 +1,93 @@
+import firefly as ff
+import pytest
+from firefly_aws.infrastructure import TrieRestRouter
+from firefly_aws.infrastructure.service.trie_rest_router import _segment_local
+
+
+def test_static_routes_win_over_placeholders(sut):
+    endpoint, params = sut.match('/todo/todos/new', 'GET')
+
+    assert endpoint.message == 'todo.NewTodo'
+    assert params == {}
+
+
+def test_placeholders_are_captured(sut):
+    endpoint, params = sut.match('/todo/todos/abc', 'get')
+
+    assert endpoint.message == 'todo.GetTodo'
+    assert params == {'id': 'abc'}
+
+
+def test_placeholder_requirements(sut):
+    endpoint, params = sut.match('/todo/pages/12', 'get')
+    assert params == {'number': '12'}
+
+    assert sut.match('/todo/pages/twelve', 'get') == (None, None)
+
+
+def test_method_must_match(sut):
+    endpoint, _ = sut.match('/todo/todos/abc', 'delete')
+    assert endpoint.message == 'todo.DeleteTodo'
+
+    assert sut.match('/todo/todos/abc', 'patch') == (None, None)
+
+
+def test_cached_params_are_not_shared(sut):
+    _, params = sut.match('/todo/todos/abc', 'get')
+    params['foo'] = 'bar'
+
+    assert sut.match('/todo/todos/abc', 'get')[1] == {'id': 'abc'}
+
+
+def test_lookup_precomputes_endpoint_metadata(sut):
+    indexed_route, _ = sut.lookup('/todo/todos/abc', 'get')
+
+    assert indexed_route.message_name == 'todo.GetTodo'
+    assert indexed_route.secured is False
+    assert indexed_route.scopes == ['todo.read']
+
+
+def test_unsupported_routes_fall_back_to_routes(sut):
+    sut.register('/todo/files/{name}.{ext}', ff.HttpEndpoint(route='/files/{name}.{ext}', message='todo.GetFile'))
+
+    endpoint, params = sut.match('/todo/files/report.csv', 'get')
+
+    assert endpoint.message == 'todo.GetFile'
+    assert params == {'name': 'report', 'ext': 'csv'}
+
+
+def test_requirements_spanning_segments_fall_back_to_routes(sut):
+    sut.register('/todo/docs/{path:[a-z/]+}', ff.HttpEndpoint(route='/docs/{path:[a-z/]+}', message='todo.GetDoc'))
+    sut.register('/todo/raw/{path:.*}', ff.HttpEndpoint(route='/raw/{path:.*}', message='todo.GetRaw'))
+
+    endpoint, params = sut.match('/todo/docs/guides/setup', 'get')
+    assert endpoint.message == 'todo.GetDoc'
+    assert params == {'path': 'guides/setup'}
+
+    endpoint, params = sut.match('/todo/raw/a/b.txt', 'get')
+    assert endpoint.message == 'todo.GetRaw'
+    assert params == {'path': 'a/b.txt'}
+
+
+@pytest.mark.parametrize('requirement, local', [
+    (r'\d+', True), ('[a-z0-9_-]+', True), ('yes|no', True), ('[^/]+', True),
+    ('.*', False), ('[a-z/]+', False), (r'\S+', False), ('[^a]+', False), ('(', False),
+])
+def test_segment_local_requirements(requirement, local):
+    assert _segment_local(requirement) is local
+
+
+@pytest.fixture()
+def sut():
+    ret = TrieRestRouter()
+    for route, method, message in (
+        ('/todo/todos/{id}', 'GET', 'todo.GetTodo'),
+        ('/todo/todos/{id}', 'DELETE', 'todo.DeleteTodo'),
+        ('/todo/todos/new', 'GET', 'todo.NewTodo'),
+        ('/todo/pages/{number:\\d+}', 'GET', 'todo.GetPage'),
+    ):
+        ret.register(route, ff.HttpEndpoint(
+            route=route, method=method, message=message, secured=False, scopes=['todo.read']
+        ))
+
+    return ret
@@ -0,0 +1,149 @@
+import json
+import subprocess
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+from botocore.exceptions import ClientError
+from firefly.domain.service.messaging.message_factory import MessageFactory
+from firefly_aws.domain import ExecutionContext
+from firefly_aws.infrastructure import BotoMessageTransport, BotoOutbox, StdlibJsonCodec
+from firefly_aws.testing import InMemoryAws
+from firefly_aws.testing.in_memory_aws import matches_filter_policy
+
+
+def test_infrastructure_does_not_load_the_fake():
+    code = 'import sys, firefly_aws.infrastructure; print("firefly_aws.testing" in sys.modules)'
+
+    assert subprocess.check_output([sys.executable, '-c', code]).strip() == b'False'
+
+
+def test_published_events_reach_subscribed_queues_only(aws, transport):
+    handler = MagicMock(return_value={'batchItemFailures': []})
+    aws.deploy_context('billing', async_handler=handler, subscriptions={'todo': ['TodoCreated']})
+
+    transport.dispatch(MessageFactory().event('todo.TodoCreated', {'id': 1}))
+    transport.dispatch(MessageFactory().event('todo.TodoDeleted', {'id': 1}))
+    aws.lambda_.drain(timeout=1)
+
+    event, context = handler.call_args[0]
+    record = event['Records'][0]
+    assert handler.call_count == 1
+    assert record['eventSource'] == 'aws:sqs'
+    assert json.loads(json.loads(record['body'])['Message'])['_name'] == 'TodoCreated'
+    assert context.function_name == 'TodoAppDevBillingAsync'
+
+
+def test_failed_records_are_redelivered_then_dead_lettered(aws, transport, clock):
+    attempts = []
+
+    def handler(event, context):
+        attempts.append(event['Records'][0]['attributes']['ApproximateReceiveCount'])
+        return {'batchItemFailures': [{'itemIdentifier': event['Records'][0]['messageId']}]}
+
+    url = aws.deploy_context('todo', async_handler=handler, visibility_timeout=30, max_receive_count=2)
+    transport.invoke(_async_command())
+
+    aws.lambda_.poll()
+    assert aws.lambda_.poll() == 0
+    clock.now += 30
+    aws.lambda_.poll()
+    clock.now += 30
+    aws.lambda_.poll()
+
+    assert attempts == ['1', '2']
+    assert aws.sqs.depth(url) == {'visible': 0, 'in_flight': 0}
+    assert aws.sqs.depth(f'{url}Dlq')['visible'] == 1
+
+
+def test_sync_invokes_run_the_function(aws, transport):
+    aws.deploy_context('todo', sync_handler=lambda event, context: {'name': event['name'].upper()})
+
+    response = aws.lambda_.invoke(FunctionName='TodoAppDevTodoSync', Payload=json.dumps({'name': 'x'}))
+
+    assert json.loads(response['Payload'].read()) == {'name': 'X'}
+
+
+def test_injected_failures_fail_batch_entries_individually():
+    aws = InMemoryAws(failure_rate=.5, seed=1)
+    aws.sqs.faults.operations = {'SendMessageBatchEntry'}
+    url = aws.sqs.create_queue(QueueName='queue')['QueueUrl']
+
+    response = aws.sqs.send_message_batch(QueueUrl=url, Entries=[
+        {'Id': str(i), 'MessageBody': 'x'} for i in range(10)
+    ])
+
+    assert response['Failed'] and response['Successful']
+    assert aws.sqs.depth(url)['visible'] == len(response['Successful'])
+
+
+def test_injected_failures_raise_client_errors():
+    aws = InMemoryAws(failure_rate=1)
+
+    with pytest.raises(ClientError):
+        aws.sns.publish(TopicArn='arn', Message='x')
+
+
+@pytest.mark.parametrize('policy, attributes, expected', [
+    ({'_name': ['A', 'B']}, {'_name': 'B'}, True),
+    ({'_name': ['A']}, {'_name': 'B'}, False),
+    ({'_name': ['A'], '_type': ['event']}, {'_name': 'A'}, False),
+    ({'_name': [{'prefix': 'Todo'}]}, {'_name': 'TodoCreated'}, True),
+    ({'_name': [{'anything-but': ['A']}]}, {'_name': 'B'}, True),
+    ({'_name': [{'exists': False}]}, {}, True),
+    ({'size': [{'numeric': ['>', 1, '<=', 5]}]}, {'size': '5'}, True),
+])
+def test_filter_policies(policy, attributes, expected):
+    attributes = {k: {'DataType': 'String', 'StringValue': v} for k, v in attributes.items()}
+
+    assert matches_filter_policy(policy, attributes) is expected
+
+
+def _async_command():
+    ret = MessageFactory().command('todo.CreateTodo', {'name': 'x'})
+    setattr(ret, '_async', True)
+    return ret
+
+
+class Clock:
+    now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture()
+def clock():
+    return Clock()
+
+
+@pytest.fixture()
+def aws(clock):
+    return InMemoryAws(project='todo-app', ff_environment='dev', region='us-east-1', account_id='123', clock=clock)
+
+
+@pytest.fixture()
+def transport(aws):
+    BotoOutbox._configuration = MagicMock(contexts={'firefly_aws': {}})
+    try:
+        outbox = BotoOutbox()
+    finally:
+        BotoOutbox._configuration = None
+    outbox._sns_client = aws.sns
+    outbox._sqs_client = aws.sqs
+    outbox._logger = MagicMock()
+
+    ret = BotoMessageTransport()
+    ret._project = 'todo-app'
+    ret._ff_environment = 'dev'
+    ret._region = 'us-east-1'
+    ret._account_id = '123'
+    ret._json_codec = StdlibJsonCodec()
+    ret._store_large_payloads_in_s3 = lambda payload, **kwargs: payload
+    ret._execution_context = outbox._execution_context = ExecutionContext()
+    ret._outbox = outbox
+    ret._sns_client = aws.sns
+    ret._sqs_client = aws.sqs
+    ret._lambda_client = aws.lambda_
+
+    return ret